@@ -0,0 +1,46 @@
+"""Memory footprint and attribute access cost of the entities.
+
+Measures the Artifact class of the pyclarity_lims found on the python path. To compare two versions, run it from
+checkouts of both, for example:
+
+    git worktree add /tmp/before <commit>
+    PYTHONPATH=/tmp/before python benchmarks/entity_memory.py
+    PYTHONPATH=. python benchmarks/entity_memory.py
+
+The first argument is the number of artifacts created (100000 by default).
+"""
+import sys
+import timeit
+import tracemalloc
+
+from pyclarity_lims.entities import Artifact
+from pyclarity_lims.lims import Lims
+
+
+def access_cost(instances, attribute, repeat=5):
+    def access():
+        for instance in instances:
+            getattr(instance, attribute)
+    return min(timeit.repeat(access, number=1, repeat=repeat)) / len(instances) * 1e9
+
+
+def main(n):
+    lims = Lims('http://testgenologics.com:4040', username='test', password='password')
+    # The uris are created beforehand so that they are not counted
+    uris = ['http://testgenologics.com:4040/api/v2/artifacts/2-%s?state=%s' % (i, i) for i in range(n)]
+    tracemalloc.start()
+    start = tracemalloc.get_traced_memory()[0]
+    instances = [Artifact(lims, uri=uri) for uri in uris]
+    created = tracemalloc.get_traced_memory()[0] - start
+    for instance in instances:
+        instance.id, instance.state
+    accessed = tracemalloc.get_traced_memory()[0] - start
+    tracemalloc.stop()
+    print('%.0f bytes per entity once created (including the cache entry)' % (created / float(n)))
+    print('%.0f bytes per entity once id and state were accessed' % (accessed / float(n)))
+    print('%.0f ns per id access' % access_cost(instances, 'id'))
+    print('%.0f ns per state access' % access_cost(instances, 'state'))
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000)
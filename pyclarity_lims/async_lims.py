@@ -0,0 +1,318 @@
+"""Asyncio interface to the LIMS.
+
+The queries of aget, aput, apost, aget_batch, aput_batch and Entity.aget are sent natively with an httpx client
+when httpx is installed (pip install pyclarity_lims[async]). The other coroutines, and all of them without httpx,
+run the blocking methods in a pool of threads.
+
+This module requires python 3.5 or later.
+"""
+
+import asyncio
+import functools
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree import ElementTree
+
+import requests
+
+from pyclarity_lims.lims import (Lims, BatchChunkResult, BatchError, MissingInstancesError, _BatchRetrieval,
+                                 _updated_instances)
+
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+EXECUTOR_WORKERS = 100
+
+
+def _async_version(name):
+    """Create a coroutine calling the synchronous method `name` of the Lims in the executor."""
+    async def method(self, *args, **kwargs):
+        return await self._run(getattr(self, name), *args, **kwargs)
+    method.__name__ = 'a' + name
+    method.__doc__ = 'Coroutine version of :py:meth:`Lims.%s <pyclarity_lims.lims.Lims.%s>`' % (name, name)
+    return method
+
+
+def _native_version(name):
+    """Decorate a coroutine sending its queries with the httpx client, so that it calls the synchronous method
+    `name` in the executor when the AsyncLims has no client."""
+    def decorator(coroutine):
+        @functools.wraps(coroutine)
+        async def method(self, *args, **kwargs):
+            if self.async_client is None:
+                return await self._run(getattr(self, name), *args, **kwargs)
+            return await coroutine(self, *args, **kwargs)
+        method.__doc__ = 'Coroutine version of :py:meth:`Lims.%s <pyclarity_lims.lims.Lims.%s>`' % (name, name)
+        return method
+    return decorator
+
+
+def _requests_error(error):
+    """Convert an httpx error to the requests exception raised by the synchronous methods."""
+    if isinstance(error, httpx.ConnectTimeout):
+        cls = requests.exceptions.ConnectTimeout
+    elif isinstance(error, httpx.TimeoutException):
+        cls = requests.exceptions.Timeout
+    elif isinstance(error, httpx.TransportError):
+        cls = requests.exceptions.ConnectionError
+    else:
+        cls = requests.exceptions.RequestException
+    return cls(str(error) or repr(error))
+
+
+def _await_flight(future):
+    """Await the future of a query in flight without cancelling it for the other waiters if the caller is cancelled."""
+    return asyncio.shield(asyncio.wrap_future(future))
+
+
+class _Response(object):
+    """The attributes of a requests response read by the Lims, taken from an httpx response."""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.content
+        self.url = str(response.url)
+
+    def raise_for_status(self):
+        if 400 <= self.status_code < 600:
+            raise requests.exceptions.HTTPError('%s Error for url: %s' % (self.status_code, self.url), response=self)
+
+
+class AsyncLims(Lims):
+    """
+    LIMS interface providing coroutine versions of the :py:class:`Lims <pyclarity_lims.lims.Lims>` methods that can
+    be awaited from an event loop.
+
+    The coroutines have the same name as their synchronous counterpart prefixed with 'a' (aget, apost, aget_batch,
+    aget_artifacts, ...). When httpx is installed, aget, aput, apost, aget_batch, aput_batch and
+    :py:meth:`Entity.aget <pyclarity_lims.entities.Entity.aget>` send their queries with an httpx.AsyncClient
+    without blocking a thread. They share the caches, the queries in flight and the request listeners of the Lims.
+    The other coroutines (searches, files and routing) are thread-offloading wrappers: they run the blocking method
+    in a pool of threads sharing the connection pools of the request session, so the number of them in progress at
+    once is limited by executor_workers. Without httpx every coroutine runs in the pool of threads.
+    Entities attached to an AsyncLims behave as usual.
+
+    :param async_client: The httpx.AsyncClient sending the native queries. By default one is created when httpx is
+                         installed and closed by :py:meth:`aclose`. Pass False to run every coroutine in the pool of
+                         threads. The client does not use the settings of the request session, such as its
+                         certificates: pass a configured client if needed.
+    :param executor_workers: The number of threads running the blocking methods.
+    :param kwargs: The other arguments of :py:class:`Lims <pyclarity_lims.lims.Lims>` such as cache, batch_size or
+                   max_workers (the number of queries in flight at once within a batch or parallel call).
+
+    Example: ::
+
+        lims = AsyncLims('https://claritylims.example.com', 'username' , 'Pa55w0rd')
+        artifacts = await lims.aget_artifacts(containername='plate1')
+        await asyncio.gather(*[a.aget() for a in artifacts])
+        await lims.aclose()
+
+    """
+
+    def __init__(self, baseuri, username, password, async_client=None, executor_workers=EXECUTOR_WORKERS,
+                 **kwargs):
+        super(AsyncLims, self).__init__(baseuri, username, password, **kwargs)
+        self.executor = ThreadPoolExecutor(max_workers=executor_workers)
+        self._owns_client = async_client is None and httpx is not None
+        if self._owns_client:
+            # Like the request session, no timeout unless the query sets one
+            async_client = httpx.AsyncClient(timeout=None)
+        self.async_client = async_client or None
+
+    def _run(self, func, *args, **kwargs):
+        """Run the blocking function in the executor and return an awaitable of its result."""
+        loop = asyncio.get_event_loop()
+        return loop.run_in_executor(self.executor, functools.partial(func, *args, **kwargs))
+
+    async def _arequest(self, method, uri, parse=None, **kwargs):
+        """
+        Coroutine version of :py:meth:`Lims._request <pyclarity_lims.lims.Lims._request>` sending the request with
+        the httpx client. The response passed to parse is converted to the attributes of a requests response and
+        the httpx errors to requests exceptions.
+        """
+        kwargs.setdefault('auth', (self.username, self.password))
+        data = kwargs.pop('data', None)
+        start = time.time()
+        try:
+            r = _Response(await self.async_client.request(method.upper(), uri, content=data, **kwargs))
+        except httpx.HTTPError as e:
+            # Timeouts and connection errors are reported to the listeners without response
+            error = _requests_error(e)
+            self._notify_request(method, uri, data, start, time.time() - start, error=error)
+            if isinstance(error, requests.exceptions.ConnectionError):
+                raise type(error)("{0}, Error trying to reach {1}".format(error, uri)) from e
+            raise error from e
+        latency = time.time() - start
+        if parse is None:
+            self._notify_request(method, uri, data, start, latency, r)
+            return r
+        try:
+            return parse(r)
+        finally:
+            self._notify_request(method, uri, data, start, latency, r, time.time() - start - latency)
+
+    @_native_version('get')
+    async def aget(self, uri, params=dict()):
+        if params:
+            return await self._aget(uri, params)
+        started, pending = self._start_flights([uri])
+        if pending:
+            return await _await_flight(pending[uri])
+        future = started[uri]
+        try:
+            root = await self._aget(uri)
+        except BaseException as e:
+            # Also on cancellation, so that the uri is not left in flight forever
+            self._end_flight(uri, future, error=e)
+            raise
+        self._end_flight(uri, future, root)
+        return root
+
+    async def _aget(self, uri, params=dict()):
+        root = None if params else self._get_cached(uri)
+        if root is None:
+            r, root = await self._arequest('get', uri, **self._get_query(uri, params))
+            if not params:
+                self._cache_response(uri, r, root)
+        return root
+
+    @_native_version('put')
+    async def aput(self, uri, data, params=dict()):
+        self._forget(uri)
+        return await self._arequest('put', uri, data=data, params=params,
+                                    headers={'content-type': 'application/xml',
+                                             'accept': 'application/xml'},
+                                    parse=self.parse_response)
+
+    @_native_version('post')
+    async def apost(self, uri, data, params=dict()):
+        return await self._arequest('post', uri, data=data, params=params,
+                                    headers={'content-type': 'application/xml',
+                                             'accept': 'application/xml'},
+                                    parse=lambda r: self.parse_response(r, accept_status_codes=[200, 201, 202]))
+
+    async def _aget_entity(self, entity, force=False):
+        if not force and entity.root is not None:
+            return
+        entity.root = await self.aget(entity.uri)
+
+    async def _aput_entity(self, entity):
+        await self.aput(entity.uri, self.tostring(ElementTree.ElementTree(entity.root)))
+        entity._saved()
+
+    async def _amap_chunks(self, coroutine, chunks):
+        """
+        Coroutine version of :py:meth:`Lims._map_chunks <pyclarity_lims.lims.Lims._map_chunks>` running up to
+        max_workers chunks at once.
+        """
+        semaphore = asyncio.Semaphore(max(self.max_workers, 1))
+
+        async def run_chunk(chunk):
+            async with semaphore:
+                try:
+                    await coroutine(chunk)
+                except Exception as e:
+                    return BatchChunkResult(chunk, e)
+            return BatchChunkResult(chunk, None)
+
+        return list(await asyncio.gather(*[run_chunk(chunk) for chunk in chunks]))
+
+    @_native_version('get_batch')
+    async def aget_batch(self, instances, force=False, batch_size=None):
+        if not instances:
+            return []
+        batch = _BatchRetrieval(self, instances, force, batch_size)
+
+        async def retrieve_chunk(chunk):
+            if not chunk[0]._BATCH:
+                for instance in chunk:
+                    await instance.aget(force=True)
+                return
+            try:
+                uri, data = batch.request(chunk)
+                retrieved = batch.assign(chunk, await self.apost(uri, data))
+            except BaseException as e:
+                batch.fail(chunk, e)
+                raise
+            batch.complete(chunk, retrieved)
+
+        try:
+            results = await self._amap_chunks(retrieve_chunk, batch.chunks)
+        except BaseException as e:
+            batch.release(e)
+            raise
+        awaited = []
+        for instance, future in batch.waiting:
+            try:
+                awaited.append((instance, await _await_flight(future)))
+            except Exception as e:
+                awaited.append((instance, e))
+        return batch.finish(results, awaited)
+
+    @_native_version('put_batch')
+    async def aput_batch(self, instances, batch_size=None, refresh=False):
+        if not instances:
+            return []
+
+        async def update_chunk(chunk):
+            if not chunk[0]._BATCH:
+                for instance in chunk:
+                    await self._aput_entity(instance)
+                return
+            uri, data = self._batch_update_request(chunk)
+            missing = self._batch_updated(chunk, await self.apost(uri, data))
+            if missing:
+                raise MissingInstancesError(missing)
+
+        async def refresh_chunk(result):
+            updated = _updated_instances(result)
+            if not updated:
+                return result
+            try:
+                await self.aget_batch(updated, force=True, batch_size=len(updated))
+            except Exception as e:
+                return result._replace(refresh_error=e)
+            return result
+
+        results = await self._amap_chunks(update_chunk, self._update_chunks(instances, batch_size))
+        if refresh:
+            results = list(await asyncio.gather(*[refresh_chunk(r) for r in results]))
+        if any(r.error is not None or r.refresh_error is not None for r in results):
+            raise BatchError(results)
+        return results
+
+    def close(self):
+        """Wait for the pending requests and release the threads of the executor.
+        The httpx client created by the AsyncLims is closed by :py:meth:`aclose`."""
+        self.executor.shutdown(wait=True)
+        super(AsyncLims, self).close()
+
+    async def aclose(self):
+        """Close the httpx client created by the AsyncLims and release the threads of the executor."""
+        if self._owns_client:
+            await self.async_client.aclose()
+        self.close()
+
+    aget_file_contents = _async_version('get_file_contents')
+    aupload_new_file = _async_version('upload_new_file')
+    aroute_artifacts = _async_version('route_artifacts')
+
+    aget_udfs = _async_version('get_udfs')
+    aget_reagent_types = _async_version('get_reagent_types')
+    aget_labs = _async_version('get_labs')
+    aget_researchers = _async_version('get_researchers')
+    aget_projects = _async_version('get_projects')
+    aget_sample_number = _async_version('get_sample_number')
+    aget_samples = _async_version('get_samples')
+    aget_artifacts = _async_version('get_artifacts')
+    aget_containers = _async_version('get_containers')
+    aget_container_types = _async_version('get_container_types')
+    aget_processes = _async_version('get_processes')
+    aget_workflows = _async_version('get_workflows')
+    aget_process_types = _async_version('get_process_types')
+    aget_protocols = _async_version('get_protocols')
+    aget_reagent_kits = _async_version('get_reagent_kits')
+    aget_reagent_lots = _async_version('get_reagent_lots')
@@ -0,0 +1,296 @@
+"""Caches used by the LIMS interface to keep track of the Entity instances."""
+
+import re
+import sqlite3
+import threading
+import time
+import weakref
+from collections import OrderedDict
+from contextlib import closing
+
+from pyclarity_lims.entities import Processtype, Containertype, Protocol, Workflow, Researcher, Udfconfig
+
+# Time to live in seconds of the configuration entities that rarely change
+DEFAULT_TTLS = {
+    Processtype: 3600,
+    Containertype: 3600,
+    Protocol: 3600,
+    Workflow: 3600,
+    Researcher: 3600,
+    Udfconfig: 3600,
+}
+
+# Approximate memory used by an ElementTree element without its text and attributes
+ELEMENT_SIZE = 200
+
+
+def estimate_size(root):
+    """Return an approximation of the memory used by an ElementTree root in bytes."""
+    if root is None:
+        return 0
+    size = 0
+    for element in root.iter():
+        size += ELEMENT_SIZE + len(element.text or '')
+        for key, value in element.attrib.items():
+            size += len(key) + len(value)
+    return size
+
+
+class EntityCache(object):
+    """
+    Cache of :py:class:`Entity <pyclarity_lims.entities.Entity>` instances keyed by uri that can replace the
+    dictionary used by default in :py:class:`Lims <pyclarity_lims.lims.Lims>`.
+
+    The least recently used instances are evicted when there are more than max_entries instances or when the
+    approximate size of their XML exceeds max_bytes. Evicting an instance drops its XML so it will be retrieved again
+    when accessed, but the instance stays accessible through the cache as long as it is referenced elsewhere
+    so there is never two instances for the same uri. The cache can be used from several threads.
+
+    Instances whose XML has not been retrieved are only kept while referenced elsewhere and do not count as entries.
+    Instances modified through their descriptors are not evicted until they are saved with put() or post() or
+    their XML is retrieved again, and instances are not evicted while a descriptor reads or modifies them so the
+    cache can be shared by several threads. Modifications made directly on the root element are not tracked and are lost
+    if the instance is evicted before being saved.
+
+    :param max_entries: The maximum number of instances with their XML kept in the cache. Unlimited if None.
+    :param max_bytes: The approximate maximum size of the XML kept in the cache. Unlimited if None.
+
+    Example: ::
+
+        lims = Lims('https://claritylims.example.com', 'username' , 'Pa55w0rd',
+                    cache=EntityCache(max_entries=100000, max_bytes=2 * 1024 ** 3))
+
+    """
+
+    def __init__(self, max_entries=None, max_bytes=None):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._sizes = {}
+        self._evicted = weakref.WeakValueDictionary()
+        # uris of the instances with unsaved modifications
+        self._modified = set()
+        # uri -> number of descriptor accesses in progress
+        self._pins = {}
+        self.total_bytes = 0
+        # Reentrant because evicting an instance resizes it
+        self._lock = threading.RLock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __getitem__(self, uri):
+        with self._lock:
+            entity = self._entries.pop(uri, None)
+            if entity is None:
+                entity = self._evicted.get(uri)
+                if entity is None:
+                    self.misses += 1
+                    raise KeyError(uri)
+                # Stays weakly referenced until its XML is retrieved
+                self.hits += 1
+                return entity
+            self._entries[uri] = entity
+            self.hits += 1
+            return entity
+
+    def __setitem__(self, uri, entity):
+        with self._lock:
+            self._remove(uri)
+            if entity.root is None:
+                self._evicted[uri] = entity
+                return
+            self._entries[uri] = entity
+            self._sizes[uri] = estimate_size(entity.root)
+            self.total_bytes += self._sizes[uri]
+            self._evict()
+
+    def __delitem__(self, uri):
+        with self._lock:
+            if uri not in self:
+                raise KeyError(uri)
+            self._remove(uri)
+
+    def __contains__(self, uri):
+        return uri in self._entries or uri in self._evicted
+
+    def __len__(self):
+        return len(self._entries) + len(self._evicted)
+
+    def __iter__(self):
+        with self._lock:
+            return iter(list(self._entries) + list(self._evicted.keys()))
+
+    def get(self, uri, default=None):
+        try:
+            return self[uri]
+        except KeyError:
+            return default
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._sizes.clear()
+            self._evicted.clear()
+            self._modified.clear()
+            self.total_bytes = 0
+
+    def resize(self, entity):
+        """Update the size of the XML of an instance after its root changed and mark it as recently used."""
+        with self._lock:
+            uri = entity.uri
+            if self._entries.get(uri) is entity:
+                # The new root replaces any modification
+                self._modified.discard(uri)
+                del self._entries[uri]
+                if entity.root is None:
+                    self.total_bytes -= self._sizes.pop(uri)
+                    self._evicted[uri] = entity
+                    return
+            elif entity.root is not None and self._evicted.get(uri) is entity:
+                # An evicted instance is being used again
+                del self._evicted[uri]
+                self._sizes[uri] = 0
+            else:
+                return
+            self._entries[uri] = entity
+            size = estimate_size(entity.root)
+            self.total_bytes += size - self._sizes[uri]
+            self._sizes[uri] = size
+            self._evict()
+
+    def mark_modified(self, entity):
+        """Prevent the eviction of an instance until it is saved or its XML is retrieved again."""
+        with self._lock:
+            if self._entries.get(entity.uri) is entity:
+                self._modified.add(entity.uri)
+
+    def mark_saved(self, entity):
+        """Allow the eviction of an instance after its modifications were saved."""
+        with self._lock:
+            self._modified.discard(entity.uri)
+            self._evict()
+
+    def pin(self, entity):
+        """Prevent the eviction of the root of an instance while it is read or modified, until unpin is called."""
+        with self._lock:
+            self._pins[entity.uri] = self._pins.get(entity.uri, 0) + 1
+
+    def unpin(self, entity):
+        """Release a pin set with pin."""
+        with self._lock:
+            count = self._pins.pop(entity.uri) - 1
+            if count:
+                self._pins[entity.uri] = count
+
+    def stats(self):
+        """Return a dictionary with the hits, misses, evictions, entries and bytes of the cache."""
+        return dict(hits=self.hits, misses=self.misses, evictions=self.evictions,
+                    entries=len(self._entries), bytes=self.total_bytes)
+
+    def _remove(self, uri):
+        self._evicted.pop(uri, None)
+        self._modified.discard(uri)
+        if uri in self._entries:
+            del self._entries[uri]
+            self.total_bytes -= self._sizes.pop(uri)
+
+    def _over_limits(self):
+        return (
+            (self.max_entries is not None and len(self._entries) > self.max_entries) or
+            (self.max_bytes is not None and self.total_bytes > self.max_bytes)
+        )
+
+    def _evict(self):
+        if not self._over_limits():
+            return
+        # The most recently used entry, the modified ones and the ones being read are never evicted
+        for uri in list(self._entries)[:-1]:
+            if uri in self._modified or uri in self._pins:
+                continue
+            entity = self._entries.pop(uri)
+            self.total_bytes -= self._sizes.pop(uri)
+            self._evicted[uri] = entity
+            self.evictions += 1
+            entity.root = None
+            if not self._over_limits():
+                return
+
+
+class DiskCache(object):
+    """
+    Persistent cache of the XML returned by :py:meth:`Lims.get <pyclarity_lims.lims.Lims.get>` stored in a SQLite
+    file that can be shared by many processes, so that short-lived scripts do not have to retrieve the same
+    configuration documents every time they start.
+
+    Only the entity classes listed in ttls are cached, each for the given number of seconds. Searches (queries with
+    parameters) are never cached and a document is removed from the cache when it is updated through the same Lims.
+
+    :param path: The path to the SQLite file, created if it does not exist.
+    :param ttls: dictionary mapping Entity classes to the number of seconds their XML stays valid.
+                 By default the configuration entities are cached for an hour.
+
+    Example: ::
+
+        lims = Lims('https://claritylims.example.com', 'username' , 'Pa55w0rd',
+                    disk_cache=DiskCache('/tmp/lims_cache.sqlite', ttls={Processtype: 86400, Sample: 60}))
+
+    """
+
+    # Seconds to wait for another process to release a lock on the file
+    TIMEOUT = 30
+
+    def __init__(self, path, ttls=None):
+        self.path = path
+        if ttls is None:
+            ttls = DEFAULT_TTLS
+        self.ttls = dict((klass._URI, ttl) for klass, ttl in ttls.items())
+        with closing(self._connect()) as connection:
+            # Write-ahead logging lets readers and a writer from different processes work concurrently
+            connection.execute('PRAGMA journal_mode=WAL')
+            with connection:
+                connection.execute(
+                    'CREATE TABLE IF NOT EXISTS responses (uri TEXT PRIMARY KEY, content BLOB, stored REAL)'
+                )
+
+    def _connect(self):
+        # One connection per operation so the cache can be used from several threads
+        return sqlite3.connect(self.path, timeout=self.TIMEOUT)
+
+    def ttl(self, uri):
+        """Return the time to live for the uri or None if it should not be cached."""
+        match = re.match(r'.*/api/[^/]+/(.+)/[^/]+$', uri)
+        if match:
+            return self.ttls.get(match.group(1))
+
+    def get(self, uri):
+        """Return the content stored for the uri or None if it is absent or expired."""
+        ttl = self.ttl(uri)
+        if ttl is None:
+            return None
+        with closing(self._connect()) as connection:
+            row = connection.execute(
+                'SELECT content FROM responses WHERE uri = ? AND stored > ?', (uri, time.time() - ttl)
+            ).fetchone()
+        if row:
+            return bytes(row[0])
+
+    def set(self, uri, content):
+        """Store the content of the uri if its class is cached."""
+        if self.ttl(uri) is None:
+            return
+        with closing(self._connect()) as connection, connection:
+            connection.execute(
+                'INSERT OR REPLACE INTO responses (uri, content, stored) VALUES (?, ?, ?)',
+                (uri, sqlite3.Binary(content), time.time())
+            )
+
+    def delete(self, uri):
+        """Remove the content stored for the uri."""
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM responses WHERE uri = ?', (uri,))
+
+    def clear(self):
+        """Remove all the stored content."""
+        with closing(self._connect()) as connection, connection:
+            connection.execute('DELETE FROM responses')
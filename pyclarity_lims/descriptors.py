@@ -13,7 +13,14 @@ try:
 except ImportError:
     from urlparse import urlsplit, urlparse, parse_qs, urlunparse
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 import datetime
+import functools
+import threading
 import time
 from xml.etree import ElementTree
 
@@ -21,6 +28,110 @@ import logging
 
 logger = logging.getLogger(__name__)
 
+# Serialises the parsing and modification of the XML done through the descriptors and their list and dictionary
+# views, so that threads sharing an instance never see or produce a half-modified document.
+_xml_lock = threading.RLock()
+
+
+def synchronized(func):
+    """Decorator running the function while holding the lock protecting the XML of the instances."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        with _xml_lock:
+            return func(*args, **kwargs)
+    return wrapper
+
+
+def _cached_views(instance):
+    """Return the dictionary of the views cached by an Entity or None for objects not caching them."""
+    views = getattr(instance, '_views', False)
+    if views is None:
+        # Entities only allocate the dictionary when a view is used
+        views = instance._views = {}
+    if isinstance(views, dict):
+        return views
+
+
+class _pinned(object):
+    """Context manager preventing bounded caches from evicting the root of the instance."""
+
+    def __init__(self, instance):
+        self.instance = instance
+        self.cache = getattr(getattr(instance, 'lims', None), 'cache', None)
+
+    def __enter__(self):
+        pin = getattr(self.cache, 'pin', None)
+        if pin is not None:
+            pin(self.instance)
+
+    def __exit__(self, *args):
+        unpin = getattr(self.cache, 'unpin', None)
+        if unpin is not None:
+            unpin(self.instance)
+
+
+def pins_instance(func):
+    """
+    Decorator for the __get__ and __set__ methods of the descriptors: the root of the instance is not evicted
+    between instance.get() and the end of the access.
+    """
+    @functools.wraps(func)
+    def wrapper(self, instance, *args):
+        with _pinned(instance):
+            return func(self, instance, *args)
+    return wrapper
+
+
+def _restore_root(view):
+    # A bounded cache may have evicted the unmodified root the view was parsed from since the view was returned
+    if view.instance.root is None and view._root is not None:
+        view.instance.root = view._root
+
+
+def _invalidate_views(instance, keep=None):
+    """Remove the cached views of an instance, except keep, after its XML was modified."""
+    views = getattr(instance, '_views', None)
+    if isinstance(views, dict) and views:
+        for descriptor, (root, view) in list(views.items()):
+            if view is not keep:
+                del views[descriptor]
+    # Let bounded caches keep the instance until it is saved
+    mark_modified = getattr(getattr(getattr(instance, 'lims', None), 'cache', None), 'mark_modified', None)
+    if mark_modified is not None:
+        mark_modified(instance)
+
+
+def modifies_xml(func):
+    """
+    Decorator for the methods of the views modifying the XML of their instance. The view stays consistent with the
+    XML but the other cached views of the instance are invalidated.
+    """
+    @functools.wraps(func)
+    def wrapper(self, *args, **kwargs):
+        with _xml_lock, _pinned(self.instance):
+            _restore_root(self)
+            try:
+                return func(self, *args, **kwargs)
+            finally:
+                _invalidate_views(self.instance, keep=self)
+    return wrapper
+
+
+def _desynchronizing(method):
+    """
+    Wrap a list or dict method that makes the view differ from the XML of its instance. All the cached views of
+    the instance are invalidated so the next access reflects the XML again.
+    """
+    def wrapper(self, *args, **kwargs):
+        with _xml_lock:
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                _invalidate_views(self.instance)
+    wrapper.__name__ = method.__name__
+    wrapper.__doc__ = method.__doc__
+    return wrapper
+
 
 class XmlElement(object):
     """Abstract class providing functionality to access the root node of an instance"""
@@ -51,31 +162,43 @@ class XmlMutable(XmlElement):
     """Class that receive an instance so it can be mutated in place"""
     def __init__(self, instance):
         self.instance = instance
+        # Root the view was parsed from
+        self._root = getattr(instance, 'root', None)
 
 
 # Dictionary types
 class XmlDictionary(XmlMutable, dict):
     """Class that behave like a dictionary and modify the provided instance as the dictionary gets updated"""
+    @synchronized
     def __init__(self, instance, *args, **kwargs):
         dict.__init__(self, *args, **kwargs)
         XmlMutable.__init__(self, instance)
         self._update_elems()
         self._prepare_lookup()
 
+    @modifies_xml
     def __setitem__(self, key, value):
         dict.__setitem__(self, key, value)
         self._setitem(key, value)
         self._update_elems()
 
+    @modifies_xml
     def __delitem__(self, key):
         dict.__delitem__(self, key)
         self._delitem(key)
         self._update_elems()
 
+    # These methods do not modify the XML
+    pop = _desynchronizing(dict.pop)
+    popitem = _desynchronizing(dict.popitem)
+    setdefault = _desynchronizing(dict.setdefault)
+    update = _desynchronizing(dict.update)
+
     def _prepare_lookup(self):
         for elem in self._elems:
             self._parse_element(elem)
 
+    @modifies_xml
     def clear(self):
         dict.clear(self)
         self.rootnode(self.instance).clear()
@@ -114,6 +237,7 @@ class UdfDictionary(Nestable, XmlDictionary):
         else:
             return self._udt
 
+    @modifies_xml
     def set_udt(self, name):
         assert isinstance(name, str)
         if not self._udt:
@@ -137,6 +261,10 @@ class UdfDictionary(Nestable, XmlDictionary):
             for elem in list(self.rootnode(self.instance)):
                 if elem.tag == tag:
                     self._elems.append(elem)
+        # Index of the field elements by name: the first one wins like in a linear search
+        self._index = {}
+        for elem in self._elems:
+            self._index.setdefault(elem.attrib['name'], elem)
 
     def _parse_element(self, element, **kwargs):
         type = element.attrib['type'].lower()
@@ -154,9 +282,39 @@ class UdfDictionary(Nestable, XmlDictionary):
             value = datetime.date(*time.strptime(value, "%Y-%m-%d")[:3])
         dict.__setitem__(self, element.attrib['name'], value)
 
+    @modifies_xml
+    def __setitem__(self, key, value):
+        # The index is maintained by _setitem so the elements do not need to be searched again
+        self._setitem(key, value)
+        dict.__setitem__(self, key, value)
+
+    @modifies_xml
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._delitem(key)
+
+    @modifies_xml
+    def update(self, *args, **kwargs):
+        """
+        Set several UDFs at once. All the values are checked before the XML is modified
+        so nothing is changed if one of them has the wrong type.
+        """
+        values = dict(*args, **kwargs)
+        converted = [(key, self._convert(key, value)) for key, value in values.items()]
+        for key, (node, vtype, text) in converted:
+            self._apply(key, node, vtype, text)
+        dict.update(self, values)
+
     def _setitem(self, key, value):
-        for node in self._elems:
-            if node.attrib['name'] != key: continue
+        self._apply(key, *self._convert(key, value))
+
+    def _convert(self, key, value):
+        """
+        Check the value against the type of the UDF and return a tuple with the existing element (or None),
+        the type of the new element and the text to store.
+        """
+        node = self._index.get(key)
+        if node is not None:
             vtype = node.attrib['type'].lower()
 
             if value is None:
@@ -187,12 +345,7 @@ class UdfDictionary(Nestable, XmlDictionary):
                     raise TypeError('URI UDF requires str or punycode (unicode) value')
                 value = str(value)
             else:
-                raise NotImplemented("UDF type '%s'" % vtype)
-            if not isinstance(value, str):
-                if not self._is_string(value):
-                    value = str(value).encode('UTF-8')
-            node.text = value
-            break
+                raise NotImplementedError("UDF type '%s'" % vtype)
         else:  # Create new entry; heuristics for type
             if self._is_string(value):
                 vtype = '\n' in value and 'Text' or 'String'
@@ -208,25 +361,38 @@ class UdfDictionary(Nestable, XmlDictionary):
             else:
                 raise NotImplementedError("Cannot handle value of type '%s'"
                                           " for UDF" % type(value))
+        if not isinstance(value, str):
+            if not self._is_string(value):
+                value = str(value).encode('UTF-8')
+        return node, vtype, value
+
+    def _apply(self, key, node, vtype, text):
+        if node is None:
             if self._udt:
                 root = self.rootnode(self.instance).find(nsmap('udf:type'))
             else:
                 root = self.rootnode(self.instance)
-            elem = ElementTree.SubElement(root,
+            node = ElementTree.SubElement(root,
                                           nsmap('udf:field'),
                                           type=vtype,
                                           name=key)
-            if not isinstance(value, str):
-                if not self._is_string(value):
-                    value = str(value).encode('UTF-8')
-
-            elem.text = value
+            self._elems.append(node)
+            self._index[key] = node
+        node.text = text
 
     def _delitem(self, key):
-        for node in self._elems:
-            if node.attrib['name'] == key:
+        node = self._index.pop(key, None)
+        if node is not None:
+            if self._udt:
+                self.rootnode(self.instance).find(nsmap('udf:type')).remove(node)
+            else:
                 self.rootnode(self.instance).remove(node)
-                break
+            self._elems.remove(node)
+            # Another field with the same name becomes visible
+            for elem in self._elems:
+                if elem.attrib['name'] == key:
+                    self._index[key] = elem
+                    break
 
 
 class XmlElementAttributeDict(XmlDictionary, Nestable):
@@ -310,31 +476,47 @@ class PlacementDictionary(XmlDictionary):
 
     def _update_elems(self):
         self._elems = self.rootnode(self.instance).findall('placement')
+        # Index of the placement elements by location so a well is not searched in every placement
+        self._index = {}
+        for elem in self._elems:
+            self._index.setdefault(elem.find('value').text, elem)
+
+    def _prepare_lookup(self):
+        from pyclarity_lims.entities import SiblingGroup
+        XmlDictionary._prepare_lookup(self)
+        SiblingGroup(self.values())
 
     def _parse_element(self, element, **kwargs):
         from pyclarity_lims.entities import Artifact
         key = element.find('value').text
         dict.__setitem__(self, key, Artifact(self.instance.lims, uri=element.attrib['uri']))
 
+    @modifies_xml
+    def __setitem__(self, key, value):
+        # The index is maintained by _setitem so the placements do not need to be searched again
+        self._setitem(key, value)
+        dict.__setitem__(self, key, value)
+
+    @modifies_xml
+    def __delitem__(self, key):
+        dict.__delitem__(self, key)
+        self._delitem(key)
+
     def _setitem(self, key, value):
         if not isinstance(key, str):
             raise ValueError()
-        elem1 = None
-        for node in self._elems:
-            if node.find('value').text == key:
-                elem1 = node
-                break
-        if elem1:
-            self.rootnode(self.instance).remove(elem1)
+        self._delitem(key)
         elem1 = ElementTree.SubElement(self.rootnode(self.instance), 'placement', uri=value.uri, limsid=value.id)
         elem2 = ElementTree.SubElement(elem1, 'value')
         elem2.text = key
+        self._elems.append(elem1)
+        self._index[key] = elem1
 
     def _delitem(self, key):
-        for node in self._elems:
-            if node.find('value').text == key:
-                self.rootnode(self.instance).remove(node)
-                break
+        node = self._index.pop(key, None)
+        if node is not None:
+            self.rootnode(self.instance).remove(node)
+            self._elems.remove(node)
 
 
 class SubTagDictionary(XmlDictionary):
@@ -424,34 +606,47 @@ class XmlPooledInputDict(XmlDictionary, Nestable):
 # List types
 class XmlList(XmlMutable, list):
     """Class that behave like a list and modify the provided instance as the list gets updated"""
+    @synchronized
     def __init__(self, instance, *args, **kwargs):
         XmlMutable.__init__(self, instance=instance)
         list.__init__(self, *args, **kwargs)
         self._update_elems()
         self._prepare_list()
 
+    # These methods do not modify the XML
+    __delitem__ = _desynchronizing(list.__delitem__)
+    __imul__ = _desynchronizing(list.__imul__)
+    pop = _desynchronizing(list.pop)
+    remove = _desynchronizing(list.remove)
+    reverse = _desynchronizing(list.reverse)
+    sort = _desynchronizing(list.sort)
+
     def _prepare_list(self):
         for i, elem in enumerate(self._elems):
             self._parse_element(elem, lims=self.instance.lims, position=i)
 
+    @modifies_xml
     def clear(self):
         # python 2.7 does not have a clear function for list
         del self[:]
         self.rootnode(self.instance).clear()
         self._update_elems()
 
+    @_desynchronizing
     def __add__(self, other_list):
         for item in other_list:
             self._additem(item)
         self._update_elems()
         return list.__add__(self, [self._modify_value_before_insert(v, len(self) + i) for i, v in enumerate(other_list)])
 
+    @modifies_xml
     def __iadd__(self, other_list):
         for item in other_list:
             self._additem(item)
         self._update_elems()
         return list.__iadd__(self, [self._modify_value_before_insert(v) for i, v in enumerate(other_list)])
 
+    @modifies_xml
     def __setitem__(self, i, item):
         if isinstance(i, slice):
             new_items = []
@@ -470,6 +665,7 @@ class XmlList(XmlMutable, list):
         self._update_elems()
         return list.__setitem__(self, i, item)
 
+    @modifies_xml
     def insert(self, i, item):
         self._insertitem(i, item)
         self._update_elems()
@@ -480,11 +676,13 @@ class XmlList(XmlMutable, list):
             new_items.append(self._modify_value_before_insert(v, i + 1 + p))
         list.__setitem__(self, slice(i + 1, len(self), 1), new_items)
 
+    @modifies_xml
     def append(self, item):
         self._additem(item)
         self._update_elems()
         return list.append(self, self._modify_value_before_insert(item, len(self)))
 
+    @modifies_xml
     def extend(self, iterable):
         for v in iterable:
             self._additem(v)
@@ -628,6 +826,11 @@ class EntityList(TagXmlList):
         node.attrib['uri'] = value.uri
         return node
 
+    def _prepare_list(self):
+        from pyclarity_lims.entities import SiblingGroup
+        TagXmlList._prepare_list(self)
+        SiblingGroup(self)
+
     def _parse_element(self, element, lims, **kwargs):
         list.append(self, self.klass(lims, uri=element.attrib['uri']))
 
@@ -647,23 +850,66 @@ class XmlInputOutputMapList(TagXmlList):
         list.append(self, (input, output))
 
     def _get_dict(self, lims, node):
-        from pyclarity_lims.entities import Artifact, Process
         if node is None: return None
-        result = dict()
-        for key in ['limsid', 'output-type', 'output-generation-type']:
-            try:
-                result[key] = node.attrib[key]
-            except KeyError:
-                pass
-            for uri in ['uri', 'post-process-uri']:
-                try:
-                    result[uri] = Artifact(lims, uri=node.attrib[uri])
-                except KeyError:
-                    pass
-        node = node.find('parent-process')
-        if node is not None:
-            result['parent-process'] = Process(lims, node.attrib['uri'])
-        return result
+        return InputOutputEntry(lims, node)
+
+
+class InputOutputEntry(Mapping):
+    """
+    Read-only dictionary describing the input or the output of an input-output-map.
+    The values are read from the XML element when accessed so the Artifact and Process entities are only
+    created for the keys actually used.
+
+    The keys can be limsid, output-type, output-generation-type, uri and post-process-uri (
+    :py:class:`Artifact <pyclarity_lims.entities.Artifact>`) and parent-process (
+    :py:class:`Process <pyclarity_lims.entities.Process>`).
+    """
+
+    __slots__ = ('lims', 'node')
+
+    _STRING_KEYS = ('limsid', 'output-type', 'output-generation-type')
+    _ARTIFACT_KEYS = ('uri', 'post-process-uri')
+
+    def __init__(self, lims, node):
+        self.lims = lims
+        self.node = node
+
+    def raw(self, key, default=None):
+        """Return the text of a key as found in the XML, the uri for the entities, without creating any entity."""
+        if key == 'parent-process':
+            node = self.node.find('parent-process')
+            return default if node is None else node.attrib['uri']
+        if key in self._STRING_KEYS or key in self._ARTIFACT_KEYS:
+            return self.node.attrib.get(key, default)
+        return default
+
+    def __getitem__(self, key):
+        from pyclarity_lims.entities import Artifact, Process
+        value = self.raw(key)
+        if value is None:
+            raise KeyError(key)
+        if key in self._ARTIFACT_KEYS:
+            return Artifact(self.lims, uri=value)
+        if key == 'parent-process':
+            return Process(self.lims, uri=value)
+        return value
+
+    def __iter__(self):
+        for key in self._STRING_KEYS + self._ARTIFACT_KEYS:
+            if key in self.node.attrib:
+                yield key
+        if self.node.find('parent-process') is not None:
+            yield 'parent-process'
+
+    def __len__(self):
+        return sum(1 for _ in self)
+
+    def __repr__(self):
+        return repr(dict(self))
+
+    def copy(self):
+        """Return a dictionary with the same content."""
+        return dict(self)
 
 
 class OutputPlacementList(TagXmlList):
@@ -795,6 +1041,7 @@ class StringDescriptor(TagDescriptor):
     represented by an XML element.
     """
 
+    @pins_instance
     def __get__(self, instance, cls):
         instance.get()
         node = self.get_node(instance)
@@ -803,14 +1050,17 @@ class StringDescriptor(TagDescriptor):
         else:
             return node.text
 
+    @pins_instance
     def __set__(self, instance, value):
         instance.get()
-        node = self.get_node(instance)
-        if node is None:
-            # create the new tag
-            node = ElementTree.Element(self.tag)
-            self.rootnode(instance).append(node)
-        node.text = str(value)
+        with _xml_lock:
+            node = self.get_node(instance)
+            if node is None:
+                # create the new tag
+                node = ElementTree.Element(self.tag)
+                self.rootnode(instance).append(node)
+            node.text = str(value)
+            _invalidate_views(instance)
 
 
 class IntegerDescriptor(StringDescriptor):
@@ -818,6 +1068,7 @@ class IntegerDescriptor(StringDescriptor):
     represented by an XMl element.
     """
 
+    @pins_instance
     def __get__(self, instance, cls):
         text = super(IntegerDescriptor, self).__get__(instance, cls)
         if text is not None:
@@ -829,6 +1080,7 @@ class IntegerAttributeDescriptor(TagDescriptor):
     represented by an XML attribute.
     """
 
+    @pins_instance
     def __get__(self, instance, cls):
         instance.get()
         return int(self.rootnode(instance).attrib[self.tag])
@@ -839,11 +1091,13 @@ class BooleanDescriptor(StringDescriptor):
     represented by an XMl element.
     """
 
+    @pins_instance
     def __get__(self, instance, cls):
         text = super(BooleanDescriptor, self).__get__(instance, cls)
         if text is not None:
             return text.lower() == 'true'
 
+    @pins_instance
     def __set__(self, instance, value):
         super(BooleanDescriptor, self).__set__(instance, str(value).lower())
 
@@ -853,13 +1107,17 @@ class StringAttributeDescriptor(TagDescriptor):
     represented by an XML attribute.
     """
 
+    @pins_instance
     def __get__(self, instance, cls):
         instance.get()
         return instance.root.attrib[self.tag]
 
+    @pins_instance
     def __set__(self, instance, value):
         instance.get()
-        instance.root.attrib[self.tag] = value
+        with _xml_lock:
+            instance.root.attrib[self.tag] = value
+            _invalidate_views(instance)
 
 
 class EntityDescriptor(TagDescriptor):
@@ -869,6 +1127,7 @@ class EntityDescriptor(TagDescriptor):
         super(EntityDescriptor, self).__init__(tag)
         self.klass = klass
 
+    @pins_instance
     def __get__(self, instance, cls):
         instance.get()
         node = self.rootnode(instance).find(self.tag)
@@ -877,14 +1136,17 @@ class EntityDescriptor(TagDescriptor):
         else:
             return self.klass(instance.lims, uri=node.attrib['uri'])
 
+    @pins_instance
     def __set__(self, instance, value):
         instance.get()
-        node = self.get_node(instance)
-        if node is None:
-            # create the new tag
-            node = ElementTree.Element(self.tag)
-            self.rootnode(instance).append(node)
-        node.attrib['uri'] = value.uri
+        with _xml_lock:
+            node = self.get_node(instance)
+            if node is None:
+                # create the new tag
+                node = ElementTree.Element(self.tag)
+                self.rootnode(instance).append(node)
+            node.attrib['uri'] = value.uri
+            _invalidate_views(instance)
 
 
 class DimensionDescriptor(TagDescriptor):
@@ -892,6 +1154,7 @@ class DimensionDescriptor(TagDescriptor):
     the properties of a dimension of a container type.
     """
 
+    @pins_instance
     def __get__(self, instance, cls):
         instance.get()
         node = self.rootnode(instance).find(self.tag)
@@ -905,6 +1168,7 @@ class LocationDescriptor(TagDescriptor):
     specifying the location of an analyte in a container.
     """
 
+    @pins_instance
     def __get__(self, instance, cls):
         from pyclarity_lims.entities import Container
         instance.get()
@@ -922,19 +1186,35 @@ class MutableDescriptor(BaseDescriptor):
         self.muttableklass = muttableklass
         self.kwargs = kwargs
 
+    @pins_instance
     def __get__(self, instance, cls):
         instance.get()
-        return self.muttableklass(instance=instance, **self.kwargs)
-
+        with _xml_lock:
+            # The view parsed from the current root is reused until the root is replaced or modified elsewhere
+            views = _cached_views(instance)
+            if views is not None:
+                root, view = views.get(self, (None, None))
+                if view is not None and root is instance.root:
+                    return view
+            view = self.muttableklass(instance=instance, **self.kwargs)
+            if views is not None:
+                views[self] = (instance.root, view)
+            return view
+
+    @pins_instance
     def __set__(self, instance, value):
         instance.get()
-        muttable = self.muttableklass(instance=instance, **self.kwargs)
-        muttable.clear()
-        if issubclass(self.muttableklass, list):
-            return muttable.extend(value)
-        elif issubclass(self.muttableklass, dict):
-            for k in value:
-                muttable[k] = value[k]
+        with _xml_lock:
+            muttable = self.muttableklass(instance=instance, **self.kwargs)
+            muttable.clear()
+            if issubclass(self.muttableklass, list):
+                muttable.extend(value)
+            elif issubclass(self.muttableklass, dict):
+                for k in value:
+                    muttable[k] = value[k]
+            views = _cached_views(instance)
+            if views is not None:
+                views[self] = (instance.root, muttable)
 
 
 class UdfDictionaryDescriptor(MutableDescriptor):
@@ -0,0 +1,176 @@
+"""Diagnostics finding the lazy loading patterns that send one query per entity.
+
+Accessing an attribute of an entity that has not been retrieved yet sends a GET query. In a loop such as
+``for a in process.all_outputs(): a.type`` this results in one query per artifact where a single
+:py:meth:`get_batch <pyclarity_lims.lims.Lims.get_batch>` would do.
+:py:class:`LazyLoadDetector` records which attribute and which line of code triggered each of these queries and
+reports the runs of consecutive queries for entities of the same class.
+"""
+
+import os
+import sys
+import threading
+from collections import namedtuple, Counter
+
+from pyclarity_lims.descriptors import BaseDescriptor
+
+_PACKAGE_DIR = os.path.dirname(os.path.abspath(__file__))
+_LIMS_FILE = os.path.join(_PACKAGE_DIR, 'lims.py')
+# Methods of Lims whose own loads are not lazy loads
+_BATCH_METHODS = ('get_batch', 'prefetch')
+
+
+LazyLoadRun = namedtuple('LazyLoadRun', ['klass', 'count', 'attribute', 'call_site', 'uris'])
+"""
+Consecutive lazy loads of entities of the same class.
+
+- klass: the class of the entities.
+- count: the number of GET queries sent.
+- attribute: the attribute that triggered most of the queries or None if it is not a descriptor.
+- call_site: the location of the code outside pyclarity_lims that triggered most of the queries (file:line function).
+- uris: the uris of the first entities loaded.
+"""
+
+
+class LazyLoadError(Exception):
+    """Raised when the number of lazy loads exceeds the budget of a :py:class:`LazyLoadDetector`."""
+
+
+class LazyLoadDetector(object):
+    """
+    Opt-in detector of the entities retrieved one by one because one of their attributes was accessed.
+    Explicit calls to :py:meth:`Entity.get <pyclarity_lims.entities.Entity.get>`, forced loads and the loads made
+    by :py:meth:`get_batch <pyclarity_lims.lims.Lims.get_batch>` and :py:meth:`prefetch
+    <pyclarity_lims.lims.Lims.prefetch>` are not recorded.
+
+    Each lazy load is attributed to the attribute and to the line of code outside pyclarity_lims that caused it.
+    Runs of at least threshold consecutive lazy loads of the same class are reported with the get_batch call that
+    would replace them. The detection inspects the stack for every lazy load so it is meant for tests and debugging.
+
+    :param lims: The Lims to monitor.
+    :param threshold: The minimum number of consecutive lazy loads of the same class reported as a run.
+    :param max_requests: If set, a :py:class:`LazyLoadError` is raised by the lazy load exceeding this number.
+
+    Example: ::
+
+        with LazyLoadDetector(lims, max_requests=20) as detector:
+            run_epp(lims)
+        print(detector.report())
+
+    """
+
+    def __init__(self, lims, threshold=5, max_requests=None):
+        self.lims = lims
+        self.threshold = threshold
+        self.max_requests = max_requests
+        self.requests = 0
+        self._runs = []
+        self._current = None
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.stop()
+
+    def start(self):
+        """Start monitoring the lazy loads of the Lims."""
+        self.lims.diagnostics = self
+
+    def stop(self):
+        """Stop monitoring the lazy loads of the Lims."""
+        if self.lims.diagnostics is self:
+            self.lims.diagnostics = None
+        with self._lock:
+            self._end_run()
+
+    @property
+    def runs(self):
+        """List of :py:class:`LazyLoadRun` found so far, including the current run if long enough."""
+        with self._lock:
+            runs = list(self._runs)
+            if self._current and self._current['count'] >= self.threshold:
+                runs.append(self._make_run(self._current))
+        return runs
+
+    def record(self, instance):
+        """
+        Record the lazy load of an instance. Called by Entity.get before querying the LIMS,
+        the load is ignored if it was not triggered by an attribute access.
+        """
+        origin = self._trace(instance)
+        if origin is None:
+            return
+        attribute, call_site = origin
+        with self._lock:
+            self.requests += 1
+            if self._current is None or self._current['klass'] is not instance.__class__:
+                self._end_run()
+                self._current = dict(klass=instance.__class__, count=0, origins=Counter(), uris=[])
+            self._current['count'] += 1
+            self._current['origins'][(attribute, call_site)] += 1
+            if len(self._current['uris']) < 5:
+                self._current['uris'].append(instance.uri)
+            if self.max_requests is not None and self.requests > self.max_requests:
+                raise LazyLoadError('%s lazy loads exceed the budget of %s\n%s' % (
+                    self.requests, self.max_requests, self._format(self._make_run(self._current))
+                ))
+
+    def report(self):
+        """Return a description of the runs found and of the get_batch calls that would replace them."""
+        runs = self.runs
+        if not runs:
+            return 'No run of %s or more lazy loads found in %s lazy loads' % (self.threshold, self.requests)
+        return '\n'.join(self._format(run) for run in runs)
+
+    def _end_run(self):
+        if self._current and self._current['count'] >= self.threshold:
+            self._runs.append(self._make_run(self._current))
+        self._current = None
+
+    @staticmethod
+    def _make_run(current):
+        (attribute, call_site), _ = current['origins'].most_common(1)[0]
+        return LazyLoadRun(current['klass'], current['count'], attribute, call_site, list(current['uris']))
+
+    @staticmethod
+    def _format(run):
+        trigger = 'accessing %s' % run.attribute if run.attribute else 'accessing their attributes'
+        return '%s %s instances loaded one by one by %s at %s: call lims.get_batch() on the list of %s first' % (
+            run.count, run.klass.__name__, trigger, run.call_site, run.klass.__name__
+        )
+
+    @staticmethod
+    def _trace(instance):
+        """
+        Return the name of the attribute and the location of the user code causing the lazy load,
+        or None if the load is not a lazy load.
+        """
+        attribute = None
+        # Skip _trace, record and Entity.get
+        frame = sys._getframe(3)
+        if frame is None or not os.path.abspath(frame.f_code.co_filename).startswith(_PACKAGE_DIR):
+            # get() called explicitly
+            return None
+        while frame is not None:
+            filename = os.path.abspath(frame.f_code.co_filename)
+            if filename == _LIMS_FILE and frame.f_code.co_name in _BATCH_METHODS:
+                return None
+            if not filename.startswith(_PACKAGE_DIR):
+                call_site = '%s:%s %s' % (frame.f_code.co_filename, frame.f_lineno, frame.f_code.co_name)
+                return attribute, call_site
+            descriptor = frame.f_locals.get('self')
+            if attribute is None and isinstance(descriptor, BaseDescriptor):
+                attribute = _attribute_name(type(instance), descriptor)
+            frame = frame.f_back
+        return attribute, None
+
+
+def _attribute_name(klass, descriptor):
+    for cls in klass.__mro__:
+        for name, value in vars(cls).items():
+            if value is descriptor:
+                return '%s.%s' % (klass.__name__, name)
+    return descriptor.__class__.__name__
@@ -5,7 +5,8 @@ from pyclarity_lims.descriptors import StringDescriptor, UdfDictionaryDescriptor
     InputOutputMapList, LocationDescriptor, IntegerAttributeDescriptor, \
     StringAttributeDescriptor, EntityListDescriptor, StringListDescriptor, PlacementDictionaryDescriptor, \
     ReagentLabelList, AttributeListDescriptor, StringDictionaryDescriptor, OutputPlacementListDescriptor, \
-    XmlActionList, MutableDescriptor, XmlPooledInputDict, QueuedArtifactList
+    XmlActionList, MutableDescriptor, XmlPooledInputDict, QueuedArtifactList, _pinned
+from pyclarity_lims.plate import PlateGeometry
 
 try:
     from urllib.parse import urlsplit, urlparse, parse_qs, urlunparse
@@ -15,9 +16,18 @@ except ImportError:
 from xml.etree import ElementTree
 
 import logging
+import threading
+import weakref
 
 logger = logging.getLogger(__name__)
 
+# Value of the attributes parsed from the uri before their first access
+_NOT_PARSED = object()
+
+# Makes the lookup and registration of an instance in Lims.cache atomic
+# so that threads building the same uri always share one instance.
+_cache_lock = threading.RLock()
+
 
 class Entity(object):
     """
@@ -30,6 +40,12 @@ class Entity(object):
     _PREFIX = None
     _CREATION_PREFIX = None
     _CREATION_TAG = None
+    # Whether the LIMS provides batch endpoints for this entity
+    _BATCH = False
+
+    # Entities are numerous so they do not get a __dict__: the subclasses declare their own __slots__
+    # except StepActions, Step and ReagentType which store extra attributes on the instance.
+    __slots__ = ('lims', '_uri', '_id', '_root', '_siblings', '_views', '__weakref__')
 
     def __new__(cls, lims, uri=None, id=None, _create_new=False):
         if not uri:
@@ -40,23 +56,43 @@ class Entity(object):
                 pass
             else:
                 raise ValueError("Entity uri and id can't be both None")
-        try:
-            return lims.cache[uri]
-        except KeyError:
-            return object.__new__(cls)
+        with _cache_lock:
+            try:
+                return lims.cache[uri]
+            except KeyError:
+                instance = object.__new__(cls)
+                if not _create_new:
+                    # Registered before releasing the lock: __init__ has nothing left to do
+                    instance._attach(lims, uri)
+                    lims.cache[uri] = instance
+                return instance
 
     def __init__(self, lims, uri=None, id=None, _create_new=False):
         assert uri or id or _create_new
-        if not _create_new:
-            if hasattr(self, 'lims'):
-                return
-            if not uri:
-                uri = lims.get_uri(self._URI, id)
-            lims.cache[uri] = self
-            self.root = None
+        if hasattr(self, 'lims'):
+            return
+        self._attach(lims, uri)
+
+    def _attach(self, lims, uri):
         self.lims = lims
+        self._set_uri(uri)
+        self._root = None
+        # SiblingGroup of the last list this instance was returned in
+        self._siblings = None
+        # Views of the MutableDescriptors parsed from the current root, allocated when first used
+        self._views = None
+
+    def _set_uri(self, uri):
         self._uri = uri
-        self.root = None
+        # The parts of the uri used as attributes are parsed on first access then kept
+        self._id = None
+
+    def __reduce__(self):
+        # Pickled as the uri and the serialised XML so another process can use it without querying the LIMS
+        data = None
+        if self.root is not None:
+            data = ElementTree.tostring(self.root, encoding='utf-8')
+        return _restore_entity, (self.__class__, self.lims, self._uri, data)
 
     def __str__(self):
         return "%s(%s)" % (self.__class__.__name__, self.id)
@@ -71,26 +107,63 @@ class Entity(object):
         except:
             return self._URI
 
+    @property
+    def root(self):
+        """The root element of the XML document of this instance or None if it has not been retrieved yet."""
+        return self._root
+
+    @root.setter
+    def root(self, value):
+        if value is not None and value is self._root:
+            # Same document, e.g. revalidated without change: it keeps its views and its local modifications
+            return
+        self._root = value
+        self._views = None
+        # Let bounded caches account for the size of the new XML
+        resize = getattr(self.lims.cache, 'resize', None)
+        if resize is not None:
+            resize(self)
+
     @property
     def id(self):
         """Return the LIMS id; obtained from the URI."""
-        parts = urlsplit(self.uri)
-        return parts.path.split('/')[-1]
+        if self._id is None and self._uri:
+            self._id = urlsplit(self._uri).path.split('/')[-1]
+        return self._id
 
     def get(self, force=False):
         """Get the XML data for this instance."""
         if not force and self.root is not None: return
+        if not force and self._siblings is not None:
+            self._siblings.load(self)
+            if self.root is not None: return
+        diagnostics = getattr(self.lims, 'diagnostics', None)
+        if diagnostics is not None and not force:
+            diagnostics.record(self)
         self.root = self.lims.get(self.uri)
 
+    def aget(self, force=False):
+        """Awaitable version of get(). The instance needs to be attached to an
+        :py:class:`AsyncLims <pyclarity_lims.async_lims.AsyncLims>`."""
+        return self.lims._aget_entity(self, force=force)
+
     def put(self):
         """Save this instance by doing PUT of its serialized XML."""
         data = self.lims.tostring(ElementTree.ElementTree(self.root))
         self.lims.put(self.uri, data)
+        self._saved()
 
     def post(self):
         """Save this instance with POST"""
         data = self.lims.tostring(ElementTree.ElementTree(self.root))
         self.lims.post(self.uri, data)
+        self._saved()
+
+    def _saved(self):
+        # Let bounded caches evict this instance again
+        mark_saved = getattr(self.lims.cache, 'mark_saved', None)
+        if mark_saved is not None:
+            mark_saved(self)
 
     @classmethod
     def _create(cls, lims, **kwargs):
@@ -119,13 +192,80 @@ class Entity(object):
         instance = cls._create(lims, **kwargs)
         data = lims.tostring(ElementTree.ElementTree(instance.root))
         instance.root = lims.post(uri=lims.get_uri(cls._URI), data=data)
-        instance._uri = instance.root.attrib['uri']
+        instance._set_uri(instance.root.attrib['uri'])
         return instance
 
 
+class SiblingGroup(object):
+    """
+    Entities returned together, such as the results of a search, the inputs of a process or the artifacts placed in
+    a container. When prefetching is enabled, the first lazy load of one of them retrieves all the members
+    of the same class not retrieved yet with a single :py:meth:`get_batch <pyclarity_lims.lims.Lims.get_batch>`.
+
+    The group is only attached to the instances when prefetching is enabled and it keeps weak references to them,
+    so it does not keep alive the members that are not used anymore.
+
+    :param instances: The entities of the group.
+    :param enabled: Whether lazy loads retrieve the whole group.
+                    If None, the prefetch_siblings attribute of the Lims of the instances decides.
+    """
+
+    def __init__(self, instances=(), enabled=None):
+        self.enabled = enabled
+        self._members = []
+        self.add(instances)
+
+    @property
+    def instances(self):
+        """The members of the group that are still referenced."""
+        return [i for i in (ref() for ref in self._members) if i is not None]
+
+    def add(self, instances):
+        """Attach more entities to the group, such as the next page of a search."""
+        instances = list(instances)
+        if not instances:
+            return
+        enabled = self.enabled
+        if enabled is None:
+            enabled = instances[0].lims.prefetch_siblings
+        if not enabled:
+            return
+        for instance in instances:
+            instance._siblings = self
+        self._members.extend(weakref.ref(i) for i in instances)
+
+    def load(self, instance):
+        """Retrieve instance with the members of its class that have not been retrieved yet."""
+        members = self.instances
+        to_load = [i for i in members if i.__class__ is instance.__class__ and i.root is None]
+        # Release the members that will not need the group anymore
+        self._members = [weakref.ref(i) for i in members if i.__class__ is not instance.__class__ and i.root is None]
+        if len(to_load) < 2:
+            return
+        try:
+            instance.lims.get_batch(to_load)
+        except Exception as e:
+            # The instances that failed are retrieved individually when accessed
+            logger.warning('Failed to prefetch the siblings of %s: %s', instance, e)
+
+
+def _restore_entity(cls, lims, uri, data):
+    """Rebuild a pickled instance attached to the Lims of the current process."""
+    if uri:
+        instance = cls(lims, uri=uri)
+    else:
+        instance = cls(lims, _create_new=True)
+    # An instance already retrieved in this process keeps its XML
+    if instance.root is None and data is not None:
+        instance.root = ElementTree.fromstring(data)
+    return instance
+
+
 class Lab(Entity):
     """A lab is a list of researcher."""
 
+    __slots__ = ()
+
     _URI = 'labs'
     _PREFIX = 'lab'
 
@@ -148,6 +288,8 @@ class Lab(Entity):
 class Researcher(Entity):
     """Person; client scientist or lab personnel. Associated with a lab."""
 
+    __slots__ = ()
+
     _URI = 'researchers'
     _PREFIX = 'res'
 
@@ -183,6 +325,8 @@ class Researcher(Entity):
 class Reagent_label(Entity):
     """Reagent label element"""
 
+    __slots__ = ()
+
     reagent_label = StringDescriptor('reagent-label')
     """The reagent label"""
 
@@ -190,6 +334,8 @@ class Reagent_label(Entity):
 class Note(Entity):
     """Note attached to a project or a sample."""
 
+    __slots__ = ()
+
     content = StringDescriptor(None)  # root element
     """The content of the note"""
 
@@ -197,6 +343,8 @@ class Note(Entity):
 class File(Entity):
     """File attached to a project or a sample."""
 
+    __slots__ = ()
+
     attached_to = StringDescriptor('attached-to')
     """The uri of the Entity this file is attached to"""
     content_location = StringDescriptor('content-location')
@@ -210,6 +358,8 @@ class File(Entity):
 class Project(Entity):
     """Project concerning a number of samples; associated with a researcher."""
 
+    __slots__ = ()
+
     _URI = 'projects'
     _PREFIX = 'prj'
 
@@ -237,9 +387,12 @@ class Project(Entity):
 class Sample(Entity):
     """Customer's sample to be analyzed; associated with a project."""
 
+    __slots__ = ()
+
     _URI = 'samples'
     _PREFIX = 'smp'
     _CREATION_TAG = 'samplecreation'
+    _BATCH = True
 
     name = StringDescriptor('name')
     """Name of the sample."""
@@ -267,8 +420,8 @@ class Sample(Entity):
 
 
     @classmethod
-    def create(cls, lims, container, position, **kwargs):
-        """Create an instance of Sample from attributes then post it to the LIMS"""
+    def _create(cls, lims, container, position, **kwargs):
+        """Create an instance of Sample located in the container from attributes and return it"""
         if not isinstance(container, Container):
             raise TypeError('%s is not of type Container'%container)
         instance = super(Sample, cls)._create(lims, **kwargs)
@@ -277,15 +430,23 @@ class Sample(Entity):
         ElementTree.SubElement(location, 'container', dict(uri=container.uri))
         position_element = ElementTree.SubElement(location, 'value')
         position_element.text = position
+        return instance
+
+    @classmethod
+    def create(cls, lims, container, position, **kwargs):
+        """Create an instance of Sample from attributes then post it to the LIMS"""
+        instance = cls._create(lims, container, position, **kwargs)
         data = lims.tostring(ElementTree.ElementTree(instance.root))
         instance.root = lims.post(uri=lims.get_uri(cls._URI), data=data)
-        instance._uri = instance.root.attrib['uri']
+        instance._set_uri(instance.root.attrib['uri'])
         return instance
 
 
 class Containertype(Entity):
     "Type of container for analyte artifacts."
 
+    __slots__ = ()
+
     _TAG = 'container-type'
     _URI = 'containertypes'
     _PREFIX = 'ctp'
@@ -301,12 +462,20 @@ class Containertype(Entity):
     y_dimension = DimensionDescriptor('y-dimension')
     """Number of position on the y axis"""
 
+    @property
+    def geometry(self):
+        """:py:class:`PlateGeometry <pyclarity_lims.plate.PlateGeometry>` converting the wells of this type of container."""
+        return PlateGeometry.from_containertype(self)
+
 
 class Container(Entity):
     "Container for analyte artifacts."
 
+    __slots__ = ()
+
     _URI = 'containers'
     _PREFIX = 'con'
+    _BATCH = True
 
     name = StringDescriptor('name')
     """Name of the container"""
@@ -332,6 +501,8 @@ class Container(Entity):
 
 
 class Processtype(Entity):
+    __slots__ = ()
+
     _TAG = 'process-type'
     _URI = 'processtypes'
     _PREFIX = 'ptp'
@@ -343,6 +514,9 @@ class Processtype(Entity):
 
 class Udfconfig(Entity):
     "Instance of field type (cnf namespace)."
+
+    __slots__ = ()
+
     _URI = 'configuration/udfs'
 
     name = StringDescriptor('name')
@@ -369,9 +543,51 @@ class Udfconfig(Entity):
     """List of presets."""
 
 
+def _unique(items):
+    """Remove the duplicated items keeping the first occurrences in order."""
+    seen = set()
+    return [i for i in items if not (i in seen or seen.add(i))]
+
+
+class _InputOutputIndex(object):
+    """Lookups built once from the input_output_maps of a Process. They hold ids and uris rather than entities."""
+
+    def __init__(self, input_output_maps):
+        # Ids in the order of the maps including duplicates, None for maps without input
+        self.input_ids = []
+        self.output_ids = []
+        # input id -> list of (output type, output uri)
+        self.outputs_per_input = {}
+        # output id -> list of input uris
+        self.inputs_per_output = {}
+        # output type -> list of unique output ids
+        self.outputs_per_type = {}
+        # input id -> uri of the process that generated the input or None
+        self.parent_process_per_input = {}
+        seen_outputs = set()
+        for input, output in input_output_maps:
+            input_id = input.get('limsid') if input is not None else None
+            self.input_ids.append(input_id)
+            if input is not None and input_id not in self.parent_process_per_input:
+                self.parent_process_per_input[input_id] = input.raw('parent-process')
+            if output is None:
+                continue
+            output_id = output.get('limsid')
+            output_type = output.get('output-type')
+            self.output_ids.append(output_id)
+            self.outputs_per_input.setdefault(input_id, []).append((output_type, output.raw('uri')))
+            if input is not None:
+                self.inputs_per_output.setdefault(output_id, []).append(input.raw('uri'))
+            if output_id not in seen_outputs:
+                seen_outputs.add(output_id)
+                self.outputs_per_type.setdefault(output_type, []).append(output_id)
+
+
 class Process(Entity):
     "Process (instance of Processtype) executed producing ouputs from inputs."
 
+    __slots__ = ('_io_index',)
+
     _URI = 'processes'
     _PREFIX = 'prc'
     _CREATION_PREFIX = 'prx'
@@ -386,7 +602,8 @@ class Process(Entity):
     """The name of the protocol"""
     input_output_maps = InputOutputMapList()
     """
-    list of tuples (input, output) where input and output item are dictionaries representing the input/output.
+    list of tuples (input, output) where input and output item are read-only dictionaries representing the
+    input/output. The entities are only created when the corresponding key is accessed.
     keys of the dict can be:
 
     * for the input:
@@ -415,6 +632,14 @@ class Process(Entity):
     # instrument XXX
     # process_parameters XXX
 
+    def _input_output_index(self):
+        """Return the lookups built from input_output_maps, rebuilt when the maps are parsed again."""
+        maps = self.input_output_maps
+        cached = getattr(self, '_io_index', None)
+        if cached is None or cached[0] is not maps:
+            cached = self._io_index = (maps, _InputOutputIndex(maps))
+        return cached[1]
+
     def outputs_per_input(self, inart, ResultFile=False, SharedResultFile=False, Analyte=False):
         """Getting all the output artifacts related to a particual input artifact
 
@@ -424,82 +649,91 @@ class Process(Entity):
         :param Analyte: boolean specifying to only return Analyte.
         :return: output artifact corresponding to the input artifact provided
         """
-        inouts = [io for io in self.input_output_maps if io[0]['limsid'] == inart]
+        outputs = self._input_output_index().outputs_per_input.get(inart, [])
         if ResultFile:
-            inouts = [io for io in inouts if io[1]['output-type'] == 'ResultFile']
+            outputs = [o for o in outputs if o[0] == 'ResultFile']
         elif SharedResultFile:
-            inouts = [io for io in inouts if io[1]['output-type'] == 'SharedResultFile']
+            outputs = [o for o in outputs if o[0] == 'SharedResultFile']
         elif Analyte:
-            inouts = [io for io in inouts if io[1]['output-type'] == 'Analyte']
-        outs = [io[1]['uri'] for io in inouts]
-        return outs
+            outputs = [o for o in outputs if o[0] == 'Analyte']
+        return [Artifact(self.lims, uri=uri) for output_type, uri in outputs if uri]
 
     def input_per_sample(self, sample):
-        """Getting all the input artifacts dereved from the specified sample
+        """Getting all the input artifacts dereved from the specified sample.
+        The inputs and their samples are retrieved with batch queries.
 
         :param sample: the sample name to check against
 
         :return: list of input artifacts matching the sample name
 
         """
-        ins_all = self.all_inputs()
-        ins = []
-        for inp in ins_all:
-            for samp in inp.samples:
-                if samp.name == sample and inp not in ins:
-                    ins.append(inp)
-        return ins
-
-    def all_inputs(self, unique=True, resolve=False):
+        inputs = self.all_inputs()
+        self.lims.get_batch(inputs)
+        self.lims.get_batch(_unique(s for i in inputs for s in i.samples))
+        return [i for i in inputs if any(s.name == sample for s in i.samples)]
+
+    def all_inputs(self, unique=True, resolve=False, prefetch_siblings=None):
         """Retrieving all input artifacts from input_output_maps
         if unique is true, no duplicates are returned.
 
         :param unique: boolean specifying if the list of artifact should be uniqued
         :param resolve: boolean specifying if the artifacts entities should be resolved through a batch query.
+        :param prefetch_siblings: boolean specifying if accessing one of the artifacts retrieves all of them
+                                  through a batch query. Defaults to the prefetch_siblings attribute of the Lims.
 
         :return: list of input artifact.
 
         """
+        ids = self._input_output_index().input_ids
         # if the process has no input, that is not standard and we want to know about it
-        try:
-            ids = [io[0]['limsid'] for io in self.input_output_maps]
-        except TypeError:
-            logger.error("Process ", self, " has no input artifacts")
+        if None in ids:
+            logger.error("Process %s has no input artifacts", self)
             raise TypeError
         if unique:
-            ids = list(frozenset(ids))
+            ids = _unique(ids)
         if resolve:
             return self.lims.get_batch([Artifact(self.lims, id=id) for id in ids if id is not None])
         else:
-            return [Artifact(self.lims, id=id) for id in ids if id is not None]
+            artifacts = [Artifact(self.lims, id=id) for id in ids if id is not None]
+            SiblingGroup(artifacts, enabled=prefetch_siblings)
+            return artifacts
 
-    def all_outputs(self, unique=True, resolve=False):
+    def all_outputs(self, unique=True, resolve=False, prefetch_siblings=None):
         """Retrieving all output artifacts from input_output_maps
         if unique is true, no duplicates are returned.
 
         :param unique: boolean specifying if the list of artifact should be uniqued
         :param resolve: boolean specifying if the artifacts entities should be resolved through a batch query.
+        :param prefetch_siblings: boolean specifying if accessing one of the artifacts retrieves all of them
+                                  through a batch query. Defaults to the prefetch_siblings attribute of the Lims.
         :return: list of output artifact.
 
         """
-        # Given how ids is structured, io[1] might be None : some process don't have an output.
-        ids = [io[1]['limsid'] for io in self.input_output_maps if io[1] is not None]
+        # Some process don't have an output: the maps without output are not indexed.
+        ids = self._input_output_index().output_ids
         if unique:
-            ids = list(frozenset(ids))
+            ids = _unique(ids)
         if resolve:
             return self.lims.get_batch([Artifact(self.lims, id=id) for id in ids if id is not None])
         else:
-            return [Artifact(self.lims, id=id) for id in ids if id is not None]
+            artifacts = [Artifact(self.lims, id=id) for id in ids if id is not None]
+            SiblingGroup(artifacts, enabled=prefetch_siblings)
+            return artifacts
 
     def shared_result_files(self):
         """Retreve all resultfiles of output-generation-type PerAllInputs."""
-        artifacts = self.all_outputs(unique=True)
-        return [a for a in artifacts if a.output_type == 'SharedResultFile']
+        return self._outputs_of_type('SharedResultFile')
 
     def result_files(self):
         """Retreve all resultfiles of output-generation-type perInput."""
-        artifacts = self.all_outputs(unique=True)
-        return [a for a in artifacts if a.output_type == 'ResultFile']
+        return self._outputs_of_type('ResultFile')
+
+    def _outputs_of_type(self, output_type):
+        # The output-type of input_output_maps avoids retrieving the artifacts
+        artifacts = [Artifact(self.lims, id=id) for id in
+                     self._input_output_index().outputs_per_type.get(output_type, []) if id is not None]
+        SiblingGroup(artifacts)
+        return artifacts
 
     def analytes(self):
         """Retreving the output Analytes of the process, if existing.
@@ -507,25 +741,29 @@ class Process(Entity):
         analytes are returned. Input/Output is returned as a information string.
         Makes aggregate processes and normal processes look the same."""
         info = 'Output'
-        artifacts = self.all_outputs(unique=True)
-        analytes = [a for a in artifacts if a.type == 'Analyte']
+        analytes = self._outputs_of_type('Analyte')
         if len(analytes) == 0:
             artifacts = self.all_inputs(unique=True)
+            self.lims.get_batch(artifacts)
             analytes = [a for a in artifacts if a.type == 'Analyte']
             info = 'Input'
         return analytes, info
 
     def parent_processes(self):
-        """Retrieving all parent processes through the input artifacts"""
-        return [i_a.parent_process for i_a in self.all_inputs(unique=True)]
+        """Retrieving all parent processes of the input artifacts as found in input_output_maps"""
+        index = self._input_output_index()
+        processes = []
+        for id in _unique(index.input_ids):
+            uri = index.parent_process_per_input.get(id)
+            processes.append(Process(self.lims, uri=uri) if uri else None)
+        SiblingGroup(p for p in processes if p is not None)
+        return processes
 
     def output_containers(self):
-        """Retrieve all unique output containers"""
-        cs = []
-        for o_a in self.all_outputs(unique=True):
-            if o_a.container:
-                cs.append(o_a.container)
-        return list(frozenset(cs))
+        """Retrieve all unique output containers. The output artifacts are retrieved with a batch query."""
+        artifacts = self.all_outputs(unique=True)
+        self.lims.get_batch(artifacts)
+        return _unique(a.container for a in artifacts if a.container)
 
     @property
     def step(self):
@@ -536,8 +774,11 @@ class Process(Entity):
 class Artifact(Entity):
     "Any process input or output; analyte or file."
 
+    __slots__ = ('_state',)
+
     _URI = 'artifacts'
     _PREFIX = 'art'
+    _BATCH = True
 
     name = StringDescriptor('name')
     """The name of the artifact."""
@@ -575,21 +816,24 @@ class Artifact(Entity):
         """Returns the input artifact ids of the parent process."""
         input_artifact_list = []
         try:
-            for tuple in self.parent_process.input_output_maps:
-                if tuple[1]['limsid'] == self.id:
-                    input_artifact_list.append(tuple[0]['uri'])  # ['limsid'])
+            uris = self.parent_process._input_output_index().inputs_per_output.get(self.id, [])
+            input_artifact_list = [Artifact(self.lims, uri=uri) for uri in uris]
         except:
             pass
         return input_artifact_list
 
+    def _set_uri(self, uri):
+        super(Artifact, self)._set_uri(uri)
+        self._state = _NOT_PARSED
+
     def get_state(self):
         "Parse out the state value from the URI."
-        parts = urlparse(self.uri)
-        params = parse_qs(parts.query)
-        try:
-            return params['state'][0]
-        except (KeyError, IndexError):
-            return None
+        if self._state is _NOT_PARSED:
+            state = None
+            if self._uri and '?' in self._uri:
+                state = parse_qs(urlsplit(self._uri).query).get('state', [None])[0]
+            self._state = state
+        return self._state
 
     @property
     def container(self):
@@ -601,8 +845,8 @@ class Artifact(Entity):
 
     def stateless(self):
         "returns the artefact independently of it's state"
-        parts = urlparse(self.uri)
-        if 'state' in parts[4]:
+        if self.state is not None:
+            parts = urlparse(self.uri)
             stateless_uri = urlunparse([parts[0], parts[1], parts[2], parts[3], '', ''])
             return Artifact(self.lims, uri=stateless_uri)
         else:
@@ -613,9 +857,10 @@ class Artifact(Entity):
     stateless = property(stateless)
 
     def _get_workflow_stages_and_statuses(self):
-        self.get()
+        with _pinned(self):
+            self.get()
+            rootnode = self.root.find('workflow-stages')
         result = []
-        rootnode = self.root.find('workflow-stages')
         for node in rootnode.findall('workflow-stage'):
             result.append((Stage(self.lims, uri=node.attrib['uri']), node.attrib['status'], node.attrib['name']))
         return result
@@ -631,6 +876,8 @@ class Artifact(Entity):
 class StepPlacements(Entity):
     """Placements from within a step. Supports POST"""
 
+    __slots__ = ()
+
     selected_containers = EntityListDescriptor(tag='container', klass=Container, nesting=['selected-containers'])
     """List of :py:class:`container <pyclarity_lims.entities.Container>`"""
     _placement_list      = OutputPlacementListDescriptor()
@@ -682,9 +929,11 @@ class StepActions(Entity):
     def escalation(self):
         # TODO: Convert to using descriptor and document
         if not self._escalation:
-            self.get()
+            with _pinned(self):
+                self.get()
+                root = self.root
             self._escalation = {}
-            for node in self.root.findall('escalation'):
+            for node in root.findall('escalation'):
                 self._escalation['artifacts'] = []
                 self._escalation['author'] = Researcher(self.lims,
                                                         uri=node.find('request').find('author').attrib.get('uri'))
@@ -705,6 +954,9 @@ class StepActions(Entity):
 
 class ReagentKit(Entity):
     """Type of Reagent with information about the provider"""
+
+    __slots__ = ()
+
     _URI = "reagentkits"
     _TAG = "reagent-kit"
     _PREFIX = 'kit'
@@ -721,6 +973,9 @@ class ReagentKit(Entity):
 
 class ReagentLot(Entity):
     """Reagent Lots contain information about a particulal lot of reagent used in a step"""
+
+    __slots__ = ()
+
     _URI = "reagentlots"
     _TAG = "reagent-lot"
     _PREFIX = 'lot'
@@ -748,12 +1003,16 @@ class ReagentLot(Entity):
 
 
 class StepReagentLots(Entity):
+    __slots__ = ()
+
     reagent_lots = EntityListDescriptor('reagent-lot', ReagentLot, nesting=['reagent-lots'])
     """List of :py:class:`ReagentLot <pyclarity_lims.entities.ReagentLot>`"""
 
 class StepDetails(Entity):
     """Detail associated with a step"""
 
+    __slots__ = ()
+
     input_output_maps = InputOutputMapList(nesting=['input-output-maps'])
     """
         list of tuples (input, output) where input and output item are dictionaries representing the input/output.
@@ -783,6 +1042,8 @@ class StepDetails(Entity):
 class StepProgramStatus(Entity):
     """Status display in the step"""
 
+    __slots__ = ()
+
     status  = StringDescriptor('status')
     """Status of the program"""
     message = StringDescriptor('message')
@@ -790,6 +1051,8 @@ class StepProgramStatus(Entity):
 
 
 class StepPools(Entity):
+    __slots__ = ()
+
     pooled_inputs = MutableDescriptor(XmlPooledInputDict)
     """Dictionary where the key are the pool names and the values are tuples (pool, inputs) representing a pool.
     Each tuple has two elements:
@@ -849,10 +1112,12 @@ class Step(Entity):
         List of available program to trigger.
         Each element is a tuple with the name and the trigger uri
         """
-        self.get()
+        with _pinned(self):
+            self.get()
+            root = self.root
         if not self._available_programs:
             self._available_programs = []
-            available_programs_et = self.root.find('available-programs')
+            available_programs_et = root.find('available-programs')
             if available_programs_et:
                 for ap in available_programs_et.findall('available-program'):
                     self._available_programs.append((ap.attrib['name'], ap.attrib['uri']))
@@ -952,13 +1217,15 @@ class Step(Entity):
                 input_node.attrib['replicates'] = str(replicates[i])
         data = lims.tostring(ElementTree.ElementTree(instance.root))
         instance.root = lims.post(uri=lims.get_uri(cls._URI), data=data)
-        instance._uri = instance.root.attrib['uri']
+        instance._set_uri(instance.root.attrib['uri'])
         return instance
 
 
 class ProtocolStep(Entity):
     """Steps key in the Protocol object"""
 
+    __slots__ = ()
+
     _TAG = 'step'
 
     name = StringAttributeDescriptor("name")
@@ -981,6 +1248,9 @@ class ProtocolStep(Entity):
 
 class Protocol(Entity):
     """Protocol, holding ProtocolSteps and protocol-properties"""
+
+    __slots__ = ()
+
     _URI = 'configuration/protocols'
     _TAG = 'protocol'
 
@@ -992,6 +1262,9 @@ class Protocol(Entity):
 
 class Stage(Entity):
     """Holds Protocol/Workflow"""
+
+    __slots__ = ()
+
     name = StringAttributeDescriptor('name')
     """Name of the stage."""
     index = IntegerAttributeDescriptor('index')
@@ -1006,6 +1279,9 @@ class Stage(Entity):
 
 class Workflow(Entity):
     """ Workflow, introduced in 3.5"""
+
+    __slots__ = ()
+
     _URI = "configuration/workflows"
     _TAG = "workflow"
 
@@ -1042,6 +1318,9 @@ class ReagentType(Entity):
 
 class Queue(Entity):
     """Queue of a given workflow stage"""
+
+    __slots__ = ()
+
     _URI = "queues"
     _TAG= "queue"
     _PREFIX = "que"
@@ -0,0 +1,208 @@
+"""Instrumentation of the HTTP requests sent to the LIMS.
+
+Listeners registered with :py:meth:`Lims.add_request_listener <pyclarity_lims.lims.Lims.add_request_listener>`
+are called with a :py:class:`RequestEvent` after every request. This module provides an in-memory
+:py:class:`MetricsAggregator` that can render its statistics in the Prometheus text format and an
+:py:class:`OpenTelemetryExporter` turning the requests into spans when opentelemetry-api is installed.
+"""
+
+import math
+import re
+import threading
+from collections import namedtuple, OrderedDict, deque
+
+try:
+    from opentelemetry import trace
+except ImportError:
+    trace = None
+
+
+RequestEvent = namedtuple('RequestEvent', ['method', 'endpoint', 'uri', 'status', 'start', 'latency',
+                                           'request_bytes', 'response_bytes', 'parse_time', 'error'])
+RequestEvent.__new__.__defaults__ = (None,)
+"""
+Description of a request sent to the LIMS.
+
+- method: the HTTP verb in lower case.
+- endpoint: the family of the endpoint queried, such as artifacts, artifacts/batch/retrieve or steps/placements.
+- uri: the uri queried.
+- status: the HTTP status code of the response or None if no response was received.
+- start: the time the request was sent, in seconds since the epoch.
+- latency: the seconds spent waiting for the response.
+- request_bytes: the size of the body sent.
+- response_bytes: the size of the body received.
+- parse_time: the seconds spent parsing the response or None if the response was not parsed.
+- error: the exception raised by the request session, such as a timeout, or None if a response was received.
+"""
+
+
+def endpoint_family(uri):
+    """
+    Return the endpoint queried by a uri, without the server, API version, ids and query.
+
+    Example: ::
+
+        endpoint_family('https://claritylims.example.com/api/v2/steps/24-1234/placements')  # 'steps/placements'
+
+    """
+    path = uri.split('?')[0]
+    match = re.match(r'(?:[a-z]+://[^/]+)?/?api/[^/]+/?(.*)', path)
+    if not match:
+        return path.split('/')[-1]
+    # The ids are the only segments containing digits
+    return '/'.join(s for s in match.group(1).split('/') if s and not re.search(r'\d', s))
+
+
+def percentile(values, q):
+    """Return the q-th percentile (between 0 and 100) of the values using the nearest-rank method."""
+    if not values:
+        return None
+    values = sorted(values)
+    rank = int(math.ceil(q / 100.0 * len(values)))
+    return values[max(rank, 1) - 1]
+
+
+class _EndpointMetrics(object):
+
+    def __init__(self, max_samples):
+        self.count = 0
+        self.errors = 0
+        self.statuses = {}
+        self.latency_sum = 0.0
+        self.latencies = deque(maxlen=max_samples)
+        self.parse_time_sum = 0.0
+        self.request_bytes = 0
+        self.response_bytes = 0
+
+    def add(self, event):
+        self.count += 1
+        self.statuses[event.status] = self.statuses.get(event.status, 0) + 1
+        if event.status is None or event.status >= 400:
+            self.errors += 1
+        self.latency_sum += event.latency
+        self.latencies.append(event.latency)
+        self.parse_time_sum += event.parse_time or 0
+        self.request_bytes += event.request_bytes
+        self.response_bytes += event.response_bytes
+
+
+class MetricsAggregator(object):
+    """
+    Request listener keeping statistics per HTTP verb and endpoint family.
+
+    :param max_samples: The number of most recent latencies kept per endpoint to compute the percentiles.
+
+    Example: ::
+
+        metrics = MetricsAggregator()
+        lims.add_request_listener(metrics)
+        ...
+        for (method, endpoint), stats in metrics.summary().items():
+            print(method, endpoint, stats['count'], stats['p90'])
+
+    """
+
+    PERCENTILES = (50, 90, 99)
+
+    def __init__(self, max_samples=10000):
+        self.max_samples = max_samples
+        self._metrics = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __call__(self, event):
+        with self._lock:
+            key = (event.method, event.endpoint)
+            if key not in self._metrics:
+                self._metrics[key] = _EndpointMetrics(self.max_samples)
+            self._metrics[key].add(event)
+
+    def clear(self):
+        with self._lock:
+            self._metrics.clear()
+
+    def summary(self):
+        """
+        Return a dictionary keyed by (method, endpoint) of dictionaries with the count, errors, statuses,
+        total and percentiles of the latency (p50, p90, p99), total parse time and bytes sent and received.
+        """
+        summary = OrderedDict()
+        with self._lock:
+            for key, metrics in self._metrics.items():
+                stats = dict(
+                    count=metrics.count, errors=metrics.errors, statuses=dict(metrics.statuses),
+                    latency=metrics.latency_sum, parse_time=metrics.parse_time_sum,
+                    request_bytes=metrics.request_bytes, response_bytes=metrics.response_bytes
+                )
+                for q in self.PERCENTILES:
+                    stats['p%s' % q] = percentile(metrics.latencies, q)
+                summary[key] = stats
+        return summary
+
+    def prometheus_text(self, prefix='pyclarity_lims'):
+        """Return the statistics in the Prometheus text exposition format."""
+        lines = []
+
+        def metric(name, metric_type, help_text, samples):
+            lines.append('# HELP %s_%s %s' % (prefix, name, help_text))
+            lines.append('# TYPE %s_%s %s' % (prefix, name, metric_type))
+            for suffix, labels, value in samples:
+                label_text = ','.join('%s="%s"' % (k, v) for k, v in labels)
+                lines.append('%s_%s%s{%s} %s' % (prefix, name, suffix, label_text, value))
+
+        summary = self.summary()
+        metric('requests_total', 'counter', 'Number of requests sent to the LIMS.', [
+            ('', [('method', m), ('endpoint', e), ('status', status)], count)
+            for (m, e), stats in summary.items() for status, count in sorted(stats['statuses'].items(), key=str)
+        ])
+        latency_samples = []
+        for (m, e), stats in summary.items():
+            labels = [('method', m), ('endpoint', e)]
+            for q in self.PERCENTILES:
+                latency_samples.append(('', labels + [('quantile', q / 100.0)], stats['p%s' % q]))
+            latency_samples.append(('_sum', labels, stats['latency']))
+            latency_samples.append(('_count', labels, stats['count']))
+        metric('request_duration_seconds', 'summary', 'Time spent waiting for the LIMS.', latency_samples)
+        metric('parse_duration_seconds_total', 'counter', 'Time spent parsing the responses.', [
+            ('', [('method', m), ('endpoint', e)], stats['parse_time']) for (m, e), stats in summary.items()
+        ])
+        metric('request_bytes_total', 'counter', 'Bytes sent to the LIMS.', [
+            ('', [('method', m), ('endpoint', e)], stats['request_bytes']) for (m, e), stats in summary.items()
+        ])
+        metric('response_bytes_total', 'counter', 'Bytes received from the LIMS.', [
+            ('', [('method', m), ('endpoint', e)], stats['response_bytes']) for (m, e), stats in summary.items()
+        ])
+        return '\n'.join(lines) + '\n'
+
+
+class OpenTelemetryExporter(object):
+    """
+    Request listener recording each request as an OpenTelemetry span. Requires the opentelemetry-api package.
+
+    :param tracer: The tracer creating the spans. By default the tracer of the global tracer provider is used.
+    """
+
+    def __init__(self, tracer=None):
+        if trace is None:
+            raise ImportError('OpenTelemetryExporter requires the opentelemetry-api package')
+        self.tracer = tracer or trace.get_tracer(__name__)
+
+    def __call__(self, event):
+        end = event.start + event.latency + (event.parse_time or 0)
+        attributes = {
+            'http.method': event.method.upper(),
+            'http.url': event.uri,
+            'lims.endpoint': event.endpoint,
+            'http.request_content_length': event.request_bytes,
+            'http.response_content_length': event.response_bytes,
+        }
+        if event.status is not None:
+            attributes['http.status_code'] = event.status
+        if event.parse_time is not None:
+            attributes['lims.parse_time'] = event.parse_time
+        if event.error is not None:
+            attributes['error.type'] = type(event.error).__name__
+        span = self.tracer.start_span(
+            'LIMS %s %s' % (event.method.upper(), event.endpoint),
+            start_time=int(event.start * 1e9), attributes=attributes
+        )
+        span.end(end_time=int(end * 1e9))
@@ -2,23 +2,40 @@ __all__ = ['Lab', 'Researcher', 'Project', 'Sample',
            'Containertype', 'Container', 'Processtype', 'Process',
            'Artifact', 'Lims']
 
+import functools
+import hashlib
+import logging
 import os
+import pickle
 import re
+import threading
+import time
+import weakref
+from collections import namedtuple, OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor, wait
 from io import BytesIO
 import requests
 
+try:
+    from collections.abc import Mapping
+except ImportError:
+    from collections import Mapping
+
 # python 2.7, 3+ compatibility
 from sys import version_info
 
 if version_info[0] == 2:
-    from urlparse import urljoin
+    from urlparse import urljoin, urlsplit, parse_qs
     from urllib import urlencode
 else:
-    from urllib.parse import urljoin
+    from urllib.parse import urljoin, urlsplit, parse_qs
     from urllib.parse import urlencode
 
 
 from .entities import *
+from .instrumentation import RequestEvent, endpoint_family
+
+logger = logging.getLogger(__name__)
 
 # Python 2.6 support work-arounds
 # - Exception ElementTree.ParseError does not exist
@@ -34,6 +51,230 @@ if version_info[:2] < (2,7):
     ElementTree.ElementTree.write = write_with_xml_declaration
 
 TIMEOUT = 16
+MAX_WORKERS = 8
+# Size of the connection pool of the default session and of the worker pool
+POOL_SIZE = 100
+BATCH_SIZE = 500
+
+
+BatchChunkResult = namedtuple('BatchChunkResult', ['instances', 'error', 'refresh_error'])
+"""Outcome of one chunk of a batch query: the instances of the chunk, the exception raised or None, and for
+:py:meth:`Lims.put_batch` with refresh the exception raised when retrieving the updated instances again or None."""
+BatchChunkResult.__new__.__defaults__ = (None,)
+
+
+class BatchError(requests.exceptions.HTTPError):
+    """
+    Raised when some chunks of a batch query failed. The successful chunks have been applied.
+
+    :param results: list of :py:class:`BatchChunkResult` for all the chunks.
+    """
+
+    def __init__(self, results):
+        self.results = results
+        self.errors = [r for r in results if r.error is not None or r.refresh_error is not None]
+        first = self.errors[0]
+        super(BatchError, self).__init__(
+            '%s of %s batch chunks failed: %s' % (
+                len(self.errors), len(results),
+                first.error if first.error is not None else 'refresh: %s' % first.refresh_error
+            )
+        )
+
+    @property
+    def failed_instances(self):
+        """List of the instances in the chunks that failed, or only those missing from the response of the LIMS."""
+        return [i for r in self.errors if r.error is not None for i in getattr(r.error, 'instances', r.instances)]
+
+    @property
+    def refresh_failed_instances(self):
+        """List of the instances updated by :py:meth:`Lims.put_batch` that could not be retrieved again."""
+        return [i for r in self.errors if r.refresh_error is not None
+                for i in getattr(r.refresh_error, 'failed_instances', _updated_instances(r))]
+
+
+class MissingInstancesError(requests.exceptions.HTTPError):
+    """
+    Error of a chunk of a batch query when the response of the LIMS does not account for some of its instances.
+
+    :param instances: The instances missing from the response.
+    """
+
+    def __init__(self, instances):
+        self.instances = instances
+        super(MissingInstancesError, self).__init__(
+            '%s instances missing from the response of the LIMS: %s' % (
+                len(instances), ', '.join(str(i) for i in instances)
+            )
+        )
+
+
+def _updated_instances(result):
+    """Return the instances of a chunk of :py:meth:`Lims.put_batch` that the LIMS updated."""
+    if result.error is None:
+        return result.instances
+    if isinstance(result.error, MissingInstancesError):
+        return [i for i in result.instances if i not in result.error.instances]
+    return []
+
+
+class _BatchRetrieval(object):
+    """
+    Plan of a :py:meth:`Lims.get_batch` call: the chunks to query, the uris registered in flight and the instances
+    another query is already retrieving. The queries themselves are sent by the caller, so that the same plan
+    serves the synchronous and the asynchronous clients.
+    """
+
+    def __init__(self, lims, instances, force=False, batch_size=None):
+        self.lims = lims
+        # The same id can be used by different classes (i.e. Process and Step)
+        # and by Artifacts in different states
+        self.class_maps = OrderedDict()
+        for instance in instances:
+            self.class_maps.setdefault(instance.__class__, OrderedDict())[instance.uri] = instance
+
+        self.chunks = []
+        self.flights = {}
+        self.waiting = []
+        for klass, instance_map in self.class_maps.items():
+            to_retrieve = [i for i in instance_map.values() if force or i.root is None]
+            if klass._BATCH:
+                started, pending = lims._start_flights(i.uri for i in to_retrieve)
+                self.flights.update(started)
+                self.waiting.extend((i, pending[i.uri]) for i in to_retrieve if i.uri in pending)
+                # The LIMS returns a single state per id in a query: the nth uri of each id goes in the nth round
+                rounds = []
+                nb_seen = {}
+                for i in to_retrieve:
+                    if i.uri not in started:
+                        continue
+                    n = nb_seen[i.id] = nb_seen.get(i.id, 0) + 1
+                    if n > len(rounds):
+                        rounds.append([])
+                    rounds[n - 1].append(i)
+                for instances_round in rounds:
+                    self.chunks.extend(lims._split(instances_round, batch_size))
+            else:
+                self.chunks.extend([i] for i in to_retrieve)
+
+    def request(self, chunk):
+        """:return the uri and the data of the batch query retrieving the chunk."""
+        klass = chunk[0].__class__
+        root = ElementTree.Element(nsmap('ri:links'))
+        for instance in chunk:
+            ElementTree.SubElement(root, 'link', dict(uri=instance.uri, rel=klass._URI))
+        return self.lims.get_uri(klass._URI, 'batch/retrieve'), self.lims.tostring(ElementTree.ElementTree(root))
+
+    def assign(self, chunk, root):
+        """Set the content of the instances found in the response and return the set of their ids."""
+        chunk_ids = dict((instance.id, instance) for instance in chunk)
+        retrieved = set()
+        for node in root:
+            chunk_ids[node.attrib['limsid']].root = node
+            retrieved.add(node.attrib['limsid'])
+        return retrieved
+
+    def fail(self, chunk, error):
+        """End the flights of a chunk whose query failed."""
+        for instance in chunk:
+            self.lims._end_flight(instance.uri, self.flights[instance.uri], error=error)
+
+    def complete(self, chunk, retrieved):
+        """
+        End the flights of a chunk whose query succeeded.
+
+        :raise MissingInstancesError: if some instances were not in the response.
+        """
+        missing = [instance for instance in chunk if instance.id not in retrieved]
+        error = MissingInstancesError(missing) if missing else None
+        for instance in chunk:
+            if instance.id in retrieved:
+                self.lims._end_flight(instance.uri, self.flights[instance.uri], instance.root)
+            else:
+                self.lims._end_flight(instance.uri, self.flights[instance.uri], error=error)
+        if error is not None:
+            raise error
+
+    def release(self, error):
+        """End the flights of the chunks that did not run, so that the threads waiting for them are released."""
+        for uri, future in self.flights.items():
+            if not future.done():
+                self.lims._end_flight(uri, future, error=error)
+
+    def finish(self, results, awaited):
+        """
+        :param results: list of :py:class:`BatchChunkResult` of the chunks.
+        :param awaited: list of tuples of an instance of waiting, and the root or the error of its query.
+        :return: the list of the requested instances.
+        :raise BatchError: if some chunks or awaited queries failed.
+        """
+        results = list(results)
+        for instance, outcome in awaited:
+            if isinstance(outcome, Exception):
+                results.append(BatchChunkResult([instance], outcome))
+            elif instance.root is None:
+                instance.root = outcome
+        if any(r.error is not None for r in results):
+            raise BatchError(results)
+        return [i for instance_map in self.class_maps.values() for i in instance_map.values()]
+
+
+# Marks the threads of the worker pools, whose nested concurrent calls run inline
+_pool_thread = threading.local()
+
+
+# Lims of the current process reused when unpickling entities, keyed by server, user and API version.
+# The references are weak so that registering a Lims does not keep it and its cache alive.
+_lims_registry = weakref.WeakValueDictionary()
+_lims_registry_lock = threading.Lock()
+
+
+def _register_lims(lims):
+    with _lims_registry_lock:
+        _lims_registry[(lims.baseuri, lims.username, lims.VERSION)] = lims
+
+
+def _restore_lims(state):
+    """Return the Lims of the current process matching the pickled state.
+    The password is not pickled so the Lims needs to have been created in this process."""
+    key = (state['baseuri'], state['username'], state['version'])
+    with _lims_registry_lock:
+        lims = _lims_registry.get(key)
+    if lims is None:
+        raise pickle.UnpicklingError(
+            'No Lims for %s and user %s in this process: create one before unpickling or pass it to '
+            'Lims.import_entities' % (state['baseuri'], state['username'])
+        )
+    return lims
+
+
+def _drop_validators(validators, uri, root_ref):
+    """Remove the validators of a uri once the root they revalidate is garbage collected."""
+    entry = validators.get(uri)
+    if entry is not None and entry[3] is root_ref:
+        validators.pop(uri, None)
+
+
+def _entities_in(value):
+    """Return the list of entities in a value returned by an attribute, searching lists, tuples and mappings."""
+    if isinstance(value, Entity):
+        return [value]
+    if isinstance(value, Mapping):
+        value = list(value.values())
+    if isinstance(value, (list, tuple)):
+        return [e for v in value for e in _entities_in(v)]
+    return []
+
+
+def _unique(instances):
+    """Return the list of instances without duplicates, in order."""
+    seen = set()
+    unique = []
+    for instance in instances:
+        if id(instance) not in seen:
+            seen.add(id(instance))
+            unique.append(instance)
+    return unique
 
 
 class Lims(object):
@@ -44,6 +285,29 @@ class Lims(object):
     :param username: The account name of the user to login as.
     :param password: The password for the user account to login as.
     :param version: The optional LIMS API version, by default 'v2'
+    :param session: The optional transport used for every HTTP call made to the LIMS.
+                    It must provide the `requests.Session` interface (get, put, post).
+                    By default a `requests.Session` with keep-alive connection pools for http and https is used.
+    :param max_workers: The maximum number of requests sent concurrently by a call to the methods that parallelise
+                        queries. The calls share a pool of threads sized to the connection pool of the default
+                        session, or to max_workers with another session, released by :py:meth:`close`.
+    :param parallel_pages: If True, searches spanning several pages retrieve the pages concurrently
+                           instead of following the next-page links one after the other. The number of
+                           concurrent queries doubles after each group of pages, up to max_workers, and the last
+                           group can request pages past the end of the search.
+    :param batch_size: The maximum number of instances sent in a single batch query.
+    :param cache: The optional mapping of uri to Entity instances used to ensure there is only one instance per uri,
+                  such as a bounded :py:class:`EntityCache <pyclarity_lims.cache.EntityCache>`.
+                  By default an unbounded dictionary is used.
+    :param disk_cache: The optional persistent :py:class:`DiskCache <pyclarity_lims.cache.DiskCache>` consulted
+                       before sending GET queries.
+    :param revalidate: If True, GET queries of a uri already retrieved are sent with the ETag and Last-Modified
+                       validators of the previous response and the previously parsed XML is returned when the LIMS
+                       answers 304 or sends the same content. Local modifications of that XML that were not saved
+                       with put are then kept.
+    :param prefetch_siblings: If True, the first lazy load of an entity returned in a list (search results, inputs
+                              and outputs of a process, entity lists and placements) retrieves all the entities of the
+                              same class in that list that were not retrieved yet with a single batch query.
 
     Example: ::
 
@@ -53,18 +317,80 @@ class Lims(object):
 
     VERSION = 'v2'
 
-    def __init__(self, baseuri, username, password, version=VERSION):
+    def __init__(self, baseuri, username, password, version=VERSION, session=None,
+                 max_workers=MAX_WORKERS, parallel_pages=False, batch_size=BATCH_SIZE, cache=None,
+                 disk_cache=None, revalidate=False, prefetch_siblings=False):
 
         self.baseuri = baseuri.rstrip('/') + '/'
         self.username = username
         self.password = password
         self.VERSION = version
-        self.cache = dict()
-        # For optimization purposes, enables requests to persist connections
-        self.request_session = requests.Session()
-        # The connection pool has a default size of 10
-        self.adapter = requests.adapters.HTTPAdapter(pool_connections=100, pool_maxsize=100)
-        self.request_session.mount('http://', self.adapter)
+        self.cache = dict() if cache is None else cache
+        self.disk_cache = disk_cache
+        self.revalidate = revalidate
+        self.prefetch_siblings = prefetch_siblings
+        # uri -> (etag, last-modified, content digest, weak reference to the parsed root),
+        # removed when the root is garbage collected so that evicted instances do not leave validators behind
+        self._validators = {}
+        # uri -> Future of the root being retrieved, shared by the threads requesting the same uri concurrently
+        self._in_flight = {}
+        self._in_flight_lock = threading.Lock()
+        self.request_listeners = []
+        # Optional LazyLoadDetector recording the instances retrieved one by one
+        self.diagnostics = None
+        # The connection pool of the default session, None when a session is provided
+        self.adapter = None
+        if session is None:
+            # For optimization purposes, enables requests to persist connections
+            session = requests.Session()
+            # The connection pool has a default size of 10
+            self.adapter = requests.adapters.HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE)
+            session.mount('http://', self.adapter)
+            session.mount('https://', self.adapter)
+        self.request_session = session
+        self.max_workers = max_workers
+        # Threads shared by the methods that parallelise queries, started on first use
+        self._pool = None
+        self._pool_lock = threading.Lock()
+        self.parallel_pages = parallel_pages
+        self.batch_size = batch_size
+        # Unpickled entities are attached to the last Lims created for the same server and user
+        _register_lims(self)
+
+    def __reduce__(self):
+        # Only what identifies the Lims is pickled: no credentials, session or cache.
+        # The Lims of the process unpickling it is used instead.
+        state = dict(baseuri=self.baseuri, username=self.username, version=self.VERSION)
+        return _restore_lims, (state,)
+
+    def export_entities(self, instances, retrieve=True):
+        """
+        Serialise instances with their XML so they can be sent to another process, such as a worker of a
+        multiprocessing pool, which will not need to query the LIMS to access them.
+        The password is not serialised: in the other process the instances are attached to the last Lims created
+        for the same server and user, or to the Lims passed to :py:meth:`import_entities`.
+
+        :param instances: List of instances children of Entity
+        :param retrieve: If True, the instances not retrieved yet are retrieved with get_batch before serialising.
+        :return: bytes to pass to :py:meth:`import_entities`.
+        """
+        instances = list(instances)
+        if retrieve:
+            self.get_batch(instances)
+        return pickle.dumps(instances, pickle.HIGHEST_PROTOCOL)
+
+    @staticmethod
+    def import_entities(data, lims=None):
+        """
+        Return the list of instances serialised by :py:meth:`export_entities`.
+
+        :param data: bytes returned by :py:meth:`export_entities`.
+        :param lims: The Lims the instances are attached to. By default the last Lims created in this process
+                     for the same server and user.
+        """
+        if lims is not None:
+            _register_lims(lims)
+        return pickle.loads(data)
 
     def get_uri(self, *segments, **query):
         """
@@ -80,6 +406,75 @@ class Lims(object):
             url += '?' + urlencode(query)
         return url
 
+    def add_request_listener(self, listener):
+        """
+        Register a function called with a :py:class:`RequestEvent <pyclarity_lims.instrumentation.RequestEvent>`
+        after every request sent to the LIMS, such as a
+        :py:class:`MetricsAggregator <pyclarity_lims.instrumentation.MetricsAggregator>`.
+        Listeners can be called from several threads at once.
+        """
+        self.request_listeners.append(listener)
+
+    def remove_request_listener(self, listener):
+        """Unregister a function registered with :py:meth:`add_request_listener`."""
+        self.request_listeners.remove(listener)
+
+    def _request(self, method, uri, parse=None, **kwargs):
+        """
+        Send an HTTP request to the LIMS through the request session.
+        All the HTTP verbs go through this function so they share the same connection pools.
+
+        :param method: the name of the HTTP verb in lower case (get, put or post)
+        :param uri: the uri to query
+        :param parse: optional function called with the response, whose result is returned instead of the response.
+                      The time it takes is reported to the request listeners as parse time.
+        :param kwargs: additional arguments passed to the request session
+
+        :return the response object
+        """
+        kwargs.setdefault('auth', (self.username, self.password))
+        start = time.time()
+        try:
+            r = getattr(self.request_session, method)(uri, **kwargs)
+        except requests.exceptions.RequestException as e:
+            # Timeouts and connection errors are reported to the listeners without response
+            self._notify_request(method, uri, kwargs.get('data'), start, time.time() - start, error=e)
+            if isinstance(e, requests.exceptions.ConnectionError):
+                raise type(e)("{0}, Error trying to reach {1}".format(e, uri))
+            raise
+        latency = time.time() - start
+        if parse is None:
+            self._notify_request(method, uri, kwargs.get('data'), start, latency, r)
+            return r
+        try:
+            return parse(r)
+        finally:
+            self._notify_request(method, uri, kwargs.get('data'), start, latency, r, time.time() - start - latency)
+
+    def _notify_request(self, method, uri, data, start, latency, response=None, parse_time=None, error=None):
+        """Send the description of a request to the request listeners."""
+        if not self.request_listeners:
+            return
+        event = RequestEvent(
+            method=method, endpoint=endpoint_family(uri), uri=uri,
+            status=response.status_code if response is not None else None, start=start, latency=latency,
+            request_bytes=self._size(data), response_bytes=self._size(getattr(response, 'content', None)),
+            parse_time=parse_time, error=error
+        )
+        for listener in list(self.request_listeners):
+            try:
+                listener(event)
+            except Exception:
+                # Instrumentation must never break the queries
+                logger.exception('Request listener %r failed', listener)
+
+    @staticmethod
+    def _size(content):
+        try:
+            return len(content)
+        except TypeError:
+            return 0
+
     def get(self, uri, params=dict()):
         """
         GET data from the URI. It checks the status and return the text of response as an ElementTree.
@@ -89,17 +484,116 @@ class Lims(object):
 
         :return the text of response as an ElementTree
 
+        Concurrent calls for the same uri without parameters share a single query.
         """
+        if params:
+            return self._get(uri, params)
+        started, pending = self._start_flights([uri])
+        if pending:
+            return pending[uri].result()
+        future = started[uri]
         try:
-            r = self.request_session.get(uri, params=params,
-                                         auth=(self.username, self.password),
-                                         headers=dict(accept='application/xml'),
-                                         timeout=TIMEOUT)
-        except requests.exceptions.ConnectionError as e:
-            raise type(e)("{0}, Error trying to reach {1}".format(e.message, uri))
+            root = self._get(uri)
+        except BaseException as e:
+            # Also on KeyboardInterrupt, so that the uri is not left in flight forever
+            self._end_flight(uri, future, error=e)
+            raise
+        self._end_flight(uri, future, root)
+        return root
 
-        else:
-            return self.parse_response(r)
+    def _get(self, uri, params=dict()):
+        root = None if params else self._get_cached(uri)
+        if root is None:
+            r, root = self._request('get', uri, **self._get_query(uri, params))
+            if not params:
+                self._cache_response(uri, r, root)
+        return root
+
+    def _get_cached(self, uri):
+        """Return the root of the uri stored in the disk cache, or None."""
+        if self.disk_cache is not None:
+            content = self.disk_cache.get(uri)
+            if content is not None:
+                return ElementTree.fromstring(content)
+
+    def _cache_response(self, uri, r, root):
+        """Store the content of the response to a GET of the uri in the disk cache."""
+        if self.disk_cache is not None:
+            if r.status_code == 304:
+                self.disk_cache.set(uri, self.tostring(ElementTree.ElementTree(root)))
+            else:
+                self.disk_cache.set(uri, r.content)
+
+    def _forget(self, uri):
+        """Drop the cached content and the validators of the uri before it is modified."""
+        if self.disk_cache is not None:
+            self.disk_cache.delete(uri)
+        self._validators.pop(uri, None)
+
+    def _start_flights(self, uris):
+        """
+        Register the uris about to be retrieved in the table of queries in flight.
+
+        :return a tuple of two dictionaries mapping uris to futures: the uris registered by this call,
+                which must be ended with _end_flight, and the uris already being retrieved by another thread.
+        """
+        started, pending = OrderedDict(), OrderedDict()
+        with self._in_flight_lock:
+            for uri in uris:
+                if uri in started:
+                    continue
+                if uri in self._in_flight:
+                    pending[uri] = self._in_flight[uri]
+                else:
+                    started[uri] = self._in_flight[uri] = Future()
+        return started, pending
+
+    def _end_flight(self, uri, future, root=None, error=None):
+        """Remove the uri from the queries in flight and pass the root or the error to the waiting threads."""
+        with self._in_flight_lock:
+            if self._in_flight.get(uri) is future:
+                del self._in_flight[uri]
+            if future.done():
+                # Already released by an interrupted call whose query was still running in the worker pool
+                return
+            if error is not None:
+                future.set_exception(error)
+            else:
+                future.set_result(root)
+
+    def _get_query(self, uri, params=dict()):
+        """
+        Build the arguments of the request GETting the uri, whose parse function returns a tuple of the response
+        and the root. When revalidate is set and there are no params, the query is conditional and the previous
+        root is reused if the content did not change.
+        """
+        if not self.revalidate or params:
+            return dict(params=params, headers=dict(accept='application/xml'), timeout=TIMEOUT,
+                        parse=lambda r: (r, self.parse_response(r)))
+        headers = dict(accept='application/xml')
+        etag, last_modified, digest, previous_ref = self._validators.get(uri, (None, None, None, None))
+        previous_root = previous_ref() if previous_ref else None
+        if previous_root is not None:
+            if etag:
+                headers['If-None-Match'] = etag
+            if last_modified:
+                headers['If-Modified-Since'] = last_modified
+
+        def parse(r):
+            if previous_root is not None and r.status_code == 304:
+                return r, previous_root
+            self.validate_response(r)
+            new_digest = hashlib.sha1(r.content).hexdigest()
+            root = previous_root
+            if root is None or new_digest != digest:
+                root = ElementTree.fromstring(r.content)
+            self._validators[uri] = (
+                r.headers.get('ETag'), r.headers.get('Last-Modified'), new_digest,
+                weakref.ref(root, functools.partial(_drop_validators, self._validators, uri))
+            )
+            return r, root
+
+        return dict(headers=headers, timeout=TIMEOUT, parse=parse)
 
     def get_file_contents(self, id=None, uri=None, encoding=None, crlf=False):
         """Returns the contents of the file of <ID> or <uri>"""
@@ -110,7 +604,7 @@ class Lims(object):
         else:
             raise ValueError('id or uri required')
 
-        r = self.request_session.get(url, auth=(self.username, self.password), timeout=TIMEOUT)
+        r = self._request('get', url, timeout=TIMEOUT)
         self.validate_response(r)
         if encoding:
             r.encoding = encoding
@@ -144,8 +638,7 @@ class Lims(object):
 
         # Actually upload the file
         uri = self.get_uri('files', file.id, 'upload')
-        r = requests.post(uri, files={'file': (file_to_upload, open(file_to_upload, 'rb'))},
-                          auth=(self.username, self.password))
+        r = self._request('post', uri, files={'file': (file_to_upload, open(file_to_upload, 'rb'))})
         self.validate_response(r)
         return file
 
@@ -154,22 +647,21 @@ class Lims(object):
         PUT the serialized XML to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.put(uri, data=data, params=params,
-                         auth=(self.username, self.password),
-                         headers={'content-type': 'application/xml',
-                                  'accept': 'application/xml'})
-        return self.parse_response(r)
+        self._forget(uri)
+        return self._request('put', uri, data=data, params=params,
+                             headers={'content-type': 'application/xml',
+                                      'accept': 'application/xml'},
+                             parse=self.parse_response)
 
     def post(self, uri, data, params=dict()):
         """
         POST the serialized XML to the given URI.
         Return the response XML as an ElementTree.
         """
-        r = requests.post(uri, data=data, params=params,
-                          auth=(self.username, self.password),
-                          headers={'content-type': 'application/xml',
-                                   'accept': 'application/xml'})
-        return self.parse_response(r, accept_status_codes=[200, 201, 202])
+        return self._request('post', uri, data=data, params=params,
+                             headers={'content-type': 'application/xml',
+                                      'accept': 'application/xml'},
+                             parse=lambda r: self.parse_response(r, accept_status_codes=[200, 201, 202]))
 
     def check_version(self):
         """
@@ -177,8 +669,7 @@ class Lims(object):
         does not match any of the versions given for the API.
         """
         uri = urljoin(self.baseuri, 'api')
-        r = requests.get(uri, auth=(self.username, self.password))
-        root = self.parse_response(r)
+        root = self._request('get', uri, parse=self.parse_response)
         tag = nsmap('ver:versions')
         assert tag == root.tag
         for node in root.findall('version'):
@@ -329,13 +820,9 @@ class Lims(object):
                                   projectlimsid=projectlimsid,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        root = self.get(self.get_uri(Sample._URI), params=params)
         total = 0
-        while params.get('start-index') is None:  # Loop over all pages.
+        for root in self._get_pages(self.get_uri(Sample._URI), params=params):
             total += len(root.findall("sample"))
-            node = root.find('next-page')
-            if node is None: break
-            root = self.get(node.attrib['uri'], params=params)
         return total
 
     def get_samples(self, name=None, projectname=None, projectlimsid=None,
@@ -351,13 +838,33 @@ class Lims(object):
                     and a string or list of strings as value.
         :param start_index: Page to retrieve; all if None.
 
+        """
+        return list(self.iter_samples(name=name, projectname=projectname, projectlimsid=projectlimsid,
+                                      udf=udf, udtname=udtname, udt=udt, start_index=start_index))
+
+    def iter_samples(self, name=None, projectname=None, projectlimsid=None,
+                     udf=dict(), udtname=None, udt=dict(), start_index=None, add_info=False):
+        """Iterate over the samples, filtered by keyword arguments, as the pages of the search are received.
+        The next page is retrieved in the background while the current one is consumed.
+
+        :param name: Sample name, or list of names.
+        :param projectlimsid: Samples for the project of the given LIMS id.
+        :param projectname: Samples for the project of the name.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param start_index: Page to retrieve; all if None.
+        :param add_info: Change the yielded items to tuples where the first element is the sample and
+                         the second is a dict of additional information provided in the query.
+
         """
         params = self._get_params(name=name,
                                   projectname=projectname,
                                   projectlimsid=projectlimsid,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Sample, params=params)
+        return self._iter_instances(Sample, add_info=add_info, params=params)
 
     def get_artifacts(self, name=None, type=None, process_type=None,
                       artifact_flag_name=None, working_flag=None, qc_flag=None,
@@ -386,6 +893,46 @@ class Lims(object):
         :param start_index: Page to retrieve; all if None.
         :param resolve: Send a batch query to the lims to get the content of all artifacts retrieved
 
+        """
+        artifacts = list(self.iter_artifacts(
+            name=name, type=type, process_type=process_type, artifact_flag_name=artifact_flag_name,
+            working_flag=working_flag, qc_flag=qc_flag, sample_name=sample_name, samplelimsid=samplelimsid,
+            artifactgroup=artifactgroup, containername=containername, containerlimsid=containerlimsid,
+            reagent_label=reagent_label, udf=udf, udtname=udtname, udt=udt, start_index=start_index
+        ))
+        if resolve:
+            return self.get_batch(artifacts)
+        else:
+            return artifacts
+
+    def iter_artifacts(self, name=None, type=None, process_type=None,
+                       artifact_flag_name=None, working_flag=None, qc_flag=None,
+                       sample_name=None, samplelimsid=None, artifactgroup=None, containername=None,
+                       containerlimsid=None, reagent_label=None,
+                       udf=dict(), udtname=None, udt=dict(), start_index=None, add_info=False):
+        """Iterate over the artifacts, filtered by keyword arguments, as the pages of the search are received.
+        The next page is retrieved in the background while the current one is consumed.
+
+        :param name: Artifact name, or list of names.
+        :param type: Artifact type, or list of types.
+        :param process_type: Produced by the process type, or list of types.
+        :param artifact_flag_name: Tagged with the genealogy flag, or list of flags.
+        :param working_flag: Having the given working flag; boolean.
+        :param qc_flag: Having the given QC flag: UNKNOWN, PASSED, FAILED.
+        :param sample_name: Related to the given sample name.
+        :param samplelimsid: Related to the given sample id.
+        :param artifactgroup: Belonging to the artifact group (experiment in client).
+        :param containername: Residing in given container, by name, or list.
+        :param containerlimsid: Residing in given container, by LIMS id, or list.
+        :param reagent_label: having attached reagent labels.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param start_index: Page to retrieve; all if None.
+        :param add_info: Change the yielded items to tuples where the first element is the artifact and
+                         the second is a dict of additional information provided in the query.
+
         """
         params = self._get_params(name=name,
                                   type=type,
@@ -401,10 +948,7 @@ class Lims(object):
                                   reagent_label=reagent_label,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        if resolve:
-            return self.get_batch(self._get_instances(Artifact, params=params))
-        else:
-            return self._get_instances(Artifact, params=params)
+        return self._iter_instances(Artifact, add_info=add_info, params=params)
 
     def get_containers(self, name=None, type=None,
                        state=None, last_modified=None,
@@ -465,6 +1009,33 @@ class Lims(object):
         :param add_info: Change the return type to a tuple where the first element is normal return and
                          the second is a dict of additional information provided in the query.
 
+        """
+        return list(self.iter_processes(last_modified=last_modified, type=type,
+                                        inputartifactlimsid=inputartifactlimsid, techfirstname=techfirstname,
+                                        techlastname=techlastname, projectname=projectname,
+                                        udf=udf, udtname=udtname, udt=udt, start_index=start_index))
+
+    def iter_processes(self, last_modified=None, type=None,
+                       inputartifactlimsid=None,
+                       techfirstname=None, techlastname=None, projectname=None,
+                       udf=dict(), udtname=None, udt=dict(), start_index=None, add_info=False):
+        """Iterate over the processes, filtered by keyword arguments, as the pages of the search are received.
+        The next page is retrieved in the background while the current one is consumed.
+
+        :param last_modified: Since the given ISO format datetime.
+        :param type: Process type, or list of types.
+        :param inputartifactlimsid: Input artifact LIMS id, or list of.
+        :param udf: dictionary of UDFs with 'UDFNAME[OPERATOR]' as keys.
+        :param udtname: UDT name, or list of names.
+        :param udt: dictionary of UDT UDFs with 'UDTNAME.UDFNAME[OPERATOR]' as keys
+                    and a string or list of strings as value.
+        :param techfirstname: First name of researcher, or list of.
+        :param techlastname: Last name of researcher, or list of.
+        :param projectname: Name of project, or list of.
+        :param start_index: Page to retrieve; all if None.
+        :param add_info: Change the yielded items to tuples where the first element is the process and
+                         the second is a dict of additional information provided in the query.
+
         """
         params = self._get_params(last_modified=last_modified,
                                   type=type,
@@ -474,7 +1045,7 @@ class Lims(object):
                                   projectname=projectname,
                                   start_index=start_index)
         params.update(self._get_params_udf(udf=udf, udtname=udtname, udt=udt))
-        return self._get_instances(Process, params=params)
+        return self._iter_instances(Process, add_info=add_info, params=params)
 
     def get_workflows(self, name=None, add_info=False):
         """
@@ -570,31 +1141,187 @@ class Lims(object):
             result["udt.%s" % key] = value
         return result
 
-    def _get_instances(self, klass, add_info=None, params=dict()):
-        results = []
-        additionnal_info_dicts = []
+    def _map_concurrently(self, func, items):
+        """
+        Apply func to every item using up to max_workers threads of the worker pool and return the results in the
+        order of items. If some items fail, the error of the first one is raised once all the items are processed.
+        Calls made from a thread of the pool, such as the batch query of a prefetch triggered in a chunk, run inline
+        so that the pool never waits for its own threads.
+        """
+        items = list(items)
+        if len(items) < 2 or self.max_workers < 2 or getattr(_pool_thread, 'active', False):
+            return [func(item) for item in items]
+        results = [None] * len(items)
+        errors = {}
+        remaining = iter(enumerate(items))
+        lock = threading.Lock()
+        interrupted = threading.Event()
+
+        def work():
+            _pool_thread.active = True
+            try:
+                while not interrupted.is_set():
+                    with lock:
+                        index, item = next(remaining, (None, None))
+                    if index is None:
+                        return
+                    try:
+                        results[index] = func(item)
+                    except Exception as e:
+                        errors[index] = e
+            finally:
+                _pool_thread.active = False
+
+        pool = self._get_pool()
+        futures = [pool.submit(work) for i in range(min(self.max_workers, len(items)))]
+        try:
+            wait(futures)
+        except BaseException:
+            # The items not started yet are abandoned when the caller is interrupted
+            interrupted.set()
+            raise
+        if errors:
+            raise errors[min(errors)]
+        return results
+
+    def _get_pool(self):
+        """Return the worker pool, sized to the connection pool of the default session or to max_workers."""
+        with self._pool_lock:
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(max_workers=POOL_SIZE if self.adapter is not None else self.max_workers)
+            return self._pool
+
+    def close(self):
+        """Release the threads of the worker pool once their queries are complete."""
+        with self._pool_lock:
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=True)
+
+    def _split(self, instances, batch_size=None):
+        """Split the list of instances in chunks of at most batch_size instances."""
+        batch_size = batch_size or self.batch_size
+        return [instances[i:i + batch_size] for i in range(0, len(instances), batch_size)]
+
+    def _map_chunks(self, func, chunks):
+        """
+        Apply func to every chunk concurrently.
+        Exceptions are captured per chunk so a failure does not prevent the other chunks from completing.
+
+        :return: list of :py:class:`BatchChunkResult` in the order of the chunks.
+        """
+        def run_chunk(chunk):
+            try:
+                func(chunk)
+            except Exception as e:
+                return BatchChunkResult(chunk, e)
+            return BatchChunkResult(chunk, None)
+
+        return self._map_concurrently(run_chunk, chunks)
+
+    def _get_pages(self, uri, params=dict()):
+        """
+        Generator yielding the root of each page of a search in the order provided by the server.
+        Only the first page is retrieved if params contains a start-index.
+        When parallel_pages is set, the page size is read from the first next-page link and the following pages are
+        retrieved concurrently using computed start-index offsets, by groups of 1, 2, 4, ... up to max_workers
+        queries. The last group can request pages past the end of the search: at most as many as the pages
+        retrieved before it.
+        """
+        root = self.get(uri, params=params)
+        yield root
+        if params.get('start-index') is not None:
+            return
+        node = root.find('next-page')
+        if node is None:
+            return
+        page_size = None
+        if self.parallel_pages:
+            start_index = parse_qs(urlsplit(node.attrib['uri']).query).get('start-index')
+            if start_index and start_index[0].isdigit() and int(start_index[0]) > 0:
+                page_size = int(start_index[0])
+        if page_size is None:
+            # Loop over all pages following the next-page links.
+            while node is not None:
+                root = self.get(node.attrib['uri'], params=params)
+                yield root
+                node = root.find('next-page')
+            return
+
+        def get_page(offset):
+            page_params = dict(params)
+            page_params['start-index'] = offset
+            return self.get(uri, params=page_params)
+
+        # The number of pages requested at once doubles up to max_workers so that short searches do not
+        # request pages past their end
+        offset = page_size
+        window = 1
+        while True:
+            offsets = [offset + i * page_size for i in range(window)]
+            for root in self._map_concurrently(get_page, offsets):
+                yield root
+                if root.find('next-page') is None:
+                    return
+            offset = offsets[-1] + page_size
+            window = min(window * 2, max(self.max_workers, 1))
+
+    def _prefetch_pages(self, pages):
+        """Generator yielding the items of pages while the next one is retrieved in a background thread."""
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            future = executor.submit(next, pages, None)
+            while True:
+                root = future.result()
+                if root is None:
+                    return
+                future = executor.submit(next, pages, None)
+                yield root
+
+    def _iter_instances(self, klass, add_info=None, params=dict(), prefetch=True):
+        """
+        Generator yielding the instances of klass found by a search, page by page.
+
+        :param klass: The class of the Entity searched.
+        :param add_info: Yield tuples where the first element is the instance and
+                         the second is a dict of additional information provided in the query.
+        :param params: dict containing the query parameters.
+        :param prefetch: Retrieve the next page in the background while the current one is consumed.
+        """
         tag = klass._TAG
         if tag is None:
             tag = klass.__name__.lower()
-        root = self.get(self.get_uri(klass._URI), params=params)
-        while params.get('start-index') is None:  # Loop over all pages.
-            for node in root.findall(tag):
-                results.append(klass(self, uri=node.attrib['uri']))
-                info_dict = {}
-                for attrib_key in node.attrib:
-                    info_dict[attrib_key] = node.attrib[attrib_key]
-                for subnode in node:
-                    info_dict[subnode.tag] = subnode.text
-                additionnal_info_dicts.append(info_dict)
-            node = root.find('next-page')
-            if node is None: break
-            root = self.get(node.attrib['uri'], params=params)
+        pages = self._get_pages(self.get_uri(klass._URI), params=params)
+        if prefetch:
+            pages = self._prefetch_pages(pages)
+        # All the results of the search form a single group
+        siblings = SiblingGroup()
+        for root in pages:
+            nodes = root.findall(tag)
+            instances = [klass(self, uri=node.attrib['uri']) for node in nodes]
+            siblings.add(instances)
+            for node, instance in zip(nodes, instances):
+                if add_info:
+                    info_dict = {}
+                    for attrib_key in node.attrib:
+                        info_dict[attrib_key] = node.attrib[attrib_key]
+                    for subnode in node:
+                        info_dict[subnode.tag] = subnode.text
+                    yield instance, info_dict
+                else:
+                    yield instance
+
+    def _get_instances(self, klass, add_info=None, params=dict()):
+        results = []
+        additionnal_info_dicts = []
+        for instance, info_dict in self._iter_instances(klass, add_info=True, params=params, prefetch=False):
+            results.append(instance)
+            additionnal_info_dicts.append(info_dict)
         if add_info:
             return results, additionnal_info_dicts
         else:
             return results
 
-    def get_batch(self, instances, force=False):
+    def get_batch(self, instances, force=False, batch_size=None):
         """Get the content of a set of instances using the efficient batch call.
 
         Returns the list of requested instances in arbitrary order, with duplicates removed
@@ -607,59 +1334,223 @@ class Lims(object):
         (this is similar to how Entity.get() works). This may help with caching.
 
         The batch request API call collapses all requested Artifacts with different
-        state into a single result with state equal to the state of the Artifact
-        occurring at the last position in the list.
+        state into a single result, so the instances sharing a LIMSID are sent in
+        separate queries and each one receives the content of its own state.
+
+        The instances can be of different classes: they are grouped by class and each class with a batch endpoint
+        (Artifact, Sample, Container) is sent in chunks of batch_size, while the instances of other classes are
+        retrieved individually. All the queries are sent concurrently.
+        If some chunks fail, the other chunks are still applied to their instances
+        and a :py:class:`BatchError` reporting the failed chunks is raised. Instances that are not listed in the
+        response of the LIMS are reported as failed with a :py:class:`MissingInstancesError`.
+        Instances that another thread is already retrieving are not queried again: their content is awaited
+        once the queries of this call are complete.
 
         :param instances: List of instances children of Entity
         :param force: optional argument to force the download of already cached instances
+        :param batch_size: optional maximum number of instances per query. Defaults to the Lims batch_size.
         """
         if not instances:
             return []
-        root = ElementTree.Element(nsmap('ri:links'))
-        needs_request = False
-        instance_map = {}
-        for instance in instances:
-            instance_map[instance.id] = instance
-            if force or instance.root is None:
-                ElementTree.SubElement(root, 'link', dict(uri=instance.uri,
-                                                          rel=instance.__class__._URI))
-                needs_request = True
+        batch = _BatchRetrieval(self, instances, force, batch_size)
+
+        def retrieve_chunk(chunk):
+            if not chunk[0]._BATCH:
+                for instance in chunk:
+                    instance.get(force=True)
+                return
+            try:
+                uri, data = batch.request(chunk)
+                retrieved = batch.assign(chunk, self.post(uri, data))
+            except BaseException as e:
+                batch.fail(chunk, e)
+                raise
+            batch.complete(chunk, retrieved)
 
-        if needs_request:
-            uri = self.get_uri(instance.__class__._URI, 'batch/retrieve')
-            data = self.tostring(ElementTree.ElementTree(root))
-            root = self.post(uri, data)
-            for node in root.getchildren():
-                instance = instance_map[node.attrib['limsid']]
-                instance.root = node
-        return instance_map.values()
+        try:
+            results = self._map_chunks(retrieve_chunk, batch.chunks)
+        except BaseException as e:
+            batch.release(e)
+            raise
+        awaited = []
+        for instance, future in batch.waiting:
+            try:
+                awaited.append((instance, future.result()))
+            except Exception as e:
+                awaited.append((instance, e))
+        return batch.finish(results, awaited)
 
-    def put_batch(self, instances):
+    def prefetch(self, instances, *paths):
         """
-        Update multiple instances using a single batch request.
+        Retrieve the instances and the entities they reference through the attribute paths, level by level.
+        All the entities found at the same depth are retrieved together with :py:meth:`get_batch`.
+
+        A path is a dot separated list of attributes returning an entity, a list of entities or a structure
+        containing entities such as the location of an artifact or the input_output_maps of a process.
 
         :param instances: List of instances children of Entity
+        :param paths: The attribute paths to follow from the instances.
+        :return: the list of instances.
 
+        Example: ::
+
+            artifacts = lims.get_artifacts(containername='plate1')
+            lims.prefetch(artifacts, 'samples.project', 'samples.submitter', 'location')
+
+        """
+        instances = list(instances)
+        tree = OrderedDict()
+        for path in paths:
+            node = tree
+            for attribute in path.split('.'):
+                node = node.setdefault(attribute, OrderedDict())
+
+        level = [(instances, tree)]
+        while level:
+            self.get_batch(_unique(i for entities, subtree in level for i in entities))
+            next_level = []
+            for entities, subtree in level:
+                for attribute, children in subtree.items():
+                    referenced = _unique(e for entity in entities for e in _entities_in(getattr(entity, attribute)))
+                    if referenced:
+                        next_level.append((referenced, children))
+            level = next_level
+        return instances
+
+    def put_batch(self, instances, batch_size=None, refresh=False):
         """
+        Update multiple instances using batch requests.
+
+        The instances are grouped by class and each class with a batch endpoint is sent in chunks of batch_size,
+        while the instances of other classes are updated individually. All the queries are sent concurrently.
+        If some chunks fail, the other chunks are still applied and a :py:class:`BatchError` reporting
+        the results of every chunk is raised. Instances of failed chunks keep their local modifications.
+        Instances that are not listed in the response of the LIMS are reported as failed with a
+        :py:class:`MissingInstancesError` and also keep their local modifications.
+        With refresh, the updated instances of each chunk are retrieved again once all the updates are sent.
+        A failed refresh does not fail the update: it is reported in the refresh_error of the chunk and in
+        :py:attr:`BatchError.refresh_failed_instances`, not in :py:attr:`BatchError.failed_instances`.
 
+        :param instances: List of instances children of Entity
+        :param batch_size: optional maximum number of instances per query. Defaults to the Lims batch_size.
+        :param refresh: If True, the content of the updated instances is retrieved again from the LIMS
+                        with batch queries.
+        :return: list of :py:class:`BatchChunkResult`, one per chunk.
+        """
         if not instances:
-            return
-
-        root = None  # XML root element for batch request
+            return []
 
+        def update_chunk(chunk):
+            if not chunk[0]._BATCH:
+                for instance in chunk:
+                    instance.put()
+                return
+            uri, data = self._batch_update_request(chunk)
+            missing = self._batch_updated(chunk, self.post(uri, data))
+            if missing:
+                raise MissingInstancesError(missing)
+
+        def refresh_chunk(result):
+            updated = _updated_instances(result)
+            if not updated:
+                return result
+            try:
+                self.get_batch(updated, force=True, batch_size=len(updated))
+            except Exception as e:
+                return result._replace(refresh_error=e)
+            return result
+
+        results = self._map_chunks(update_chunk, self._update_chunks(instances, batch_size))
+        if refresh:
+            results = self._map_concurrently(refresh_chunk, results)
+        if any(r.error is not None or r.refresh_error is not None for r in results):
+            raise BatchError(results)
+        return results
+
+    def _update_chunks(self, instances, batch_size=None):
+        """Group the instances to update by class and split the classes with a batch endpoint in chunks."""
+        class_lists = OrderedDict()
         for instance in instances:
-            if root is None:
-                klass = instance.__class__
-                # Tag is art:details, con:details, etc.
-                example_root = instance.root
-                ns_uri = re.match("{(.*)}.*", example_root.tag).group(1)
-                root = ElementTree.Element("{%s}details" % (ns_uri))
-
+            class_lists.setdefault(instance.__class__, []).append(instance)
+        chunks = []
+        for klass, klass_instances in class_lists.items():
+            if klass._BATCH:
+                chunks.extend(self._split(klass_instances, batch_size))
+            else:
+                chunks.extend([i] for i in klass_instances)
+        return chunks
+
+    def _batch_update_request(self, chunk):
+        """:return the uri and the data of the batch query updating the chunk."""
+        # Tag is art:details, con:details, etc.
+        ns_uri = re.match("{(.*)}.*", chunk[0].root.tag).group(1)
+        root = ElementTree.Element("{%s}details" % (ns_uri))
+        for instance in chunk:
             root.append(instance.root)
+            self._forget(instance.uri)
+        return self.get_uri(chunk[0]._URI, 'batch/update'), self.tostring(ElementTree.ElementTree(root))
+
+    def _batch_updated(self, chunk, links):
+        """Mark the instances listed in the response of a batch update as saved and return the missing ones."""
+        updated_ids = set(urlsplit(link.attrib['uri']).path.split('/')[-1] for link in links)
+        for instance in chunk:
+            if instance.id in updated_ids:
+                instance._saved()
+        return [instance for instance in chunk if instance.id not in updated_ids]
+
+    def create_batch(self, klass, specs, batch_size=None):
+        """
+        Create multiple instances using batch requests.
+
+        The instances are built from the specs the same way as klass.create and sent in chunks of batch_size
+        concurrently. The created instances are registered in the cache and their content is retrieved lazily.
+        If some chunks fail, the other chunks are still created and a :py:class:`BatchError` reporting
+        the results of every chunk is raised. A chunk also fails when the LIMS does not return one link per
+        instance, as the links cannot be matched to the specs; the error lists the links returned.
 
-        uri = self.get_uri(klass._URI, 'batch/update')
-        data = self.tostring(ElementTree.ElementTree(root))
-        root = self.post(uri, data)
+        :param klass: The class of the instances to create: :py:class:`Sample <pyclarity_lims.entities.Sample>`
+                      or :py:class:`Container <pyclarity_lims.entities.Container>`.
+        :param specs: List of dicts containing the keyword arguments of klass.create for each instance.
+                      For Samples it must include the container and position.
+        :param batch_size: optional maximum number of instances per query. Defaults to the Lims batch_size.
+        :return: list of the created instances in the order of the specs.
+
+        Example: ::
+
+            samples = lims.create_batch(Sample, [
+                dict(name='sample1', project=project, container=plate, position='A:1'),
+                dict(name='sample2', project=project, container=plate, position='B:1'),
+            ])
+
+        """
+        if klass not in (Sample, Container):
+            raise TypeError('%s instances cannot be created in batch' % klass.__name__)
+        if not specs:
+            return []
+        new_instances = [klass._create(self, **spec) for spec in specs]
+        created = {}
+
+        def create_chunk(chunk):
+            # Tag is smp:details or con:details
+            ns_uri = re.match("{(.*)}.*", chunk[0].root.tag).group(1)
+            root = ElementTree.Element("{%s}details" % (ns_uri))
+            for instance in chunk:
+                root.append(instance.root)
+            uri = self.get_uri(klass._URI, 'batch/create')
+            links = self.post(uri, self.tostring(ElementTree.ElementTree(root)))
+            if len(links) != len(chunk):
+                # The links cannot be matched to the instances
+                raise requests.exceptions.HTTPError(
+                    'The LIMS returned %s links for the %s instances created: %s' % (
+                        len(links), len(chunk), ', '.join(link.attrib.get('uri', '') for link in links)))
+            # The links are returned in the order of creation
+            for instance, link in zip(chunk, links):
+                created[instance] = klass(self, uri=link.attrib['uri'])
+
+        results = self._map_chunks(create_chunk, self._split(new_instances, batch_size))
+        if any(r.error is not None for r in results):
+            raise BatchError(results)
+        return [created[instance] for instance in new_instances]
 
     def route_artifacts(self, artifact_list, workflow_uri=None, stage_uri=None, unassign=False):
         """
@@ -686,8 +1577,7 @@ class Lims(object):
             a.set('uri', artifact.uri)
 
         uri = self.get_uri('route', 'artifacts')
-        r = requests.post(uri, data=self.tostring(ElementTree.ElementTree(root)),
-                          auth=(self.username, self.password),
+        r = self._request('post', uri, data=self.tostring(ElementTree.ElementTree(root)),
                           headers={'content-type': 'application/xml',
                                    'accept': 'application/xml'})
         self.validate_response(r)
@@ -0,0 +1,208 @@
+"""Geometry of the wells of a container.
+
+The LIMS identifies a well by a "row:column" string such as "A:1" where the row is on the y dimension and the column
+on the x dimension of the :py:class:`Containertype <pyclarity_lims.entities.Containertype>`.
+:py:class:`PlateGeometry` converts lists of these labels to and from integer indices in row-major or column-major
+order using precomputed lookup tables, and :py:func:`to_quadrant`/:py:func:`from_quadrants` map the wells of a
+96-well plate to the quadrants of a 384-well plate.
+"""
+
+ROW_MAJOR = 'row'
+COLUMN_MAJOR = 'column'
+
+
+def _dimension_labels(dimension):
+    if dimension['is_alpha']:
+        return [_alpha_label(i + dimension['offset']) for i in range(dimension['size'])]
+    return [str(i + dimension['offset']) for i in range(dimension['size'])]
+
+
+def _alpha_label(position):
+    # A to Z then AA, AB, ... like spreadsheet columns
+    label = ''
+    position += 1
+    while position:
+        position, remainder = divmod(position - 1, 26)
+        label = chr(ord('A') + remainder) + label
+    return label
+
+
+class PlateGeometry(object):
+    """
+    Wells of a container with rows on the y dimension and columns on the x dimension.
+
+    :param x_dimension: dictionary with is_alpha, offset and size describing the columns,
+                        as returned by Containertype.x_dimension.
+    :param y_dimension: dictionary with is_alpha, offset and size describing the rows,
+                        as returned by Containertype.y_dimension.
+    :param unavailable_wells: labels of the wells that cannot be used.
+
+    Example: ::
+
+        geometry = PlateGeometry.from_containertype(container.type)
+        geometry.indices(['A:1', 'B:1'], order='column')  # [0, 1]
+        geometry.labels([0, 1])  # ['A:1', 'A:2']
+
+    """
+
+    def __init__(self, x_dimension, y_dimension, unavailable_wells=None):
+        self.x_dimension = dict(x_dimension)
+        self.y_dimension = dict(y_dimension)
+        self.rows = _dimension_labels(self.y_dimension)
+        self.columns = _dimension_labels(self.x_dimension)
+        self.unavailable_wells = set(unavailable_wells or [])
+        self._row_major = [r + ':' + c for r in self.rows for c in self.columns]
+        self._column_major = [r + ':' + c for c in self.columns for r in self.rows]
+        self._positions = {}
+        for row, row_label in enumerate(self.rows):
+            for column, column_label in enumerate(self.columns):
+                self._positions[row_label + ':' + column_label] = (row, column)
+
+    @classmethod
+    def from_containertype(cls, containertype):
+        """Create the geometry of a :py:class:`Containertype <pyclarity_lims.entities.Containertype>`."""
+        return cls(containertype.x_dimension, containertype.y_dimension, containertype.unavailable_wells)
+
+    @property
+    def size(self):
+        """Number of wells in the container."""
+        return len(self._row_major)
+
+    def __len__(self):
+        return self.size
+
+    def __contains__(self, label):
+        return label in self._positions
+
+    def __eq__(self, other):
+        return isinstance(other, PlateGeometry) and (self.rows, self.columns) == (other.rows, other.columns)
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return '%s(%s rows, %s columns)' % (self.__class__.__name__, len(self.rows), len(self.columns))
+
+    def _check_order(self, order):
+        if order not in (ROW_MAJOR, COLUMN_MAJOR):
+            raise ValueError("order must be '%s' or '%s' not %r" % (ROW_MAJOR, COLUMN_MAJOR, order))
+
+    def wells(self, order=ROW_MAJOR, available_only=False):
+        """
+        Return the labels of all the wells.
+
+        :param order: 'row' for A:1, A:2, ... or 'column' for A:1, B:1, ...
+        :param available_only: exclude the unavailable wells.
+        """
+        self._check_order(order)
+        wells = self._row_major if order == ROW_MAJOR else self._column_major
+        if available_only:
+            return [w for w in wells if w not in self.unavailable_wells]
+        return list(wells)
+
+    def position(self, label):
+        """Return the tuple (row, column) of a well label, both starting at 0."""
+        try:
+            return self._positions[label]
+        except KeyError:
+            raise ValueError('%r is not a well of %r' % (label, self))
+
+    def label(self, row, column):
+        """Return the label of the well at row and column, both starting at 0."""
+        if not (0 <= row < len(self.rows) and 0 <= column < len(self.columns)):
+            raise IndexError('well (%s, %s) is outside of %r' % (row, column, self))
+        return self.rows[row] + ':' + self.columns[column]
+
+    def indices(self, labels, order=ROW_MAJOR):
+        """
+        Convert a list of well labels to their index in the wells sorted in the given order.
+
+        :param labels: list of labels such as "A:1".
+        :param order: 'row' or 'column'.
+        """
+        self._check_order(order)
+        positions = self._positions
+        try:
+            if order == ROW_MAJOR:
+                ncol = len(self.columns)
+                return [row * ncol + column for row, column in (positions[l] for l in labels)]
+            nrow = len(self.rows)
+            return [column * nrow + row for row, column in (positions[l] for l in labels)]
+        except KeyError as e:
+            raise ValueError('%r is not a well of %r' % (e.args[0], self))
+
+    def labels(self, indices, order=ROW_MAJOR):
+        """
+        Convert a list of indices in the wells sorted in the given order to well labels.
+
+        :param indices: list of integers between 0 and size - 1.
+        :param order: 'row' or 'column'.
+        """
+        self._check_order(order)
+        wells = self._row_major if order == ROW_MAJOR else self._column_major
+        size = len(wells)
+        result = []
+        for i in indices:
+            if not 0 <= i < size:
+                raise IndexError('indices must be between 0 and %s not %s' % (size - 1, i))
+            result.append(wells[i])
+        return result
+
+    def sort(self, labels, order=ROW_MAJOR):
+        """Return the labels sorted in the given order."""
+        indices = self.indices(labels, order)
+        return [l for _, l in sorted(zip(indices, labels))]
+
+    def convert(self, indices, from_order, to_order):
+        """Convert indices in one order to indices in the other order."""
+        return self.indices(self.labels(indices, from_order), to_order)
+
+
+def _check_quadrants(small, large):
+    if len(large.rows) != 2 * len(small.rows) or len(large.columns) != 2 * len(small.columns):
+        raise ValueError('%r is not made of four quadrants of %r' % (large, small))
+
+
+def to_quadrant(labels, quadrant, small, large):
+    """
+    Map wells of a small plate to a quadrant of a plate with twice as many rows and columns,
+    such as a 96-well plate to a 384-well plate.
+
+    The quadrants are interleaved as with a 96-channel head: quadrant 1 starts at A:1, 2 at A:2, 3 at B:1
+    and 4 at B:2 of the large plate.
+
+    :param labels: list of well labels of the small plate.
+    :param quadrant: the quadrant, between 1 and 4.
+    :param small: :py:class:`PlateGeometry` of the small plate.
+    :param large: :py:class:`PlateGeometry` of the large plate.
+    :return: list of well labels of the large plate.
+    """
+    _check_quadrants(small, large)
+    if quadrant not in (1, 2, 3, 4):
+        raise ValueError('quadrant must be between 1 and 4 not %r' % quadrant)
+    row_shift, column_shift = divmod(quadrant - 1, 2)
+    large_rows, large_columns = large.rows, large.columns
+    return [
+        large_rows[2 * row + row_shift] + ':' + large_columns[2 * column + column_shift]
+        for row, column in (small.position(l) for l in labels)
+    ]
+
+
+def from_quadrants(labels, small, large):
+    """
+    Map wells of a large plate to the quadrants of a plate with half as many rows and columns.
+    This is the reverse of :py:func:`to_quadrant`.
+
+    :param labels: list of well labels of the large plate.
+    :param small: :py:class:`PlateGeometry` of the small plate.
+    :param large: :py:class:`PlateGeometry` of the large plate.
+    :return: list of tuples (quadrant, well label of the small plate).
+    """
+    _check_quadrants(small, large)
+    small_rows, small_columns = small.rows, small.columns
+    result = []
+    for row, column in (large.position(l) for l in labels):
+        row, row_shift = divmod(row, 2)
+        column, column_shift = divmod(column, 2)
+        result.append((2 * row_shift + column_shift + 1, small_rows[row] + ':' + small_columns[column]))
+    return result
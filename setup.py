@@ -43,7 +43,12 @@ setup(name='pyclarity_lims',
     include_package_data=True,
     zip_safe=False,
     install_requires=[
-      "requests"
+      "requests",
+      "futures; python_version < '3'"
     ],
+    extras_require={
+      'opentelemetry': ['opentelemetry-api'],
+      'async': ['httpx']
+    },
 
 )
@@ -0,0 +1,202 @@
+import re
+from sys import version_info
+from unittest import TestCase
+
+import pytest
+
+if version_info < (3, 5):
+    pytest.skip('AsyncLims requires python 3.5 or later', allow_module_level=True)
+
+import asyncio
+from unittest import skipUnless
+from unittest.mock import patch, Mock
+
+from requests.exceptions import HTTPError, Timeout
+
+from pyclarity_lims.async_lims import AsyncLims, httpx
+from pyclarity_lims.entities import Artifact, Sample
+
+url = 'http://testgenologics.com:4040'
+
+artifact_xml = """<?xml version='1.0' encoding='utf-8'?>
+<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{url}/api/v2/artifacts/{id}" limsid="{id}">
+<name>{id} name</name>
+<type>Analyte</type>
+</art:artifact>"""
+
+samples_xml = """<?xml version='1.0' encoding='utf-8'?>
+<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+<sample uri="{url}/api/v2/samples/s1" limsid="s1"/>
+<sample uri="{url}/api/v2/samples/s2" limsid="s2"/>
+</smp:samples>""".format(url=url)
+
+
+details_xml = """<?xml version='1.0' encoding='utf-8'?>
+<art:details xmlns:art="http://genologics.com/ri/artifact">
+{artifacts}
+</art:details>"""
+
+links_xml = """<?xml version='1.0' encoding='utf-8'?>
+<ri:links xmlns:ri="http://genologics.com/ri">
+{links}
+</ri:links>"""
+
+error_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<exc:exception xmlns:exc="http://genologics.com/ri/exception">
+    <message>Generic error message</message>
+</exc:exception>"""
+
+
+def fake_get(uri, **kwargs):
+    return Mock(content=artifact_xml.format(url=url, id=uri.split('/')[-1]), status_code=200)
+
+
+class TestAsyncLims(TestCase):
+    def setUp(self):
+        self.lims = AsyncLims(url, username='test', password='password', async_client=False)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        asyncio.set_event_loop(None)
+        self.loop.close()
+        self.lims.close()
+
+    def run_async(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    def test_aget(self):
+        with patch('requests.Session.get', side_effect=fake_get) as mocked_get:
+            root = self.run_async(self.lims.aget(url + '/api/v2/artifacts/a1'))
+        assert root.find('name').text == 'a1 name'
+        assert mocked_get.call_count == 1
+
+    def test_entity_aget(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(10)]
+
+        with patch('requests.Session.get', side_effect=fake_get) as mocked_get:
+            self.run_async(asyncio.gather(*[a.aget() for a in artifacts]))
+            assert mocked_get.call_count == 10
+            assert [a.name for a in artifacts] == ['a%s name' % i for i in range(10)]
+            # Already loaded: no extra query
+            self.run_async(artifacts[0].aget())
+            assert mocked_get.call_count == 10
+
+    def test_asearch(self):
+        with patch('requests.Session.get', return_value=Mock(content=samples_xml, status_code=200)):
+            samples = self.run_async(self.lims.aget_samples(projectname='p1'))
+        assert samples == [Sample(self.lims, id='s1'), Sample(self.lims, id='s2')]
+
+    def test_lims_options(self):
+        cache = {}
+        lims = AsyncLims(url, username='test', password='password', async_client=False, executor_workers=4,
+                         max_workers=2, batch_size=10, cache=cache, prefetch_siblings=True)
+        try:
+            assert lims.async_client is None
+            assert lims.executor._max_workers == 4
+            assert lims.max_workers == 2
+            assert lims.batch_size == 10
+            assert lims.cache is cache
+            assert lims.prefetch_siblings
+        finally:
+            lims.close()
+
+
+@skipUnless(httpx, 'The native transport requires httpx')
+class TestNativeAsyncLims(TestCase):
+    def setUp(self):
+        self.requests = []
+        self.error = None
+        self.client = httpx.AsyncClient(transport=httpx.MockTransport(self.handle))
+        self.lims = AsyncLims(url, username='test', password='password', async_client=self.client)
+        self.loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(self.loop)
+
+    def tearDown(self):
+        self.run_async(self.lims.aclose())
+        self.run_async(self.client.aclose())
+        asyncio.set_event_loop(None)
+        self.loop.close()
+
+    def run_async(self, awaitable):
+        return self.loop.run_until_complete(awaitable)
+
+    async def handle(self, request):
+        self.requests.append(request)
+        if self.error is not None:
+            raise self.error('timed out', request=request)
+        # Let the other coroutines run while the query is in flight
+        await asyncio.sleep(0.01)
+        path = request.url.path
+        if path.endswith('batch/retrieve'):
+            ids = [l.split('/')[-1] for l in re.findall(r'uri="([^"]+)"', request.content.decode())]
+            artifacts = ''.join(artifact_xml.format(url=url, id=i).split('?>')[1] for i in ids)
+            return httpx.Response(200, content=details_xml.format(artifacts=artifacts))
+        if path.endswith('batch/update'):
+            ids = re.findall(r'limsid="([^"]+)"', request.content.decode())
+            links = ''.join('<link uri="%s/api/v2/artifacts/%s" rel="artifacts"/>' % (url, i) for i in ids)
+            return httpx.Response(200, content=links_xml.format(links=links))
+        if path.endswith('missing'):
+            return httpx.Response(404, content=error_xml)
+        return httpx.Response(200, content=artifact_xml.format(url=url, id=path.split('/')[-1]))
+
+    def test_aget(self):
+        with patch('requests.Session.get') as mocked_get:
+            root = self.run_async(self.lims.aget(url + '/api/v2/artifacts/a1'))
+        assert root.find('name').text == 'a1 name'
+        assert not mocked_get.called
+        assert len(self.requests) == 1
+        assert self.requests[0].headers['accept'] == 'application/xml'
+        assert self.requests[0].headers['authorization'].startswith('Basic ')
+
+    def test_aget_in_flight(self):
+        uri = url + '/api/v2/artifacts/a1'
+        roots = self.run_async(asyncio.gather(*[self.lims.aget(uri) for i in range(10)]))
+        assert len(self.requests) == 1
+        assert all(root is roots[0] for root in roots)
+        assert not self.lims._in_flight
+
+    def test_entity_aget(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(10)]
+        self.run_async(asyncio.gather(*[a.aget() for a in artifacts]))
+        assert len(self.requests) == 10
+        assert [a.name for a in artifacts] == ['a%s name' % i for i in range(10)]
+
+    def test_errors(self):
+        events = []
+        self.lims.request_listeners.append(events.append)
+        with self.assertRaises(HTTPError) as context:
+            self.run_async(self.lims.aget(url + '/api/v2/artifacts/missing'))
+        assert 'Generic error message' in str(context.exception)
+        assert events[-1].status == 404
+
+        self.error = httpx.ReadTimeout
+        self.assertRaises(Timeout, self.run_async, self.lims.aget(url + '/api/v2/artifacts/a1'))
+        assert isinstance(events[-1].error, Timeout)
+        assert events[-1].status is None
+        assert not self.lims._in_flight
+
+    def test_aget_batch(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(5)]
+        self.lims.batch_size = 2
+        self.run_async(self.lims.aget_batch(artifacts))
+        assert len(self.requests) == 3
+        assert all(r.url.path.endswith('batch/retrieve') for r in self.requests)
+        assert [a.name for a in artifacts] == ['a%s name' % i for i in range(5)]
+        assert not self.lims._in_flight
+
+    def test_aput_batch(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(3)]
+        self.run_async(self.lims.aget_batch(artifacts))
+        artifacts[0].name = 'new name'
+        results = self.run_async(self.lims.aput_batch(artifacts, refresh=True))
+        assert [r.error for r in results] == [None]
+        assert [r.url.path.split('/')[-1] for r in self.requests] == ['retrieve', 'update', 'retrieve']
+        assert b'new name' in self.requests[1].content
+
+    def test_fallback(self):
+        # The searches still run in the executor with the request session
+        with patch('requests.Session.get', return_value=Mock(content=samples_xml, status_code=200)):
+            samples = self.run_async(self.lims.aget_samples(projectname='p1'))
+        assert samples == [Sample(self.lims, id='s1'), Sample(self.lims, id='s2')]
+        assert not self.requests
@@ -0,0 +1,143 @@
+import gc
+import os
+import shutil
+import tempfile
+import time
+from unittest import TestCase
+from xml.etree import ElementTree
+
+try:
+    from mock import patch, Mock
+except ImportError:
+    from unittest.mock import patch, Mock
+
+from pyclarity_lims.cache import EntityCache, DiskCache, estimate_size
+from pyclarity_lims.entities import Artifact, Processtype
+from pyclarity_lims.lims import Lims
+
+url = 'http://testgenologics.com:4040'
+
+
+def artifact_root(artifact, nb_udfs=1):
+    root = ElementTree.Element('{http://genologics.com/ri/artifact}artifact', uri=artifact.uri)
+    for i in range(nb_udfs):
+        udf = ElementTree.SubElement(root, '{http://genologics.com/ri/userdefined}field', type='String', name='u%s' % i)
+        udf.text = 'value %s' % i
+    return root
+
+
+class TestEntityCache(TestCase):
+
+    def test_max_entries(self):
+        cache = EntityCache(max_entries=2)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        a1, a2, a3 = [Artifact(lims, id='a%s' % i) for i in range(1, 4)]
+        # Instances without XML do not count
+        assert cache.evictions == 0
+        assert cache.stats()['entries'] == 0
+        for a in (a1, a2, a3):
+            a.root = artifact_root(a)
+        # a1 was the least recently used
+        assert a1.root is None
+        assert a2.root is not None and a3.root is not None
+        assert cache.evictions == 1
+        # a1 is still referenced so the same instance is returned
+        assert Artifact(lims, id='a1') is a1
+        assert cache.hits == 1
+        assert cache.stats()['entries'] == 2
+        # a2 is evicted once a1 is retrieved again
+        a1.root = artifact_root(a1)
+        assert a2.root is None
+        assert cache.evictions == 2
+
+    def test_modified_not_evicted(self):
+        cache = EntityCache(max_entries=1)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        a1, a2, a3 = [Artifact(lims, id='a%s' % i) for i in range(1, 4)]
+        a1.root = artifact_root(a1)
+        a1.udf['u0'] = 'modified'
+        a2.root = artifact_root(a2)
+        a3.root = artifact_root(a3)
+        # a1 is kept with its modifications while a2 is evicted
+        assert a1.udf['u0'] == 'modified'
+        assert a2.root is None
+        assert cache.stats()['entries'] == 2
+        with patch('requests.Session.put', return_value=Mock(content=b'<artifact/>', status_code=200)):
+            a1.put()
+        # Once saved, a1 can be evicted
+        assert a1.root is None
+        assert cache.stats()['entries'] == 1
+
+    def test_evicted_not_referenced(self):
+        cache = EntityCache(max_entries=1)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        Artifact(lims, id='a1')
+        Artifact(lims, id='a2')
+        gc.collect()
+        assert 'a1' not in [k.split('/')[-1] for k in cache]
+        Artifact(lims, id='a1')
+        assert cache.misses == 3
+
+    def test_max_bytes(self):
+        a_size = None
+        cache = EntityCache(max_bytes=1500)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(5)]
+        for a in artifacts:
+            a.root = artifact_root(a, nb_udfs=2)
+            a_size = estimate_size(a.root)
+        assert a_size * 2 < 1500 < a_size * 3
+        assert [a.root is not None for a in artifacts] == [False, False, False, True, True]
+        assert cache.total_bytes == a_size * 2
+
+    def test_max_bytes_not_loaded(self):
+        cache = EntityCache(max_bytes=1500)
+        lims = Lims(url, username='test', password='password', cache=cache)
+        for i in range(100):
+            Artifact(lims, id='a%s' % i)
+        gc.collect()
+        # The instances never retrieved are not kept once unreferenced
+        assert len(cache) == 0
+
+
+processtype_xml = b"""<?xml version='1.0' encoding='utf-8'?>
+<ptp:process-type xmlns:ptp="http://genologics.com/ri/processtype" uri="{url}/api/v2/processtypes/1" name="Step 1">
+</ptp:process-type>""".replace(b'{url}', url.encode())
+
+
+class TestDiskCache(TestCase):
+
+    def setUp(self):
+        self.tmp_dir = tempfile.mkdtemp()
+        self.path = os.path.join(self.tmp_dir, 'cache.sqlite')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmp_dir)
+
+    def test_ttl(self):
+        cache = DiskCache(self.path, ttls={Processtype: 10})
+        assert cache.ttl(url + '/api/v2/processtypes/1') == 10
+        assert cache.ttl(url + '/api/v2/samples/s1') is None
+        cache.set(url + '/api/v2/samples/s1', b'<sample/>')
+        assert cache.get(url + '/api/v2/samples/s1') is None
+        cache.set(url + '/api/v2/processtypes/1', b'<process-type/>')
+        assert cache.get(url + '/api/v2/processtypes/1') == b'<process-type/>'
+        with patch('time.time', return_value=time.time() + 11):
+            assert cache.get(url + '/api/v2/processtypes/1') is None
+
+    def test_shared_between_lims(self):
+        uri = url + '/api/v2/processtypes/1'
+        lims = Lims(url, username='test', password='password', disk_cache=DiskCache(self.path))
+        with patch('requests.Session.get', return_value=Mock(content=processtype_xml, status_code=200)) as mocked_get:
+            assert Processtype(lims, uri=uri).name == 'Step 1'
+            assert mocked_get.call_count == 1
+
+        # Another process starting with an empty Lims.cache
+        lims = Lims(url, username='test', password='password', disk_cache=DiskCache(self.path))
+        with patch('requests.Session.get') as mocked_get:
+            assert Processtype(lims, uri=uri).name == 'Step 1'
+            assert mocked_get.call_count == 0
+
+        with patch('requests.Session.put', return_value=Mock(content=processtype_xml, status_code=200)):
+            lims.put(uri, b'<process-type/>')
+        assert lims.disk_cache.get(uri) is None
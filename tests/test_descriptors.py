@@ -16,9 +16,9 @@ from pyclarity_lims.lims import Lims
 from tests import elements_equal
 
 if version_info[0] == 2:
-    from mock import Mock
+    from mock import Mock, patch
 else:
-    from unittest.mock import Mock
+    from unittest.mock import Mock, patch
 
 
 def _tostring(e):
@@ -349,6 +349,45 @@ class TestUdfDictionary(TestCase):
             self.dict1['test']
         assert self._get_udf_value(self.dict1, 'test') is None
 
+    def test___delitem__duplicated(self):
+        instance = Mock(root=ElementTree.fromstring("""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<test-entry xmlns:udf="http://genologics.com/ri/userdefined">
+<udf:field type="String" name="test">first</udf:field>
+<udf:field type="String" name="test">second</udf:field>
+</test-entry>"""))
+        dict1 = UdfDictionary(instance)
+        dict1['test'] = 'changed'
+        assert [e.text for e in dict1._elems] == ['changed', 'second']
+        del dict1['test']
+        assert [e.text for e in dict1._elems] == ['second']
+        dict1['test'] = 'changed again'
+        assert [e.text for e in dict1._elems] == ['changed again']
+
+    def test_update(self):
+        self.dict1.update({'test': 'other', 'how much': 21}, new=1.5)
+        assert self._get_udf_value(self.dict1, 'test') == 'other'
+        assert self._get_udf_value(self.dict1, 'how much') == '21'
+        assert self._get_udf_value(self.dict1, 'new') == '1.5'
+        assert self.dict1['new'] == 1.5
+        assert len(self.dict1._elems) == 4
+        # The XML was modified so the new UDF is found after a new parsing
+        assert UdfDictionary(self.instance1)['new'] == 1.5
+
+        # Nothing is modified if one of the values has the wrong type
+        self.assertRaises(TypeError, self.dict1.update, {'test': 'again', 'how much': 'many'})
+        assert self.dict1['test'] == 'other'
+        assert self._get_udf_value(self.dict1, 'test') == 'other'
+
+    def test_update_many(self):
+        instance = Mock(root=self.empty_et)
+        dict1 = UdfDictionary(instance)
+        values = dict(('field %s' % i, i) for i in range(1000))
+        with patch.object(UdfDictionary, '_update_elems') as mocked_update:
+            dict1.update(values)
+        assert mocked_update.call_count == 0
+        assert dict1 == values
+        assert len(instance.root.findall(nsmap('udf:field'))) == 1000
+
     def test_items(self):
         pass
 
@@ -410,6 +449,25 @@ class TestPlacementDictionary(TestCase):
         del self.dict1['A:1']
         assert len(self.dict1.rootnode(self.dict1.instance).findall('placement')) == 0
 
+    def test_fill_plate(self):
+        et = ElementTree.fromstring("""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+        <test-entry xmlns:udf="http://genologics.com/ri/userdefined">
+        </test-entry>""")
+        instance = Mock(root=et, lims=self.lims)
+        placements = PlacementDictionary(instance)
+        wells = ['%s:%s' % (r, c) for r in 'ABCDEFGHIJKLMNOP' for c in range(1, 25)]
+        with patch.object(PlacementDictionary, '_update_elems') as mocked_update:
+            for well in wells:
+                placements[well] = self.art1
+            placements['A:1'] = Artifact(lims=self.lims, id='a2')
+            del placements['B:1']
+        assert mocked_update.call_count == 0
+        assert len(placements) == 383
+        nodes = et.findall('placement')
+        assert len(nodes) == 383
+        assert [n.find('value').text for n in nodes if n.attrib['limsid'] == 'a2'] == ['A:1']
+        assert PlacementDictionary(instance) == placements
+
 
 class TestSubTagDictionary(TestCase):
 
@@ -601,6 +659,23 @@ class TestInputOutputMapList(TestCase):
         assert sorted(res[0][0].keys()) == sorted(expected_keys_input)
         assert sorted(res[0][1].keys()) == sorted(expected_keys_ouput)
 
+    def test_lazy_entities(self):
+        res = self.IO_map.__get__(self.instance1, None)
+        input, output = res[0]
+        assert self.instance1.lims.cache == {}
+        assert output['output-type'] == 'ResultFile'
+        assert output.raw('uri') == 'http://testgenologics.com:4040/api/v2/artifacts/2'
+        assert input.raw('parent-process') == 'http://testgenologics.com:4040//api/v2/processes/1'
+        assert self.instance1.lims.cache == {}
+        assert output['uri'].uri == 'http://testgenologics.com:4040/api/v2/artifacts/2'
+        assert list(self.instance1.lims.cache) == ['http://testgenologics.com:4040/api/v2/artifacts/2']
+        self.assertRaises(KeyError, input.__getitem__, 'output-type')
+        assert input.get('post-process-uri') is None
+        assert output == {
+            'limsid': '2', 'output-type': 'ResultFile', 'output-generation-type': 'PerAllInputs', 'uri': output['uri']
+        }
+        assert output.copy() == dict(output)
+
 
 class TestExternalidList(TestCase):
 
@@ -0,0 +1,77 @@
+from unittest import TestCase
+
+from pyclarity_lims.diagnostics import LazyLoadDetector, LazyLoadError
+from pyclarity_lims.entities import Artifact, Sample, Process
+from pyclarity_lims.lims import Lims
+
+try:
+    from mock import patch, Mock
+except ImportError:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+entity_xml = """<?xml version='1.0' encoding='utf-8'?>
+<ent:entity xmlns:ent="http://genologics.com/ri/entity" uri="{uri}" limsid="{id}">
+<name>{id} name</name>
+</ent:entity>"""
+
+
+def fake_get(uri, **kwargs):
+    return Mock(content=entity_xml.format(uri=uri, id=uri.split('/')[-1]), status_code=200)
+
+
+class TestLazyLoadDetector(TestCase):
+
+    def setUp(self):
+        self.lims = Lims(url, username='test', password='password')
+        self.artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(6)]
+        self.samples = [Sample(self.lims, id='s%s' % i) for i in range(2)]
+
+    def test_runs(self):
+        with patch('requests.Session.get', side_effect=fake_get):
+            with LazyLoadDetector(self.lims, threshold=5) as detector:
+                names = [a.name for a in self.artifacts]
+                self.samples[0].get()
+                self.samples[1].get()
+        assert names[0] == 'a0 name'
+        assert self.lims.diagnostics is None
+        # The explicit calls to get() are not lazy loads
+        assert detector.requests == 6
+        runs = detector.runs
+        assert len(runs) == 1
+        assert runs[0].klass is Artifact
+        assert runs[0].count == 6
+        assert runs[0].attribute == 'Artifact.name'
+        assert 'test_diagnostics.py' in runs[0].call_site
+        assert runs[0].uris[0] == self.artifacts[0].uri
+        assert 'get_batch' in detector.report()
+
+    def test_no_run(self):
+        with patch('requests.Session.get', side_effect=fake_get):
+            with LazyLoadDetector(self.lims, threshold=5) as detector:
+                for a in self.artifacts[:4]:
+                    a.name
+                # Already loaded
+                self.artifacts[0].name
+        assert detector.runs == []
+        assert detector.report() == 'No run of 5 or more lazy loads found in 4 lazy loads'
+
+    def test_budget(self):
+        with patch('requests.Session.get', side_effect=fake_get) as mocked_get:
+            with LazyLoadDetector(self.lims, max_requests=3):
+                with self.assertRaises(LazyLoadError):
+                    for a in self.artifacts:
+                        a.name
+            assert mocked_get.call_count == 3
+
+    def test_not_lazy_loads(self):
+        processes = [Process(self.lims, id='p%s' % i) for i in range(8)]
+        with patch('requests.Session.get', side_effect=fake_get) as mocked_get:
+            with LazyLoadDetector(self.lims, max_requests=3) as detector:
+                # Processes have no batch endpoint: get_batch sends one forced GET per process
+                self.lims.get_batch(processes, batch_size=1)
+                self.samples[0].get()
+                self.samples[0].get(force=True)
+            assert mocked_get.call_count == 10
+        assert detector.requests == 0
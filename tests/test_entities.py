@@ -1,9 +1,12 @@
+import gc
 from sys import version_info
+from threading import Event, Thread
 from unittest import TestCase
 from xml.etree import ElementTree
 
+from pyclarity_lims.cache import EntityCache
 from pyclarity_lims.entities import ProtocolStep, StepActions, Researcher, Artifact, \
-    Step, StepPlacements, Container, Stage, ReagentKit, ReagentLot, Sample, Project
+    Step, StepPlacements, Container, Stage, ReagentKit, ReagentLot, Sample, Project, SiblingGroup, Process
 from pyclarity_lims.lims import Lims
 from tests import NamedMock, elements_equal
 
@@ -165,6 +168,33 @@ generic_sample_creation_xml = """
 </smp:samplecreation>
 """
 
+generic_process_xml = """<?xml version='1.0' encoding='utf-8'?>
+<prc:process xmlns:prc="http://genologics.com/ri/process" uri="{url}/api/v2/processes/p1" limsid="p1">
+<type uri="{url}/api/v2/processtypes/pt1">Step type</type>
+<input-output-map>
+<input post-process-uri="{url}/api/v2/artifacts/a1?state=2" uri="{url}/api/v2/artifacts/a1?state=1" limsid="a1">
+<parent-process uri="{url}/api/v2/processes/p0" limsid="p0"/>
+</input>
+<output uri="{url}/api/v2/artifacts/o1?state=3" output-generation-type="PerInput" output-type="Analyte" limsid="o1"/>
+</input-output-map>
+<input-output-map>
+<input post-process-uri="{url}/api/v2/artifacts/a1?state=2" uri="{url}/api/v2/artifacts/a1?state=1" limsid="a1"/>
+<output uri="{url}/api/v2/artifacts/r1?state=4" output-generation-type="PerInput" output-type="ResultFile" limsid="r1"/>
+</input-output-map>
+<input-output-map>
+<input post-process-uri="{url}/api/v2/artifacts/a2?state=2" uri="{url}/api/v2/artifacts/a2?state=1" limsid="a2"/>
+<output uri="{url}/api/v2/artifacts/o2?state=3" output-generation-type="PerInput" output-type="Analyte" limsid="o2"/>
+</input-output-map>
+<input-output-map>
+<input post-process-uri="{url}/api/v2/artifacts/a1?state=2" uri="{url}/api/v2/artifacts/a1?state=1" limsid="a1"/>
+<output uri="{url}/api/v2/artifacts/s1?state=5" output-generation-type="PerAllInputs" output-type="SharedResultFile" limsid="s1"/>
+</input-output-map>
+<input-output-map>
+<input post-process-uri="{url}/api/v2/artifacts/a2?state=2" uri="{url}/api/v2/artifacts/a2?state=1" limsid="a2"/>
+<output uri="{url}/api/v2/artifacts/s1?state=5" output-generation-type="PerAllInputs" output-type="SharedResultFile" limsid="s1"/>
+</input-output-map>
+</prc:process>"""
+
 class TestEntities(TestCase):
     def test_pass(self):
         pass
@@ -176,6 +206,11 @@ class TestEntities(TestCase):
     dummy_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
     <dummy></dummy>"""
 
+    escalated_artifacts_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+    <art:details xmlns:art="http://genologics.com/ri/artifact">
+    <art:artifact uri="http://testgenologics.com:4040/artifacts/r1" limsid="r1"/>
+    </art:details>"""
+
     def setUp(self):
         self.lims = Lims(url, username='test', password='password')
 
@@ -190,7 +225,8 @@ class TestStepActions(TestEntities):
     def test_escalation(self):
         s = StepActions(uri=self.lims.get_uri('steps', 'step_id', 'actions'), lims=self.lims)
         with patch('requests.Session.get', return_value=Mock(content=self.step_actions_xml, status_code=200)):
-            with patch('requests.post', return_value=Mock(content=self.dummy_xml, status_code=200)):
+            with patch('requests.Session.post',
+                       return_value=Mock(content=self.escalated_artifacts_xml, status_code=200)):
                 r = Researcher(uri='http://testgenologics.com:4040/researchers/r1', lims=self.lims)
                 a = Artifact(uri='http://testgenologics.com:4040/artifacts/r1', lims=self.lims)
                 expected_escalation = {
@@ -272,7 +308,7 @@ class TestStep(TestEntities):
             uri='http://testgenologics.com:4040/api/v2/configuration//protocols/p1/steps/p1s1',
             permittedcontainers=['Tube']
         )
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.step_xml, status_code=201)) as patch_post:
             Step.create(self.lims, protocol_step=protocol_step, inputs=inputs, replicates=[1, 2])
             data = '''<?xml version='1.0' encoding='utf-8'?>
@@ -300,7 +336,7 @@ class TestStep(TestEntities):
             uri='http://testgenologics.com:4040/api/v2/configuration//protocols/p1/steps/p1s1',
             permittedcontainers=['Tube']
         )
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.step_xml, status_code=201)) as patch_post:
             # replicates default to 1
             Step.create(self.lims, protocol_step=protocol_step, inputs=inputs)
@@ -337,7 +373,7 @@ class TestStep(TestEntities):
         with patch('requests.Session.get', return_value=Mock(content=self.step_xml, status_code=200)):
             s = Step(self.lims, id='s1')
             s.get()
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.step_prog_status, status_code=201)) as patch_post:
             prog_status = s.trigger_program('program1')
             assert prog_status.message == 'Traceback Error message'
@@ -361,6 +397,114 @@ class TestArtifacts(TestEntities):
         with patch('requests.Session.get', return_value=Mock(content=self.root_artifact_xml, status_code=200)):
             assert a.workflow_stages_and_statuses == expected_wf_stage
 
+    def test_state(self):
+        a = Artifact(self.lims, uri=url + '/api/v2/artifacts/a1?state=1234')
+        assert a.id == 'a1'
+        assert a.state == '1234'
+        assert a.stateless is Artifact(self.lims, id='a1')
+        assert a.stateless.state is None
+        assert a.stateless.stateless is a.stateless
+
+    def test_slots(self):
+        a = Artifact(self.lims, id='a1')
+        assert not hasattr(a, '__dict__')
+        self.assertRaises(AttributeError, setattr, a, 'unknown_attribute', 1)
+
+
+class TestProcess(TestEntities):
+    process_xml = generic_process_xml.format(url=url)
+
+    def setUp(self):
+        TestEntities.setUp(self)
+        self.process = Process(self.lims, id='p1')
+        self.process.root = ElementTree.fromstring(self.process_xml)
+
+    def test_outputs_per_input(self):
+        assert self.process.outputs_per_input('a1') == [
+            Artifact(self.lims, uri=url + '/api/v2/artifacts/o1?state=3'),
+            Artifact(self.lims, uri=url + '/api/v2/artifacts/r1?state=4'),
+            Artifact(self.lims, uri=url + '/api/v2/artifacts/s1?state=5'),
+        ]
+        assert self.process.outputs_per_input('a1', ResultFile=True) == [
+            Artifact(self.lims, uri=url + '/api/v2/artifacts/r1?state=4')
+        ]
+        assert self.process.outputs_per_input('a2', Analyte=True) == [
+            Artifact(self.lims, uri=url + '/api/v2/artifacts/o2?state=3')
+        ]
+        assert self.process.outputs_per_input('a3') == []
+
+    def test_all_inputs_outputs(self):
+        assert self.process.all_inputs() == [Artifact(self.lims, id='a1'), Artifact(self.lims, id='a2')]
+        assert len(self.process.all_inputs(unique=False)) == 5
+        assert [a.id for a in self.process.all_outputs()] == ['o1', 'r1', 'o2', 's1']
+        assert len(self.process.all_outputs(unique=False)) == 5
+
+    def test_result_files(self):
+        with patch('requests.Session.get') as mocked_get:
+            assert self.process.result_files() == [Artifact(self.lims, id='r1')]
+            assert self.process.shared_result_files() == [Artifact(self.lims, id='s1')]
+        assert mocked_get.call_count == 0
+
+    def test_input_artifact_list(self):
+        shared = Artifact(self.lims, id='s1')
+        shared.root = ElementTree.fromstring(
+            '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s/api/v2/artifacts/s1">'
+            '<parent-process uri="%s/api/v2/processes/p1"/></art:artifact>' % (url, url)
+        )
+        assert shared.input_artifact_list() == [
+            Artifact(self.lims, uri=url + '/api/v2/artifacts/a1?state=1'),
+            Artifact(self.lims, uri=url + '/api/v2/artifacts/a2?state=1')
+        ]
+
+    def _batch_retrieve(self, uri, data, **kwargs):
+        # Artifacts are in the container c1 and derived from the sample s1 apart from a2 derived from s2
+        links = ElementTree.fromstring(data)
+        if uri.endswith('samples/batch/retrieve'):
+            entity_xml = '<smp:sample uri="{uri}" limsid="{id}"><name>{id} name</name></smp:sample>'
+            details_xml = '<smp:details xmlns:smp="http://genologics.com/ri/sample">{entities}</smp:details>'
+        else:
+            entity_xml = '<art:artifact uri="{uri}" limsid="{id}"><type>Analyte</type>' \
+                         '<location><container uri="%s/api/v2/containers/c1" limsid="c1"/><value>A:1</value></location>' \
+                         '<sample uri="%s/api/v2/samples/{sample}" limsid="{sample}"/></art:artifact>' % (url, url)
+            details_xml = '<art:details xmlns:art="http://genologics.com/ri/artifact">{entities}</art:details>'
+        entities = ''
+        for link in links:
+            id = link.attrib['uri'].split('/')[-1]
+            entities += entity_xml.format(uri=link.attrib['uri'], id=id, sample='s2' if id == 'a2' else 's1')
+        return Mock(content=details_xml.format(entities=entities), status_code=200)
+
+    def test_analytes(self):
+        with patch('requests.Session.get') as mocked_get:
+            assert self.process.analytes() == ([Artifact(self.lims, id='o1'), Artifact(self.lims, id='o2')], 'Output')
+        assert mocked_get.call_count == 0
+
+    def test_parent_processes(self):
+        with patch('requests.Session.get') as mocked_get:
+            assert self.process.parent_processes() == [Process(self.lims, id='p0'), None]
+        assert mocked_get.call_count == 0
+
+    def test_output_containers(self):
+        with patch('requests.Session.post', side_effect=self._batch_retrieve) as mocked_post, \
+                patch('requests.Session.get') as mocked_get:
+            assert self.process.output_containers() == [Container(self.lims, id='c1')]
+        assert mocked_post.call_count == 1
+        assert mocked_get.call_count == 0
+
+    def test_input_per_sample(self):
+        with patch('requests.Session.post', side_effect=self._batch_retrieve) as mocked_post, \
+                patch('requests.Session.get') as mocked_get:
+            assert self.process.input_per_sample('s2 name') == [Artifact(self.lims, id='a2')]
+        assert [c[0][0] for c in mocked_post.call_args_list] == [
+            url + '/api/v2/artifacts/batch/retrieve', url + '/api/v2/samples/batch/retrieve'
+        ]
+        assert mocked_get.call_count == 0
+
+    def test_index_reused(self):
+        index = self.process._input_output_index()
+        assert self.process._input_output_index() is index
+        self.process.root = ElementTree.fromstring(self.process_xml)
+        assert self.process._input_output_index() is not index
+
 
 class TestReagentKits(TestEntities):
     url = 'http://testgenologics.com:4040'
@@ -375,7 +519,7 @@ class TestReagentKits(TestEntities):
             assert r.archived == False
 
     def test_create_entity(self):
-        with patch('pyclarity_lims.lims.requests.post', return_value=Mock(content=self.reagentkit_xml, status_code=201)):
+        with patch('requests.Session.post', return_value=Mock(content=self.reagentkit_xml, status_code=201)):
             r = ReagentKit.create(self.lims, name='regaentkitname', supplier='reagentProvider',
                                   website='www.reagentprovider.com', archived=False)
         self.assertRaises(TypeError, ReagentKit.create, self.lims, error='test')
@@ -396,7 +540,7 @@ class TestReagentLots(TestEntities):
     def test_create_entity(self):
         with patch('requests.Session.get', return_value=Mock(content=self.reagentkit_xml, status_code=200)):
             r = ReagentKit(uri=self.lims.get_uri('reagentkits', 'r1'), lims=self.lims)
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.reagentlot_xml, status_code=201)) as patch_post:
             l = ReagentLot.create(
                     self.lims,
@@ -415,7 +559,7 @@ class TestSample(TestEntities):
     sample_creation = generic_sample_creation_xml.format(url=url)
 
     def test_create_entity(self):
-        with patch('pyclarity_lims.lims.requests.post',
+        with patch('requests.Session.post',
                    return_value=Mock(content=self.sample_creation, status_code=201)) as patch_post:
             l = Sample.create(
                 self.lims,
@@ -434,3 +578,152 @@ class TestSample(TestEntities):
             </location>
             </smp:samplecreation>'''
             assert elements_equal(ElementTree.fromstring(patch_post.call_args_list[0][1]['data']), ElementTree.fromstring(data))
+        assert l.id == 's1'
+
+
+class TestThreadSafety(TestEntities):
+    root_artifact_xml = generic_artifact_xml.format(url=url)
+
+    def _run_threads(self, target, nb_threads=16):
+        start = Event()
+
+        def run(i):
+            start.wait(5)
+            target(i)
+
+        threads = [Thread(target=run, args=(i,)) for i in range(nb_threads)]
+        for t in threads:
+            t.start()
+        # Release all the threads at once to maximise the contention
+        start.set()
+        for t in threads:
+            t.join()
+
+    def test_identity(self):
+        for lims in (self.lims, Lims(url, username='test', password='password', cache=EntityCache(max_entries=10))):
+            instances = {}
+
+            def build(i):
+                for j in range(200):
+                    a = Artifact(lims, id='a%s' % (j % 20))
+                    # Keep a reference to every instance so evicted ones stay in the cache
+                    instances.setdefault(a.id, []).append(a)
+
+            self._run_threads(build)
+            assert len(instances) == 20
+            assert all(all(a is same_id[0] for a in same_id) for same_id in instances.values())
+
+    def test_concurrent_udf_updates(self):
+        a = Artifact(self.lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.root_artifact_xml, status_code=200)) as mocked_get:
+            def update(i):
+                for j in range(20):
+                    a.udf['udf %s %s' % (i, j)] = j
+
+            self._run_threads(update)
+            assert mocked_get.call_count == 1
+        assert len(a.udf) == 2 + 16 * 20
+        assert len(a.root.findall('{http://genologics.com/ri/userdefined}field')) == 2 + 16 * 20
+
+    def test_reads_with_evictions(self):
+        lims = Lims(url, username='test', password='password', cache=EntityCache(max_entries=4))
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(20)]
+        errors = []
+        with patch('requests.Session.get', return_value=Mock(content=self.root_artifact_xml, status_code=200)):
+            def read(i):
+                try:
+                    for j in range(50):
+                        a = artifacts[(i + j) % 20]
+                        assert a.name == 'test_sample1'
+                        assert a.location[1] == 'A:1'
+                        assert a.udf['Ave. Conc. (ng/uL)'] == 1
+                        assert len(a.workflow_stages_and_statuses) == 2
+                except Exception as e:
+                    errors.append(e)
+
+            self._run_threads(read)
+        assert errors == []
+        assert lims.cache.evictions > 0
+        assert lims.cache._pins == {}
+
+    def test_view_after_eviction(self):
+        lims = Lims(url, username='test', password='password', cache=EntityCache(max_entries=1))
+        a1, a2 = Artifact(lims, id='a1'), Artifact(lims, id='a2')
+        with patch('requests.Session.get', return_value=Mock(content=self.root_artifact_xml, status_code=200)):
+            udf = a1.udf
+            a2.get()
+        assert a1.root is None
+        # The view puts back the root it was parsed from before modifying it
+        udf['Ave. Conc. (ng/uL)'] = 2
+        assert a1.root is udf._root
+        assert a1.udf['Ave. Conc. (ng/uL)'] == 2
+        assert a1.uri in lims.cache._modified
+
+
+class TestSiblingGroup(TestEntities):
+
+    def test_load(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(3)]
+        sample = Sample(self.lims, id='s1')
+        SiblingGroup(artifacts + [sample], enabled=True)
+        artifacts[0].root = ElementTree.Element('artifact')
+        with patch.object(self.lims, 'get_batch') as mocked_get_batch:
+            with patch('requests.Session.get', return_value=Mock(content=generic_artifact_xml.format(url=url), status_code=200)):
+                artifacts[1].get()
+        # Only the members of the same class not retrieved yet
+        mocked_get_batch.assert_called_once_with(artifacts[1:])
+        # The group is only used once per class
+        assert artifacts[2]._siblings.instances == [sample]
+
+    def test_disabled(self):
+        artifacts = [Artifact(self.lims, id='a%s' % i) for i in range(3)]
+        SiblingGroup(artifacts)
+        # Not attached when the prefetch is disabled
+        assert all(a._siblings is None for a in artifacts)
+        with patch.object(self.lims, 'get_batch') as mocked_get_batch:
+            with patch('requests.Session.get', return_value=Mock(content=generic_artifact_xml.format(url=url), status_code=200)):
+                artifacts[1].get()
+        assert mocked_get_batch.call_count == 0
+
+    def test_weak_members(self):
+        lims = Lims(url, username='test', password='password', cache=EntityCache(max_entries=10))
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(3)]
+        group = SiblingGroup(artifacts, enabled=True)
+        del artifacts[1:]
+        gc.collect()
+        # The group does not keep the other members alive
+        assert group.instances == artifacts
+
+
+class TestViewCache(TestEntities):
+    root_artifact_xml = generic_artifact_xml.format(url=url)
+
+    def test_udf_view_cached(self):
+        a = Artifact(self.lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.root_artifact_xml, status_code=200)):
+            udf = a.udf
+            assert a.udf is udf
+            # Modified through the view: still valid
+            a.udf['new udf'] = 'value'
+            assert a.udf is udf
+            assert a.udf['new udf'] == 'value'
+            # Another view is invalidated by the modification
+            stages = a.workflow_stages
+            a.udf['other udf'] = 'value'
+            assert a.workflow_stages is not stages
+            # The root is replaced
+            a.get(force=True)
+            assert a.udf is not udf
+            assert 'new udf' not in a.udf
+
+    def test_invalidated_by_setters(self):
+        a = Artifact(self.lims, id='a1')
+        with patch('requests.Session.get', return_value=Mock(content=self.root_artifact_xml, status_code=200)):
+            udf = a.udf
+            a.name = 'new name'
+            assert a.udf is not udf
+            samples = a.samples
+            # Modifies the list without the XML
+            samples.pop()
+            assert a.samples is not samples
+            assert len(a.samples) == 1
@@ -0,0 +1,104 @@
+from unittest import TestCase
+
+from requests.exceptions import HTTPError, ReadTimeout
+
+from pyclarity_lims.entities import Sample
+from pyclarity_lims.instrumentation import endpoint_family, percentile, MetricsAggregator, OpenTelemetryExporter, \
+    RequestEvent
+from pyclarity_lims.lims import Lims
+
+try:
+    from mock import patch, Mock
+except ImportError:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+sample_xml = """<?xml version='1.0' encoding='utf-8'?>
+<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{url}/api/v2/samples/s1" limsid="s1">
+<name>sample1</name>
+</smp:sample>""".format(url=url)
+
+error_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<exc:exception xmlns:exc="http://pyclarity_lims.com/ri/exception">
+    <message>Generic error message</message>
+</exc:exception>"""
+
+
+class TestInstrumentation(TestCase):
+
+    def test_endpoint_family(self):
+        assert endpoint_family(url + '/api/v2/artifacts/2-1234?state=56') == 'artifacts'
+        assert endpoint_family(url + '/api/v2/artifacts') == 'artifacts'
+        assert endpoint_family(url + '/api/v2/artifacts/batch/retrieve') == 'artifacts/batch/retrieve'
+        assert endpoint_family(url + '/api/v2/steps/24-1234/placements') == 'steps/placements'
+        assert endpoint_family(url + '/api/v2/configuration/protocols/1/steps/2') == 'configuration/protocols/steps'
+        assert endpoint_family(url + '/api/v2/samples/ADM1A1PA1') == 'samples'
+
+    def test_percentile(self):
+        values = list(range(1, 101))
+        assert percentile(values, 50) == 50
+        assert percentile(values, 99) == 99
+        assert percentile([3], 90) == 3
+        assert percentile([], 90) is None
+
+    def test_aggregator(self):
+        lims = Lims(url, username='test', password='password')
+        metrics = MetricsAggregator()
+        events = []
+        lims.add_request_listener(metrics)
+        lims.add_request_listener(events.append)
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml, status_code=200)):
+            assert Sample(lims, id='s1').name == 'sample1'
+        with patch('requests.Session.put', return_value=Mock(content=error_xml, status_code=400)):
+            self.assertRaises(HTTPError, lims.put, url + '/api/v2/samples/s1', '<sample/>')
+
+        assert [(e.method, e.endpoint, e.status) for e in events] == [
+            ('get', 'samples', 200), ('put', 'samples', 400)
+        ]
+        assert events[0].response_bytes == len(sample_xml)
+        assert events[0].parse_time is not None
+        assert events[1].request_bytes == len('<sample/>')
+
+        summary = metrics.summary()
+        assert summary[('get', 'samples')]['count'] == 1
+        assert summary[('put', 'samples')]['errors'] == 1
+        assert summary[('get', 'samples')]['p50'] == events[0].latency
+
+        text = metrics.prometheus_text()
+        assert 'pyclarity_lims_requests_total{method="get",endpoint="samples",status="200"} 1' in text
+        assert 'pyclarity_lims_request_duration_seconds_count{method="put",endpoint="samples"} 1' in text
+        assert '# TYPE pyclarity_lims_request_duration_seconds summary' in text
+
+    def test_timeout(self):
+        lims = Lims(url, username='test', password='password')
+        metrics = MetricsAggregator()
+        events = []
+        lims.add_request_listener(metrics)
+        lims.add_request_listener(events.append)
+        with patch('requests.Session.get', side_effect=ReadTimeout('read timed out')):
+            self.assertRaises(ReadTimeout, lims.get, url + '/api/v2/samples/s1')
+        assert [(e.method, e.endpoint, e.status) for e in events] == [('get', 'samples', None)]
+        assert isinstance(events[0].error, ReadTimeout)
+        assert metrics.summary()[('get', 'samples')]['errors'] == 1
+        # The uri is not left in flight
+        assert lims._in_flight == {}
+
+    def test_failing_listener(self):
+        lims = Lims(url, username='test', password='password')
+        lims.add_request_listener(Mock(side_effect=ValueError('listener error')))
+        with patch('requests.Session.get', return_value=Mock(content=sample_xml, status_code=200)):
+            assert lims.get(url + '/api/v2/samples/s1') is not None
+
+    def test_opentelemetry_exporter(self):
+        with patch('pyclarity_lims.instrumentation.trace', None):
+            self.assertRaises(ImportError, OpenTelemetryExporter)
+        tracer = Mock()
+        with patch('pyclarity_lims.instrumentation.trace', Mock()):
+            exporter = OpenTelemetryExporter(tracer=tracer)
+        exporter(RequestEvent('get', 'samples', url + '/api/v2/samples/s1', 200, 10, 0.5, 0, 100, 0.25))
+        name = tracer.start_span.call_args[0][0]
+        assert name == 'LIMS GET samples'
+        assert tracer.start_span.call_args[1]['start_time'] == 10 * 10 ** 9
+        assert tracer.start_span.call_args[1]['attributes']['http.status_code'] == 200
+        tracer.start_span.return_value.end.assert_called_once_with(end_time=int(10.75 * 10 ** 9))
@@ -1,8 +1,17 @@
+import gc
+import pickle
+import weakref
+from threading import Event, Thread, Timer, current_thread
+from time import sleep
 from unittest import TestCase
+from xml.etree import ElementTree
 
+from requests import Session
 from requests.exceptions import HTTPError
 
-from pyclarity_lims.lims import Lims
+from pyclarity_lims.cache import EntityCache
+from pyclarity_lims.entities import Artifact, Sample, Process, Step, Container, Project
+from pyclarity_lims.lims import Lims, BatchChunkResult, BatchError, MissingInstancesError
 try:
     callable(1)
 except NameError: # callable() doesn't exist in Python 3.0 and 3.1
@@ -65,23 +74,105 @@ class TestLims(TestCase):
         mocked_instance.assert_called_with('http://testgenologics.com:4040/api/v2/artifacts?sample_name=test_sample', timeout=16,
                                   headers={'accept': 'application/xml'}, params={}, auth=('test', 'password'))
 
+    def test_get_single_flight(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
+        release = Event()
+
+        def slow_get(*args, **kwargs):
+            release.wait(5)
+            return Mock(content=self.sample_xml, status_code=200)
+
+        with patch('requests.Session.get', side_effect=slow_get) as mocked_get:
+            threads = [Thread(target=lambda: roots.append(lims.get(uri))) for _ in range(4)]
+            roots = []
+            for t in threads:
+                t.start()
+            sleep(0.1)
+            release.set()
+            for t in threads:
+                t.join()
+        assert mocked_get.call_count == 1
+        assert len(roots) == 4
+        assert all(r is roots[0] for r in roots)
+        assert lims._in_flight == {}
+
+    def test_get_interrupted(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
+        with patch('requests.Session.get', side_effect=KeyboardInterrupt):
+            self.assertRaises(KeyboardInterrupt, lims.get, uri)
+        assert lims._in_flight == {}
+
+    def test_get_revalidate(self):
+        lims = Lims(self.url, username=self.username, password=self.password, revalidate=True)
+        uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
+        content = self.sample_xml.encode('utf-8')
+        headers = {'ETag': '"v1"', 'Last-Modified': 'Mon, 01 Jan 2018 00:00:00 GMT'}
+        with patch('requests.Session.get', return_value=Mock(content=content, status_code=200, headers=headers)) as mocked_get:
+            root = lims.get(uri)
+            assert 'If-None-Match' not in mocked_get.call_args[1]['headers']
+            # Same content without validators is not parsed again
+            assert lims.get(uri) is root
+            assert mocked_get.call_args[1]['headers']['If-None-Match'] == '"v1"'
+            assert mocked_get.call_args[1]['headers']['If-Modified-Since'] == 'Mon, 01 Jan 2018 00:00:00 GMT'
+
+        with patch('requests.Session.get', return_value=Mock(content=b'', status_code=304, headers={})):
+            assert lims.get(uri) is root
+
+        new_content = content.replace(b'test_sample', b'test_sample2')
+        with patch('requests.Session.get', return_value=Mock(content=new_content, status_code=200, headers={})):
+            new_root = lims.get(uri)
+        assert new_root is not root
+        assert new_root.find('sample').attrib['uri'].endswith('test_sample2')
+
+    def test_revalidate_validators(self):
+        cache = EntityCache(max_entries=2)
+        lims = Lims(self.url, username=self.username, password=self.password, revalidate=True, cache=cache)
+        content = self.sample_xml.encode('utf-8')
+        with patch('requests.Session.get', return_value=Mock(content=content, status_code=200, headers={})):
+            for i in range(10):
+                Sample(lims, id='s%s' % i).get()
+        gc.collect()
+        # The validators of the evicted instances are removed with their root
+        assert len(lims._validators) == 2
+
+    def test_revalidate_modified(self):
+        cache = EntityCache(max_entries=2)
+        lims = Lims(self.url, username=self.username, password=self.password, revalidate=True, cache=cache)
+        content = self.sample_xml.encode('utf-8')
+        sample = Sample(lims, id='test_sample')
+        with patch('requests.Session.get', return_value=Mock(content=content, status_code=200, headers={})):
+            sample.get()
+            sample.name = 'new name'
+            # Same digest: the root is reused and keeps the local modification
+            sample.get(force=True)
+        assert sample.name == 'new name'
+        with patch('requests.Session.get', return_value=Mock(content=b'', status_code=304, headers={})):
+            sample.get(force=True)
+        assert sample.name == 'new name'
+        assert sample.uri in cache._modified
+        for i in range(5):
+            Sample(lims, id='s%s' % i).root = ElementTree.Element('sample')
+        assert cache.get(sample.uri) is sample
+
     def test_put(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
-        with patch('requests.put', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
+        with patch('requests.Session.put', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
             response = lims.put(uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
-        with patch('requests.put', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
+        with patch('requests.Session.put', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
             self.assertRaises(HTTPError, lims.put, uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
 
     def test_post(self):
         lims = Lims(self.url, username=self.username, password=self.password)
         uri = '{url}/api/v2/samples'.format(url=self.url)
-        with patch('requests.post', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
+        with patch('requests.Session.post', return_value=Mock(content = self.sample_xml, status_code=200)) as mocked_put:
             response = lims.post(uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
-        with patch('requests.post', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
+        with patch('requests.Session.post', return_value=Mock(content = self.error_xml, status_code=400)) as mocked_put:
             self.assertRaises(HTTPError, lims.post, uri=uri, data=self.sample_xml)
             assert mocked_put.call_count == 1
 
@@ -98,7 +189,7 @@ class TestLims(TestCase):
         file_end = """</file:file>"""
         glsstorage_xml = '\n'.join([xml_intro,file_start, attached, upload, content_loc, file_end]).format(url=self.url)
         file_post_xml = '\n'.join([xml_intro, file_start2, attached, upload, content_loc, file_end]).format(url=self.url)
-        with patch('requests.post', side_effect=[Mock(content=glsstorage_xml, status_code=200),
+        with patch('requests.Session.post', side_effect=[Mock(content=glsstorage_xml, status_code=200),
                                                  Mock(content=file_post_xml, status_code=200),
                                                  Mock(content="", status_code=200)]):
 
@@ -106,14 +197,14 @@ class TestLims(TestCase):
                                         'filename_to_upload')
             assert file.id == "40-3501"
 
-        with patch('requests.post', side_effect=[Mock(content=self.error_xml, status_code=400)]):
+        with patch('requests.Session.post', side_effect=[Mock(content=self.error_xml, status_code=400)]):
 
           self.assertRaises(HTTPError,
                             lims.upload_new_file,
                             Mock(uri=self.url+"/api/v2/samples/test_sample"),
                             'filename_to_upload')
 
-    @patch('requests.post', return_value=Mock(content = sample_xml, status_code=200))
+    @patch('requests.Session.post', return_value=Mock(content = sample_xml, status_code=200))
     def test_route_artifact(self, mocked_post):
         lims = Lims(self.url, username=self.username, password=self.password)
         artifact = Mock(uri=self.url+"/artifact/2")
@@ -146,3 +237,501 @@ class TestLims(TestCase):
         assert lims.get_file_contents(id='an_id', encoding='utf-16', crlf=True) == 'some data\n'
         assert lims.request_session.get.return_value.encoding == 'utf-16'
         lims.request_session.get.assert_called_with(exp_url, auth=(self.username, self.password), timeout=16)
+
+    def test_transport(self):
+        lims = Lims('https://testgenologics.com:4040', username=self.username, password=self.password)
+        assert lims.request_session.get_adapter('https://testgenologics.com') is lims.adapter
+        assert lims.request_session.get_adapter('http://testgenologics.com') is lims.adapter
+
+        session = Mock(put=Mock(return_value=Mock(content=self.sample_xml, status_code=200)),
+                       post=Mock(return_value=Mock(content=self.sample_xml, status_code=200)))
+        lims = Lims(self.url, username=self.username, password=self.password, session=session)
+        assert lims.adapter is None
+        uri = '{url}/api/v2/samples/test_sample'.format(url=self.url)
+        lims.put(uri=uri, data=self.sample_xml)
+        lims.post(uri=uri, data=self.sample_xml)
+        lims.route_artifacts(artifact_list=[Mock(uri=uri)], stage_uri=uri)
+        assert session.put.call_count == 1
+        assert session.post.call_count == 2
+        assert session.post.call_args[1]['auth'] == (self.username, self.password)
+
+    def _paged_samples(self, nb_samples, page_size):
+        page_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<smp:samples xmlns:smp="http://genologics.com/ri/sample">
+{samples}
+{next_page}
+</smp:samples>"""
+
+        def get_page(uri, params=None, **kwargs):
+            start = int(dict(params or {}).get('start-index', uri.partition('start-index=')[2] or 0))
+            samples = ''.join('<sample uri="{url}/api/v2/samples/s{i}" limsid="s{i}"/>'.format(url=self.url, i=i)
+                              for i in range(start, min(start + page_size, nb_samples)))
+            next_page = ''
+            if start + page_size < nb_samples:
+                next_page = '<next-page uri="{url}/api/v2/samples?start-index={i}"/>'.format(
+                    url=self.url, i=start + page_size)
+            return Mock(content=page_xml.format(samples=samples, next_page=next_page), status_code=200)
+        return get_page
+
+    def test_get_instances_pages(self):
+        for parallel_pages in (False, True):
+            lims = Lims(self.url, username=self.username, password=self.password,
+                        parallel_pages=parallel_pages, max_workers=3)
+            with patch('requests.Session.get', side_effect=self._paged_samples(11, 2)) as mocked_get:
+                samples = lims.get_samples()
+                assert [s.id for s in samples] == ['s%s' % i for i in range(11)]
+                assert lims.get_sample_number() == 11
+            with patch('requests.Session.get', side_effect=self._paged_samples(11, 2)) as mocked_get:
+                assert [s.id for s in lims.get_samples(start_index=4)] == ['s4', 's5']
+                assert mocked_get.call_count == 1
+
+    def test_parallel_pages_requests(self):
+        lims = Lims(self.url, username=self.username, password=self.password, parallel_pages=True, max_workers=8)
+        # 1 page then groups of 1, 2 and 4 pages
+        for nb_pages, nb_requests in ((1, 1), (2, 2), (3, 4), (4, 4), (5, 8), (8, 8)):
+            with patch('requests.Session.get', side_effect=self._paged_samples(nb_pages * 2, 2)) as mocked_get:
+                assert len(lims.get_samples()) == nb_pages * 2
+                assert mocked_get.call_count == nb_requests
+
+    def test_iter_samples(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        with patch('requests.Session.get', side_effect=self._paged_samples(5, 2)) as mocked_get:
+            iterator = lims.iter_samples(add_info=True)
+            sample, info = next(iterator)
+            assert sample.id == 's0'
+            assert info == {'uri': self.url + '/api/v2/samples/s0', 'limsid': 's0'}
+            # Only the first page and the prefetched second page have been retrieved
+            assert mocked_get.call_count <= 2
+            assert [s.id for s, info in iterator] == ['s1', 's2', 's3', 's4']
+            assert mocked_get.call_count == 3
+
+    def test_prefetch_siblings(self):
+        lims = Lims(self.url, username=self.username, password=self.password, prefetch_siblings=True)
+        with patch('requests.Session.get', side_effect=self._paged_samples(5, 2)):
+            samples = lims.get_samples()
+        with patch('requests.Session.get') as mocked_get, \
+                patch('requests.Session.post', side_effect=self._batch_retrieve()) as mocked_post:
+            assert samples[2].name == 's2 name'
+            assert [s.name for s in samples] == ['s%s name' % i for i in range(5)]
+            assert mocked_post.call_count == 1
+            assert mocked_get.call_count == 0
+
+        # Disabled by default
+        lims = Lims(self.url, username=self.username, password=self.password)
+        with patch('requests.Session.get', side_effect=self._paged_samples(5, 2)):
+            samples = lims.get_samples()
+            samples[0].get()
+        assert [s.root is not None for s in samples] == [True, False, False, False, False]
+        assert all(s._siblings is None for s in samples)
+
+    def test_prefetch_siblings_memory(self):
+        lims = Lims(self.url, username=self.username, password=self.password, prefetch_siblings=True,
+                    cache=EntityCache(max_entries=10))
+        with patch('requests.Session.get', side_effect=self._paged_samples(5, 2)):
+            samples = lims.get_samples()
+        # A single group for all the pages
+        assert all(s._siblings is samples[0]._siblings for s in samples)
+        sample = samples[0]
+        del samples
+        gc.collect()
+        # Keeping one sample does not keep the others
+        assert sample._siblings.instances == [sample]
+        assert len(lims.cache) == 1
+
+    def _batch_retrieve(self, failing_ids=(), missing_ids=()):
+        details_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<art:details xmlns:art="http://genologics.com/ri/artifact">
+{artifacts}
+</art:details>"""
+        artifact_xml = '<art:artifact uri="{uri}" limsid="{id}"><name>{id} name</name></art:artifact>'
+
+        def post(uri, data, **kwargs):
+            links = ElementTree.fromstring(data)
+            ids = [link.attrib['uri'].split('/')[-1].split('?')[0] for link in links]
+            # The LIMS would return a single state per id
+            assert len(set(ids)) == len(ids)
+            if set(ids) & set(failing_ids):
+                return Mock(content=self.error_xml, status_code=400)
+            artifacts = ''.join(artifact_xml.format(uri=link.attrib['uri'], id=i)
+                                for link, i in zip(links, ids) if i not in missing_ids)
+            return Mock(content=details_xml.format(artifacts=artifacts), status_code=200)
+        return post
+
+    def test_worker_pool(self):
+        lims = Lims(self.url, username=self.username, password=self.password, max_workers=2, session=Session())
+        results = []
+
+        def outer(i):
+            # The nested calls run inline instead of waiting for the two threads of the pool
+            return lims._map_concurrently(lambda j: (i, j, current_thread()), range(3))
+
+        thread = Thread(target=lambda: results.extend(lims._map_concurrently(outer, range(4))))
+        thread.start()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert [[(i, j) for i, j, t in r] for r in results] == [[(i, j) for j in range(3)] for i in range(4)]
+        assert all(len(set(t for i, j, t in r)) == 1 for r in results)
+        pool = lims._pool
+        assert pool._max_workers == 2
+        # The pool is shared by the following calls
+        lims._map_concurrently(str, range(3))
+        assert lims._pool is pool
+        lims.close()
+        assert lims._pool is None
+
+        lims = Lims(self.url, username=self.username, password=self.password)
+        assert lims._get_pool()._max_workers == lims.adapter._pool_maxsize
+        lims.close()
+
+    def test_worker_pool_errors(self):
+        lims = Lims(self.url, username=self.username, password=self.password, max_workers=2)
+        processed = []
+
+        def func(i):
+            processed.append(i)
+            if i % 2:
+                raise ValueError(i)
+
+        with self.assertRaises(ValueError) as cm:
+            lims._map_concurrently(func, range(5))
+        # The first error is raised once all the items are processed
+        assert cm.exception.args == (1,)
+        assert sorted(processed) == list(range(5))
+        lims.close()
+
+    def test_get_batch(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(5)]
+        with patch('requests.Session.post', side_effect=self._batch_retrieve()) as mocked_post:
+            assert sorted(lims.get_batch(artifacts + artifacts[:2]), key=lambda a: a.id) == artifacts
+            assert mocked_post.call_count == 3
+            assert [a.name for a in artifacts] == ['a%s name' % i for i in range(5)]
+            # Already retrieved
+            lims.get_batch(artifacts)
+            assert mocked_post.call_count == 3
+
+    def test_get_batch_in_flight(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        a1, a2 = Artifact(lims, id='a1'), Artifact(lims, id='a2')
+        # Another thread is retrieving a1
+        started, pending = lims._start_flights([a1.uri])
+        root = ElementTree.fromstring('<art:artifact xmlns:art="http://genologics.com/ri/artifact" limsid="a1"/>')
+        Timer(0.1, lims._end_flight, args=(a1.uri, started[a1.uri], root)).start()
+        with patch('requests.Session.post', side_effect=self._batch_retrieve()) as mocked_post:
+            lims.get_batch([a1, a2])
+        assert mocked_post.call_count == 1
+        assert [l.attrib['uri'] for l in ElementTree.fromstring(mocked_post.call_args[1]['data'])] == [a2.uri]
+        assert a1.root is root
+        assert a2.root is not None
+        assert lims._in_flight == {}
+
+    def test_pickle(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        a1, a2 = Artifact(lims, id='a1'), Artifact(lims, id='a2')
+        a1.root = ElementTree.fromstring('<art:artifact xmlns:art="http://genologics.com/ri/artifact"><name>a1 name</name></art:artifact>')
+        data = pickle.dumps([a1, a2])
+        # Unpickled in the same process: same Lims and instances
+        assert pickle.loads(data) == [a1, a2]
+        assert pickle.loads(data)[0] is a1
+
+        assert self.password.encode() not in data
+
+        # Simulate another process
+        with patch.dict('pyclarity_lims.lims._lims_registry', clear=True):
+            self.assertRaises(pickle.UnpicklingError, pickle.loads, data)
+            other_lims = Lims(self.url, username=self.username, password=self.password)
+            with patch('requests.Session.get') as mocked_get:
+                b1, b2 = pickle.loads(data)
+                assert b1.lims is b2.lims
+                assert b1.lims is other_lims
+                assert b1.name == 'a1 name'
+                assert b2.root is None
+                assert mocked_get.call_count == 0
+
+    def test_pickle_does_not_keep_lims(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        pickle.dumps(Artifact(lims, id='a1'))
+        lims_ref = weakref.ref(lims)
+        del lims
+        gc.collect()
+        assert lims_ref() is None
+
+    def test_export_entities(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(3)]
+        with patch('requests.Session.post', side_effect=self._batch_retrieve()) as mocked_post:
+            data = lims.export_entities(artifacts)
+            assert mocked_post.call_count == 1
+        other_lims = Lims(self.url, username=self.username, password=self.password)
+        with patch.dict('pyclarity_lims.lims._lims_registry', clear=True):
+            imported = Lims.import_entities(data, lims=other_lims)
+        assert imported[0].lims is other_lims
+        assert [a.uri for a in imported] == [a.uri for a in artifacts]
+        assert [a.name for a in imported] == ['a0 name', 'a1 name', 'a2 name']
+
+    def test_prefetch(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifact_xml = """<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="{url}/api/v2/artifacts/{id}" limsid="{id}">
+<location><container uri="{url}/api/v2/containers/c1" limsid="c1"/><value>A:1</value></location>
+<sample uri="{url}/api/v2/samples/s{id}" limsid="s{id}"/>
+</art:artifact>"""
+        sample_xml = """<smp:sample xmlns:smp="http://genologics.com/ri/sample" uri="{url}/api/v2/samples/{id}" limsid="{id}">
+<project uri="{url}/api/v2/projects/p1" limsid="p1"/>
+</smp:sample>"""
+        container_xml = '<con:container xmlns:con="http://genologics.com/ri/container" uri="{url}/api/v2/containers/{id}" limsid="{id}"/>'
+        templates = dict(artifacts=artifact_xml, samples=sample_xml, containers=container_xml)
+
+        def post(uri, data, **kwargs):
+            template = templates[uri.split('/')[-3]]
+            ids = [link.attrib['uri'].split('/')[-1] for link in ElementTree.fromstring(data)]
+            content = '<ri:details xmlns:ri="http://genologics.com/ri">%s</ri:details>' % ''.join(
+                template.format(url=self.url, id=i) for i in ids
+            )
+            return Mock(content=content, status_code=200)
+
+        project_xml = '<prj:project xmlns:prj="http://genologics.com/ri/project"><name>p1 name</name></prj:project>'
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(3)]
+        with patch('requests.Session.post', side_effect=post) as mocked_post, \
+                patch('requests.Session.get', return_value=Mock(content=project_xml, status_code=200)) as mocked_get:
+            assert lims.prefetch(artifacts, 'samples.project', 'location') == artifacts
+            # artifacts, then samples and container, then project
+            endpoints = [c[0][0].split('/')[-3] for c in mocked_post.call_args_list]
+            assert endpoints[0] == 'artifacts'
+            assert sorted(endpoints[1:]) == ['containers', 'samples']
+            assert mocked_get.call_count == 1
+            assert artifacts[2].samples[0].project.name == 'p1 name'
+            assert artifacts[0].location[0].root is not None
+            assert mocked_post.call_count == 3
+            assert mocked_get.call_count == 1
+
+    def test_prefetch_input_output_maps(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        process = Process(lims, id='p1')
+        process.root = ElementTree.fromstring("""<prc:process xmlns:prc="http://genologics.com/ri/process">
+<input-output-map>
+<input uri="{url}/api/v2/artifacts/a1?state=1" post-process-uri="{url}/api/v2/artifacts/a1?state=2" limsid="a1"/>
+<output uri="{url}/api/v2/artifacts/o1?state=3" output-type="Analyte" limsid="o1"/>
+</input-output-map>
+<input-output-map>
+<input uri="{url}/api/v2/artifacts/a2?state=4" post-process-uri="{url}/api/v2/artifacts/a2?state=5" limsid="a2"/>
+<output uri="{url}/api/v2/artifacts/o2?state=6" output-type="Analyte" limsid="o2"/>
+</input-output-map>
+</prc:process>""".format(url=self.url))
+        with patch('requests.Session.post', side_effect=self._batch_retrieve()) as mocked_post:
+            lims.prefetch([process], 'input_output_maps')
+        # The two states of the inputs are retrieved in separate queries
+        assert mocked_post.call_count == 2
+        assert sorted(l.attrib['uri'].split('/')[-1] for call in mocked_post.call_args_list
+                      for l in ElementTree.fromstring(call[1]['data'])) \
+            == ['a1?state=1', 'a1?state=2', 'a2?state=4', 'a2?state=5', 'o1?state=3', 'o2?state=6']
+        artifacts = [io[0][key] for io in process.input_output_maps for key in ('uri', 'post-process-uri')] + \
+            [io[1]['uri'] for io in process.input_output_maps]
+        assert len(set(artifacts)) == 6
+        # Every instance got the content of its own state
+        assert all(a.root is not None and a.root.attrib['uri'] == a.uri for a in artifacts)
+
+    def test_get_batch_states(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = [Artifact(lims, uri='%s/api/v2/artifacts/a1?state=%s' % (self.url, i)) for i in range(3)]
+        artifacts.append(Artifact(lims, id='a2'))
+        with patch('requests.Session.post', side_effect=self._batch_retrieve()) as mocked_post:
+            assert lims.get_batch(artifacts + artifacts[:1]) == artifacts
+            assert mocked_post.call_count == 3
+        assert all(a.root.attrib['uri'] == a.uri for a in artifacts)
+
+    def test_get_batch_partial_failure(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(5)]
+        with patch('requests.Session.post', side_effect=self._batch_retrieve(failing_ids=['a2'])):
+            with self.assertRaises(BatchError) as cm:
+                lims.get_batch(artifacts)
+        assert len(cm.exception.results) == 3
+        assert cm.exception.failed_instances == artifacts[2:4]
+        assert [a.root is not None for a in artifacts] == [True, True, False, False, True]
+
+    def test_get_batch_missing(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        a1, a2 = Artifact(lims, id='a1'), Artifact(lims, id='a2')
+        flights = {}
+        retrieve = self._batch_retrieve(missing_ids=['a1'])
+
+        def post(uri, data, **kwargs):
+            flights.update(lims._in_flight)
+            return retrieve(uri, data, **kwargs)
+
+        with patch('requests.Session.post', side_effect=post):
+            with self.assertRaises(BatchError) as cm:
+                lims.get_batch([a1, a2])
+        assert cm.exception.failed_instances == [a1]
+        assert a1.root is None and a2.root is not None
+        # Threads waiting for a1 get the error instead of None
+        assert isinstance(flights[a1.uri].exception(), MissingInstancesError)
+        assert flights[a2.uri].result() is a2.root
+        assert lims._in_flight == {}
+
+    def test_get_batch_interrupted(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=1, max_workers=1)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(3)]
+        with patch('requests.Session.post', side_effect=KeyboardInterrupt):
+            self.assertRaises(KeyboardInterrupt, lims.get_batch, artifacts)
+        assert lims._in_flight == {}
+
+    def test_get_batch_mixed_classes(self):
+        lims = Lims(self.url, username=self.username, password=self.password)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(2)]
+        samples = [Sample(lims, id='s%s' % i) for i in range(2)]
+        process = Process(lims, id='p1')
+        step = Step(lims, id='p1')
+        with patch('requests.Session.post', side_effect=self._batch_retrieve()) as mocked_post, \
+                patch('requests.Session.get', return_value=Mock(content=self.sample_xml, status_code=200)) as mocked_get:
+            instances = lims.get_batch([artifacts[0], samples[0], process, artifacts[1], samples[1], step])
+            assert instances == artifacts + [samples[0], samples[1], process, step]
+            assert sorted(c[0][0] for c in mocked_post.call_args_list) == [
+                self.url + '/api/v2/artifacts/batch/retrieve',
+                self.url + '/api/v2/samples/batch/retrieve'
+            ]
+            assert sorted(c[0][0] for c in mocked_get.call_args_list) == [
+                self.url + '/api/v2/processes/p1',
+                self.url + '/api/v2/steps/p1'
+            ]
+            assert all(i.root is not None for i in instances)
+
+    def test_put_batch(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(5)]
+        for a in artifacts:
+            a.root = ElementTree.fromstring(
+                '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s"><name>%s</name></art:artifact>'
+                % (a.uri, a.id)
+            )
+        links_xml = '<ri:links xmlns:ri="http://genologics.com/ri">%s</ri:links>'
+
+        def post(uri, data, **kwargs):
+            details = ElementTree.fromstring(data)
+            assert details.tag == '{http://genologics.com/ri/artifact}details'
+            if 'a4' in data.decode('utf-8'):
+                return Mock(content=self.error_xml, status_code=400)
+            # a1 is not acknowledged by the LIMS
+            links = ''.join('<link uri="%s?state=1" rel="artifacts"/>' % a.attrib['uri']
+                            for a in details if not a.attrib['uri'].endswith('a1'))
+            return Mock(content=links_xml % links, status_code=200)
+
+        with patch('requests.Session.post', side_effect=post) as mocked_post:
+            results = lims.put_batch(artifacts[2:4])
+            assert mocked_post.call_count == 1
+        assert [r.instances for r in results] == [artifacts[2:4]]
+        assert all(r.error is None for r in results)
+
+        # a1 is reported as failed and keeps its modifications
+        with patch('requests.Session.post', side_effect=post) as mocked_post:
+            with self.assertRaises(BatchError) as cm:
+                lims.put_batch(artifacts[:4])
+            assert mocked_post.call_count == 2
+        assert [r.instances for r in cm.exception.results] == [artifacts[:2], artifacts[2:4]]
+        assert [r.error is None for r in cm.exception.results] == [False, True]
+        assert isinstance(cm.exception.results[0].error, MissingInstancesError)
+        assert cm.exception.failed_instances == [artifacts[1]]
+        assert all(a.root is not None for a in artifacts[:4])
+
+        with patch('requests.Session.post', side_effect=post) as mocked_post:
+            with self.assertRaises(BatchError) as cm:
+                lims.put_batch(artifacts[2:])
+        assert [r.error is None for r in cm.exception.results] == [True, False]
+        assert cm.exception.failed_instances == [artifacts[4]]
+        assert artifacts[4].root is not None
+
+    def test_put_batch_refresh(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(5)]
+        for a in artifacts:
+            a.root = ElementTree.fromstring(
+                '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s"><name>%s</name></art:artifact>'
+                % (a.uri, a.id)
+            )
+        retrieve = self._batch_retrieve(failing_ids=['a2'], missing_ids=['a4'])
+
+        def post(uri, data, **kwargs):
+            if uri.endswith('batch/retrieve'):
+                return retrieve(uri, data, **kwargs)
+            details = ElementTree.fromstring(data)
+            if 'a0' in data.decode('utf-8'):
+                return Mock(content=self.error_xml, status_code=400)
+            links = ''.join('<link uri="%s" rel="artifacts"/>' % a.attrib['uri'] for a in details)
+            return Mock(content='<ri:links xmlns:ri="http://genologics.com/ri">%s</ri:links>' % links, status_code=200)
+
+        with patch('requests.Session.post', side_effect=post) as mocked_post:
+            with self.assertRaises(BatchError) as cm:
+                lims.put_batch(artifacts, refresh=True)
+            # The chunk whose update failed is not retrieved again
+            assert [c[0][0].split('/')[-1] for c in mocked_post.call_args_list].count('retrieve') == 2
+        results = cm.exception.results
+        assert [r.error is None for r in results] == [False, True, True]
+        assert [r.refresh_error is None for r in results] == [True, False, False]
+        # Only the failed update is reported as failed: the other instances were saved
+        assert cm.exception.failed_instances == artifacts[:2]
+        assert cm.exception.refresh_failed_instances == artifacts[2:]
+        assert [a.name for a in artifacts] == ['a0', 'a1', 'a2', 'a3', 'a4']
+
+        with patch('requests.Session.post', side_effect=post):
+            results = lims.put_batch(artifacts[1:2], refresh=True)
+        assert results == [BatchChunkResult(artifacts[1:2], None, None)]
+        assert artifacts[1].name == 'a1 name'
+
+    def test_put_batch_cache(self):
+        cache = EntityCache(max_entries=2)
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2, cache=cache)
+        artifacts = [Artifact(lims, id='a%s' % i) for i in range(5)]
+        for a in artifacts:
+            a.root = ElementTree.fromstring(
+                '<art:artifact xmlns:art="http://genologics.com/ri/artifact" uri="%s"><name>%s</name></art:artifact>'
+                % (a.uri, a.id)
+            )
+            a.name = 'new ' + a.id
+        # The modified instances are kept
+        assert cache.stats()['entries'] == 5
+
+        def post(uri, data, **kwargs):
+            links = ''.join('<link uri="%s" rel="artifacts"/>' % a.attrib['uri'] for a in ElementTree.fromstring(data))
+            return Mock(content='<ri:links xmlns:ri="http://genologics.com/ri">%s</ri:links>' % links, status_code=200)
+
+        with patch('requests.Session.post', side_effect=post):
+            lims.put_batch(artifacts)
+        # Once saved they can be evicted again
+        assert cache._modified == set()
+        assert cache.stats()['entries'] == 2
+
+    def test_create_batch(self):
+        lims = Lims(self.url, username=self.username, password=self.password, batch_size=2)
+        container = Container(lims, id='c1')
+        project = Project(lims, id='p1')
+        specs = [dict(name='s%s' % i, project=project, container=container, position='%s:1' % i) for i in range(3)]
+        links_xml = '<ri:links xmlns:ri="http://genologics.com/ri">%s</ri:links>'
+
+        def post(uri, data, **kwargs):
+            assert uri == self.url + '/api/v2/samples/batch/create'
+            details = ElementTree.fromstring(data)
+            assert details.tag == '{http://genologics.com/ri/sample}details'
+            links = ''.join('<link uri="%s/api/v2/samples/%s" rel="samples"/>' % (self.url, s.find('name').text)
+                            for s in details)
+            return Mock(content=links_xml % links, status_code=201)
+
+        with patch('requests.Session.post', side_effect=post) as mocked_post:
+            samples = lims.create_batch(Sample, specs)
+            assert mocked_post.call_count == 2
+            data = ElementTree.fromstring(mocked_post.call_args_list[0][1]['data'])
+            location = data[0].find('location')
+            assert location.find('container').attrib['uri'] == container.uri
+        assert samples == [Sample(lims, id='s0'), Sample(lims, id='s1'), Sample(lims, id='s2')]
+        self.assertRaises(TypeError, lims.create_batch, Artifact, [{}])
+
+        def post_missing_link(uri, data, **kwargs):
+            names = [s.find('name').text for s in ElementTree.fromstring(data) if s.find('name').text != 's1']
+            links = ''.join('<link uri="%s/api/v2/samples/%s" rel="samples"/>' % (self.url, n) for n in names)
+            return Mock(content=links_xml % links, status_code=201)
+
+        with patch('requests.Session.post', side_effect=post_missing_link):
+            with self.assertRaises(BatchError) as cm:
+                lims.create_batch(Sample, specs)
+        assert [r.error is None for r in cm.exception.results] == [False, True]
+        assert isinstance(cm.exception.results[0].error, HTTPError)
+        assert [s.name for s in cm.exception.failed_instances] == ['s0', 's1']
@@ -0,0 +1,76 @@
+from unittest import TestCase
+
+from pyclarity_lims.entities import Containertype
+from pyclarity_lims.lims import Lims
+from pyclarity_lims.plate import PlateGeometry, to_quadrant, from_quadrants
+
+try:
+    from mock import patch, Mock
+except ImportError:
+    from unittest.mock import patch, Mock
+
+url = 'http://testgenologics.com:4040'
+
+containertype_xml = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<ctp:container-type xmlns:ctp="http://genologics.com/ri/containertype" uri="{url}/api/v2/containertypes/1" name="96 well plate">
+<is-tube>false</is-tube>
+<unavailable-well>H:12</unavailable-well>
+<x-dimension><is-alpha>false</is-alpha><offset>1</offset><size>12</size></x-dimension>
+<y-dimension><is-alpha>true</is-alpha><offset>0</offset><size>8</size></y-dimension>
+</ctp:container-type>""".format(url=url)
+
+
+def plate(rows, columns):
+    return PlateGeometry(dict(is_alpha=False, offset=1, size=columns), dict(is_alpha=True, offset=0, size=rows))
+
+
+class TestPlateGeometry(TestCase):
+
+    def setUp(self):
+        self.plate96 = plate(8, 12)
+        self.plate384 = plate(16, 24)
+
+    def test_from_containertype(self):
+        lims = Lims(url, username='test', password='password')
+        with patch('requests.Session.get', return_value=Mock(content=containertype_xml, status_code=200)):
+            geometry = Containertype(lims, id='1').geometry
+        assert geometry == self.plate96
+        assert geometry.size == 96
+        assert geometry.unavailable_wells == {'H:12'}
+        assert len(geometry.wells(available_only=True)) == 95
+
+    def test_wells(self):
+        assert self.plate96.rows == list('ABCDEFGH')
+        assert self.plate96.columns[-1] == '12'
+        assert self.plate96.wells()[:3] == ['A:1', 'A:2', 'A:3']
+        assert self.plate96.wells(order='column')[:3] == ['A:1', 'B:1', 'C:1']
+        assert plate(30, 1).rows[-4:] == ['AA', 'AB', 'AC', 'AD']
+        self.assertRaises(ValueError, self.plate96.wells, order='diagonal')
+
+    def test_indices(self):
+        assert self.plate96.indices(['A:1', 'A:2', 'B:1', 'H:12']) == [0, 1, 12, 95]
+        assert self.plate96.indices(['A:1', 'A:2', 'B:1', 'H:12'], order='column') == [0, 8, 1, 95]
+        assert self.plate96.labels([0, 1, 12, 95]) == ['A:1', 'A:2', 'B:1', 'H:12']
+        assert self.plate96.labels([0, 8, 1, 95], order='column') == ['A:1', 'A:2', 'B:1', 'H:12']
+        assert self.plate96.convert([1, 12], 'row', 'column') == [8, 1]
+        assert self.plate96.sort(['B:1', 'A:2', 'A:1'], order='column') == ['A:1', 'B:1', 'A:2']
+        assert self.plate96.position('B:3') == (1, 2)
+        assert self.plate96.label(1, 2) == 'B:3'
+        self.assertRaises(ValueError, self.plate96.indices, ['I:1'])
+        self.assertRaises(IndexError, self.plate96.labels, [96])
+        self.assertRaises(IndexError, self.plate96.labels, [-1])
+
+    def test_quadrants(self):
+        assert to_quadrant(['A:1', 'A:2', 'B:1'], 1, self.plate96, self.plate384) == ['A:1', 'A:3', 'C:1']
+        assert to_quadrant(['A:1', 'H:12'], 2, self.plate96, self.plate384) == ['A:2', 'O:24']
+        assert to_quadrant(['A:1'], 3, self.plate96, self.plate384) == ['B:1']
+        assert to_quadrant(['H:12'], 4, self.plate96, self.plate384) == ['P:24']
+        assert from_quadrants(['A:1', 'A:2', 'B:1', 'P:24'], self.plate96, self.plate384) == [
+            (1, 'A:1'), (2, 'A:1'), (3, 'A:1'), (4, 'H:12')
+        ]
+        wells384 = []
+        for quadrant in range(1, 5):
+            wells384.extend(to_quadrant(self.plate96.wells(), quadrant, self.plate96, self.plate384))
+        assert sorted(wells384) == sorted(self.plate384.wells())
+        self.assertRaises(ValueError, to_quadrant, ['A:1'], 5, self.plate96, self.plate384)
+        self.assertRaises(ValueError, to_quadrant, ['A:1'], 1, self.plate96, self.plate96)